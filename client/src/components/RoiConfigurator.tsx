@@ -34,6 +34,25 @@ export function RoiConfigurator() {
       setRatiosString(laneRatios.join(', '));
   }, [laneRatios]);
 
+  // Progress of the running scan, polled from the server
+  const [progress, setProgress] = useState<{ done: number, total: number | null, rate: number, etaS: number | null } | null>(null);
+  useEffect(() => {
+    if (!isProcessing || !videoFilename) {
+      setProgress(null);
+      return;
+    }
+    const timer = setInterval(async () => {
+      try {
+        const res = await fetch(`/api/progress/${encodeURIComponent(videoFilename)}`);
+        const data = await res.json();
+        if (data.status === 'running' && data.stage === 'scan') setProgress(data);
+      } catch (e) {
+        // The next poll will try again
+      }
+    }, 500);
+    return () => clearInterval(timer);
+  }, [isProcessing, videoFilename]);
+
   // Calibration Modal State
   const [calibrationOpened, setCalibrationOpened] = useState(false);
   const [laneConfigOpened, setLaneConfigOpened] = useState(false);
@@ -416,6 +435,13 @@ export function RoiConfigurator() {
           {isProcessing ? <Loader size="xs" mr="xs" /> : null}
           Generate Waterfall Chart
         </Button>
+        {progress && (
+          <Text size="xs" c="dimmed" mt={4}>
+            {progress.total ? `${Math.min(100, Math.round(100 * progress.done / progress.total))}% · ` : ''}
+            {progress.done}{progress.total ? ` / ${progress.total}` : ''} frames · {progress.rate.toFixed(0)} fps
+            {progress.etaS !== null ? ` · ${Math.ceil(progress.etaS)}s left` : ''}
+          </Text>
+        )}
       </Paper>
 
       <SpeedCalibrator opened={calibrationOpened} onClose={() => setCalibrationOpened(false)} />
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useAtom } from 'jotai';
 import { processingResultAtom, videoFilenameAtom, laneRatiosAtom } from '../store';
 import { Image, Paper, Text, Button, Group, Slider, Box, Loader, ActionIcon, Tooltip, NumberInput, Popover } from '@mantine/core';
@@ -33,6 +33,8 @@ export function WaterfallViewer() {
   const [zoom, setZoom] = useState(50);
   const [editorOpened, setEditorOpened] = useState(false);
   const [metadata, setMetadata] = useState<any>(null);
+  const scrollRef = useRef<HTMLDivElement>(null);
+  const [viewWidth, setViewWidth] = useState(0);
 
   useEffect(() => {
       if (result && result.outputDir) {
@@ -43,8 +45,23 @@ export function WaterfallViewer() {
       }
   }, [result]);
 
+  // Track the chart area's width, to pick the pyramid level that matches the zoom
+  useEffect(() => {
+      const el = scrollRef.current;
+      if (!el) return;
+      const observer = new ResizeObserver(() => setViewWidth(el.clientWidth));
+      observer.observe(el);
+      return () => observer.disconnect();
+  }, [result]);
+
   if (!result) return null;
 
+  // Smallest pyramid level that still has a pixel for every screen pixel at this zoom
+  const levels = result.levels ?? [];
+  const displayWidth = viewWidth * (zoom / 100) * (window.devicePixelRatio || 1);
+  const level = viewWidth > 0 ? ([...levels].reverse().find(l => l.width >= displayWidth) ?? levels[0]) : levels[0];
+  const imageDir = level?.dir ?? result.previewDir ?? result.outputDir;
+
   const handleDetect = async () => {
     if (!videoFilename) return;
     setDetecting(true);
@@ -307,7 +324,7 @@ export function WaterfallViewer() {
           <span style={{ marginLeft: 20, color: 'gray', fontSize: '0.8em' }}>(Click chart to add/remove notes)</span>
       </Text>
       
-      <div style={{ maxHeight: '70vh', overflowY: 'auto', border: '1px solid #333', borderRadius: 4, padding: 10 }}>
+      <div ref={scrollRef} style={{ maxHeight: '70vh', overflowY: 'auto', border: '1px solid #333', borderRadius: 4, padding: 10 }}>
         <div style={{ display: 'flex', flexDirection: 'column', alignItems: 'center', gap: 0 }}>
             {[...result.chunks].reverse().map((chunk) => {
             // Extract original index from filename "chunk_N.jpg"
@@ -320,7 +337,7 @@ export function WaterfallViewer() {
                     onClick={(e) => handleChunkClick(e, chunkIndex)}
                 >
                     <Image
-                    src={`/workspace/${result.outputDir}/${chunk}?t=${result.timestamp}`}
+                    src={`/workspace/${imageDir}/${chunk}?t=${result.timestamp}`}
                     alt={chunk}
                     w="100%"
                     fit="contain"
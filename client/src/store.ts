@@ -12,7 +12,8 @@ export const scrollSpeedAtom = atomWithStorage<number>('mania2midi_scrollSpeed',
 export const laneRatiosAtom = atomWithStorage<number[]>('mania2midi_laneRatios', [1, 1, 1, 1, 1, 1, 1, 1, 1])
 export const visualOffsetAtom = atomWithStorage<number>('mania2midi_visualOffset', 0)
 export const isProcessingAtom = atom<boolean>(false)
-export const processingResultAtom = atom<{ outputDir: string, chunks: string[], timestamp?: number } | null>(null)
+// levels: the displayed chunks at full size and downsampled (factor 1, 2, 4, ...), widest first
+export const processingResultAtom = atom<{ outputDir: string, previewDir?: string, levels?: { factor: number, dir: string, width: number }[], chunks: string[], timestamp?: number } | null>(null)
 export const lanePresetsAtom = atomWithStorage<Record<string, number[]>>('mania2midi_lanePresets', {
     'drum mania': [13.874028389875152, 9.6173776064337, 9.841927337024476, 11.111111111111114, 10.552164055698931, 11.938813580400442, 9.949011317000355, 9.949011317000384, 13.166555285455445],
     '9k': [1, 1, 1, 1, 1, 1, 1, 1, 1],
@@ -0,0 +1,306 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from frame_index import FrameIndex
+from scan_cache import cache_key, tree_size
+
+# =============================================================================
+# BATCH SLIT-SCAN
+# =============================================================================
+# Scans many videos from one manifest, e.g. to warm a whole workspace
+# overnight. Every job is a normal slit_scan.py run in its own process; at
+# most --jobs of them run at a time, so a fixed number of cores stays busy.
+#
+# MANIFEST (JSON):
+#   {
+#     "defaults": {"speed": 7.3, "chunk_size": 5000},
+#     "jobs": [
+#       {"video": "workspace/a.mp4", "y": 700, "x1": 444, "x2": 1220},
+#       {"video": "workspace/b.mp4", "roi": ["700,444,1220", "650,100,400"], "output": "workspace/output_b"}
+#     ]
+#   }
+# Job keys are slit_scan.py options with underscores ("preview_scale": 0.25,
+# "resume": true). Relative paths are relative to the manifest. Without an
+# "output", a job writes to --output-root/output_<video name>.
+#
+# SKIPPING:
+# Each output directory gets a batch.key file with the key of its video and
+# the manifest options that affect the output (hashed like the slit-scan cache
+# keys, but a separate key: it covers the options as written in the manifest,
+# not slit_scan.py's parsed arguments). A job whose output is complete and
+# has the same key is skipped; one that was interrupted with the same key is
+# resumed from its checkpoint; anything else is cleared and rescanned. A
+# non-empty output that holds no scan (no batch.key and no metadata.json) is
+# never cleared: that job fails instead.
+#
+# REPORT:
+# --report (default batch_report.json next to the manifest) lists every job
+# with its status, time, frames, rows and throughput. Each job's output goes
+# to a log file in --log-dir.
+# =============================================================================
+
+KEY_FILENAME = "batch.key"
+
+# slit_scan.py options that change how a scan runs, not what it produces
+EXECUTION_OPTIONS = {"output", "workers", "prefetch", "writer_threads", "resume", "cache_dir", "cache_quota", "ffmpeg",
+                     "progress", "progress_interval"}
+
+SLIT_SCAN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "slit_scan.py")
+
+def load_manifest(path):
+    """
+    Reads the manifest and returns the jobs with the defaults applied and paths resolved.
+    """
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"jobs": manifest}
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for i, entry in enumerate(manifest.get("jobs", [])):
+        job = dict(manifest.get("defaults", {}))
+        job.update(entry)
+        if "video" not in job:
+            raise ValueError(f"Job {i} has no video")
+        job["video"] = os.path.join(base_dir, job["video"])
+        if "output" in job:
+            job["output"] = os.path.join(base_dir, job["output"])
+        jobs.append(job)
+    return jobs
+
+def job_key(job):
+    """
+    Key of the video and the parameters that affect the output.
+    """
+    params = {name: value for name, value in job.items() if name not in EXECUTION_OPTIONS and name != "video"}
+    return cache_key(job["video"], params)
+
+def slit_scan_args(job):
+    """
+    Command line options for slit_scan.py.
+    """
+    args = []
+    for name, value in sorted(job.items()):
+        option = '--' + name.replace('_', '-')
+        if isinstance(value, bool):
+            if value:
+                args.append(option)
+        elif isinstance(value, list):
+            for item in value:
+                args += [option, str(item)]
+        elif value is not None:
+            args += [option, str(value)]
+    return args
+
+def roi_dirs(output_dir):
+    """
+    Directories holding the scan results: the output itself, or roi_0, roi_1, ... for several ROIs.
+    """
+    if os.path.exists(os.path.join(output_dir, "metadata.json")):
+        return [output_dir]
+    dirs = []
+    while os.path.isdir(os.path.join(output_dir, f"roi_{len(dirs)}")):
+        dirs.append(os.path.join(output_dir, f"roi_{len(dirs)}"))
+    return dirs
+
+def is_scan_output(output_dir):
+    """
+    True if the directory is missing, empty, or holds a scan (a batch.key or metadata.json).
+    Only those are cleared before a scan.
+    """
+    if not os.path.isdir(output_dir) or not os.listdir(output_dir):
+        return not os.path.isfile(output_dir)
+    return os.path.exists(os.path.join(output_dir, KEY_FILENAME)) or len(roi_dirs(output_dir)) > 0
+
+def scan_state(output_dir, key):
+    """
+    'done', 'resumable' (interrupted scan with the same key) or 'new',
+    and the number of frames the scan already covers.
+    """
+    try:
+        with open(os.path.join(output_dir, KEY_FILENAME), 'r') as f:
+            if f.read().strip() != key:
+                return 'new', 0
+        checkpoints = []
+        for path in roi_dirs(output_dir):
+            with open(os.path.join(path, "metadata.json"), 'r') as f:
+                checkpoints.append(json.load(f).get("checkpoint", {}))
+    except (OSError, ValueError):
+        return 'new', 0
+    if not checkpoints:
+        return 'new', 0
+    if all(checkpoint.get("complete") for checkpoint in checkpoints):
+        return 'done', 0
+    if all("resume_frame" in checkpoint for checkpoint in checkpoints):
+        return 'resumable', checkpoints[0]["frames_done"]
+    if all("shards" in checkpoint for checkpoint in checkpoints):
+        # A parallel scan: every shard checkpoints in its own file
+        return 'resumable', shard_frames_done(roi_dirs(output_dir)[0], len(checkpoints[0]["shards"]))
+    return 'new', 0
+
+def shard_frames_done(path, shards):
+    """
+    Frames the shards of an interrupted parallel scan already covered (slit_scan.py's checkpoint_shard_{k}.json).
+    """
+    done = 0
+    for k in range(shards):
+        try:
+            with open(os.path.join(path, f"checkpoint_shard_{k}.json"), 'r') as f:
+                done += json.load(f)["frames_done"]
+        except (OSError, ValueError, KeyError):
+            pass # No checkpoint yet
+    return done
+
+def index_totals(output_dir):
+    """
+    (frames, rows) of a finished output (the first ROI's when there are several).
+    """
+    for path in roi_dirs(output_dir)[:1]:
+        index = FrameIndex.load(path)
+        if index is not None:
+            return index.frame_count, index.row_count
+    return 0, 0
+
+def run_job(job, log_path, python):
+    """
+    Runs (or skips) one job. Returns its report entry.
+    """
+    output_dir = job["output"]
+    entry = {"video": job["video"], "output": output_dir}
+    try:
+        key = job_key(job)
+    except OSError as e:
+        entry["status"] = "failed"
+        entry["error"] = str(e)
+        return entry
+    entry["key"] = key[:12]
+
+    state, frames_done = scan_state(output_dir, key)
+    if state == 'done':
+        entry["status"] = "skipped"
+        entry["frames"], entry["rows"] = index_totals(output_dir)
+        return entry
+
+    options = dict(job)
+    if state == 'resumable':
+        options["resume"] = True
+    else:
+        if not is_scan_output(output_dir):
+            # Never wipe a directory we didn't write (e.g. a mistyped "output")
+            entry["status"] = "failed"
+            entry["error"] = f"{output_dir} is not empty and is not a scan output"
+            return entry
+        # Different parameters: start from scratch
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir)
+        with open(os.path.join(output_dir, KEY_FILENAME), 'w') as f:
+            f.write(key)
+
+    t0 = time.perf_counter()
+    with open(log_path, 'w') as log:
+        code = subprocess.call([python, SLIT_SCAN_PATH] + slit_scan_args(options), stdout=log, stderr=subprocess.STDOUT,
+                               env=dict(os.environ, PYTHONIOENCODING='utf-8'))
+    elapsed = time.perf_counter() - t0
+
+    entry["seconds"] = round(elapsed, 2)
+    entry["log"] = log_path
+    if code != 0:
+        entry["status"] = "failed"
+        entry["exit_code"] = code
+        return entry
+
+    with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+        cached = any(line.startswith("Cache hit") for line in f)
+    entry["status"] = "cached" if cached else ("resumed" if state == 'resumable' else "scanned")
+    entry["frames"], entry["rows"] = index_totals(output_dir)
+    # Throughput of this run only (a resumed scan did part of the work before)
+    entry["frames_scanned"] = 0 if cached else entry["frames"] - frames_done
+    entry["fps"] = round(entry["frames_scanned"] / elapsed, 1) if elapsed > 0 else 0.0
+    entry["bytes"] = tree_size(output_dir)
+    return entry
+
+def main():
+    parser = argparse.ArgumentParser(description='Slit-scan every job of a manifest over a fixed-size process pool')
+    parser.add_argument('manifest', help='JSON manifest of scan jobs')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Scans running at the same time')
+    parser.add_argument('--output-root', type=str, help='Directory for jobs without an "output" (default: next to each video)')
+    parser.add_argument('--log-dir', type=str, help='Directory for per-job logs (default: batch_logs next to the manifest)')
+    parser.add_argument('--report', type=str, help='Summary report (default: batch_report.json next to the manifest)')
+    parser.add_argument('--cache-dir', type=str, help='Slit-scan cache shared by every job')
+    parser.add_argument('--python', default=sys.executable, help='Python interpreter for slit_scan.py')
+
+    args = parser.parse_args()
+
+    try:
+        jobs = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        print(f"Error: Could not read manifest {args.manifest} ({e})")
+        sys.exit(1)
+
+    base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    log_dir = args.log_dir or os.path.join(base_dir, "batch_logs")
+    report_path = args.report or os.path.join(base_dir, "batch_report.json")
+    os.makedirs(log_dir, exist_ok=True)
+
+    for job in jobs:
+        if "output" not in job:
+            root = args.output_root or os.path.dirname(job["video"])
+            job["output"] = os.path.join(root, "output_" + os.path.basename(job["video"]))
+        if args.cache_dir and "cache_dir" not in job:
+            job["cache_dir"] = args.cache_dir
+
+    outputs = [job["output"] for job in jobs]
+    if len(set(outputs)) != len(outputs):
+        print("Error: Several jobs write to the same output directory")
+        sys.exit(1)
+
+    print(f"Running {len(jobs)} jobs, {args.jobs} at a time")
+    t0 = time.perf_counter()
+
+    # Each pool thread only waits for its slit_scan.py process, so --jobs processes do the work
+    def run(i):
+        log_path = os.path.join(log_dir, f"{i:04d}_{os.path.basename(jobs[i]['video'])}.log")
+        entry = run_job(jobs[i], log_path, args.python)
+        rate = f", {entry['fps']} fps" if "fps" in entry else ""
+        if "error" in entry:
+            rate = f" ({entry['error']})"
+        # One write call, so lines from the pool threads do not interleave
+        print(f"[{i + 1}/{len(jobs)}] {entry['status']}: {os.path.basename(entry['video'])} -> {entry['output']}{rate}\n", end='', flush=True)
+        return entry
+
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        entries = list(pool.map(run, range(len(jobs))))
+    elapsed = time.perf_counter() - t0
+
+    counts = {}
+    for entry in entries:
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    scanned_frames = sum(entry.get("frames_scanned", 0) for entry in entries)
+    report = {
+        "jobs": entries,
+        "total": {
+            "seconds": round(elapsed, 2),
+            "statuses": counts,
+            "frames_scanned": scanned_frames,
+            "fps": round(scanned_frames / elapsed, 1) if elapsed > 0 else 0.0
+        }
+    }
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    print(f"Done in {elapsed:.1f}s: {summary}. {scanned_frames} frames scanned ({report['total']['fps']} fps overall)")
+    print(f"Report: {report_path}")
+    if counts.get("failed"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
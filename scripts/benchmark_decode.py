@@ -0,0 +1,85 @@
+import argparse
+import math
+import sys
+import time
+
+import numpy as np
+
+from frame_sources import BACKENDS, open_source, probe_video
+
+# =============================================================================
+# DECODE BENCHMARK
+# =============================================================================
+# Reads the same frame range through every decode backend and reports how fast
+# each one delivers the slit-scan band. No chunks are encoded or written, so
+# this measures decode + crop + copy only.
+#
+# --pixel-formats also compares the BGR path with the luma path (Y plane
+# without colour conversion, slit_scan.py --channels luma; ffmpeg backend only).
+# =============================================================================
+
+def run_backend(backend, args, crop, start_frame, end_frame, luma=False):
+    """
+    Reads the whole range once. Returns (frames, seconds, checksum).
+    """
+    source = open_source(backend, args.video, crop, start_frame, end_frame, ffmpeg=args.ffmpeg, luma=luma)
+    frames = 0
+    checksum = 0
+    t0 = time.perf_counter()
+    while True:
+        band = source.read()
+        if band is None:
+            break
+        # Touch the pixels like the slit-scan does (it copies the strip out)
+        checksum += int(np.sum(band, dtype=np.uint64))
+        frames += 1
+    elapsed = time.perf_counter() - t0
+    source.release()
+    return frames, elapsed, checksum
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare slit-scan decode backends')
+    parser.add_argument('--video', required=True, help='Path to input video file')
+    parser.add_argument('--y', type=int, required=True, help='Y coordinate of the scan line')
+    parser.add_argument('--x1', type=int, required=True, help='Left X coordinate of the track')
+    parser.add_argument('--x2', type=int, required=True, help='Right X coordinate of the track')
+    parser.add_argument('--start', type=float, default=0.0, help='Start time in seconds')
+    parser.add_argument('--end', type=float, default=0.0, help='End time in seconds (0 for end of video)')
+    parser.add_argument('--speed', type=float, default=10.0, help='Scroll speed in pixels per frame (Slit Height)')
+    parser.add_argument('--backends', type=str, default=','.join(BACKENDS), help='Comma-separated backends to run')
+    parser.add_argument('--pixel-formats', type=str, default='bgr', help='Comma-separated pixel formats to run (bgr, luma)')
+    parser.add_argument('--ffmpeg', default='ffmpeg', help='Path to the ffmpeg executable')
+
+    args = parser.parse_args()
+
+    try:
+        fps, width, height, _ = probe_video(args.video)
+    except IOError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    start_frame = int(args.start * fps)
+    end_frame = int(args.end * fps) if args.end > 0 else None
+    crop = (args.x1, args.y, args.x2 - args.x1, max(1, math.ceil(args.speed)))
+
+    print(f"Video: {args.video} ({width}x{height} @ {fps:.2f} fps)")
+    print(f"Band: {crop[2]}x{crop[3]} at ({crop[0]}, {crop[1]})")
+
+    for pixel_format in args.pixel_formats.split(','):
+        results = {}
+        for backend in args.backends.split(','):
+            name = f"{backend}/{pixel_format}"
+            try:
+                frames, elapsed, checksum = run_backend(backend, args, crop, start_frame, end_frame, luma=pixel_format == 'luma')
+            except (IOError, ValueError) as e:
+                print(f"{name:>14}: skipped ({e})")
+                continue
+            results[backend] = checksum
+            rate = frames / elapsed if elapsed > 0 else 0.0
+            print(f"{name:>14}: {frames} frames in {elapsed:.2f}s ({rate:.1f} fps)")
+
+        if len(set(results.values())) > 1:
+            print(f"Warning: backends returned different {pixel_format} pixels (check seeking / colour conversion)")
+
+if __name__ == "__main__":
+    main()
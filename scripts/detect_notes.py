@@ -5,7 +5,433 @@ import os
 import json
 import glob
 import re
-import bisect
+import math
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+
+from frame_index import FrameIndex
+from telemetry import ProgressReporter
+from waterfall_store import chunk_view, load_store
+
+# Bar lines are thin (< BAR_MAX_HEIGHT rows) bright lines across the whole chart.
+# A note within BAR_TOLERANCE rows of one is the bar line itself.
+BAR_MAX_HEIGHT = 10
+BAR_TOLERANCE = 5
+# Bar lines are grey and about as bright as the threshold (200-205 in the bundled
+# video at the default 200): compared with the threshold itself, whether a line
+# counted came down to a few pixels of compression noise. Rows and pixels are
+# compared with BAR_LEVEL * threshold instead.
+BAR_LEVEL = 0.9
+
+# A lane row with a larger brightness std than this holds detail, not a note
+NOTE_MAX_STD = 80
+
+# Chunks saved with --channels luma hold video luma, where black is 16 and white is 235.
+# Stretched to 0-255, white and grey content (bar lines, white notes) has the same
+# brightness as in the max channel, so the thresholds keep their meaning.
+# Saturated colours come out darker than in the max channel (pure blue is ~18% luma),
+# which flattens coloured detail next to a note: it takes a lower std limit to
+# reject the same rows as the max channel (measured against bgr scans of the bundled video).
+LUMA_NOTE_MAX_STD = 72
+LUMA_BLACK = 16
+LUMA_WHITE = 235
+LUMA_TO_BRIGHTNESS = np.clip((np.arange(256) - LUMA_BLACK) * 255.0 / (LUMA_WHITE - LUMA_BLACK), 0, 255).round().astype(np.uint8)
+
+def near_bar_lines(global_ys, bar_lines):
+    """
+    True for every row that lies within BAR_TOLERANCE of a bar line.
+    bar_lines must be sorted. Both are global rows.
+    """
+    global_ys = np.asarray(global_ys, dtype=np.float64)
+    # Number of bar lines strictly inside (y - tolerance, y + tolerance)
+    first = np.searchsorted(bar_lines, global_ys - BAR_TOLERANCE, side='right')
+    last = np.searchsorted(bar_lines, global_ys + BAR_TOLERANCE, side='left')
+    return last > first
+
+def extend_grid(first, step, limit):
+    """
+    first + step, first + 2 * step, ... until a line reaches limit (step < 0: at or below it, else at or above).
+    Lines are accumulated one step at a time, like adding them one by one would.
+    """
+    reached = (lambda lines: lines <= limit) if step < 0 else (lambda lines: lines >= limit)
+    if reached(first):
+        return np.zeros(0)
+    count = int(math.ceil(abs(limit - first) / abs(step))) + 1
+    while True:
+        lines = np.cumsum(np.concatenate(([first], np.full(count, step))))[1:]
+        done = np.flatnonzero(reached(lines))
+        if len(done) > 0:
+            return lines[:done[0] + 1]
+        count *= 2 # Rounding fell short of the estimate
+
+def generate_grid(lines, line_height, min_y, max_y):
+    """
+    Grid of bar lines: the detected (sorted, filtered) lines, gaps filled with
+    evenly spaced lines about line_height apart, and extended by line_height
+    steps until it covers min_y .. max_y.
+    """
+    lines = np.asarray(lines, dtype=np.float64)
+    # How many lines fit in each gap? (at least the line that ends it)
+    gaps = np.diff(lines)
+    segments = np.maximum(np.round(gaps / line_height), 1).astype(np.int64)
+    steps = gaps / segments
+    # Line k of a gap is prev + k * step, the last one is the detected line itself
+    gap_of = np.repeat(np.arange(len(gaps)), segments)
+    k = np.arange(len(gap_of)) - np.repeat(np.cumsum(segments) - segments, segments) + 1
+    filled = lines[gap_of] + k * steps[gap_of]
+    filled[np.cumsum(segments) - 1] = lines[1:]
+    grid = np.concatenate(([lines[0]], filled))
+
+    before = extend_grid(grid[0], -line_height, min_y)[::-1]
+    after = extend_grid(grid[-1], line_height, max_y)
+    return np.concatenate((before, grid, after))
+
+def quantize_rows(global_ys, grid, subdivisions):
+    """
+    Snaps rows to the nearest 1/subdivisions of their grid segment.
+    Returns the snapped rows and a mask of the rows that lie inside the grid (the others are unchanged).
+    """
+    global_ys = np.asarray(global_ys, dtype=np.float64)
+    idx = np.searchsorted(grid, global_ys, side='right') - 1
+    inside = (idx >= 0) & (idx < len(grid) - 1)
+    idx = np.clip(idx, 0, max(len(grid) - 2, 0))
+    grid_start = grid[idx]
+    segment_height = grid[np.minimum(idx + 1, len(grid) - 1)] - grid_start
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = (global_ys - grid_start) / segment_height
+        snapped = grid_start + np.round(fraction * subdivisions) / subdivisions * segment_height
+    return np.where(inside, snapped, global_ys), inside
+
+def lane_bounds(width, normalized_ratios):
+    """
+    Pixel range (x_start, x_end) of each lane for lane width ratios that sum to 1.
+    """
+    bounds = []
+    current_x = 0.0
+    for ratio in normalized_ratios:
+        this_lane_width_px = width * ratio
+        bounds.append((int(current_x), int(current_x + this_lane_width_px)))
+        current_x += this_lane_width_px
+    return bounds
+
+def lane_row_sums(table, columns):
+    """
+    Per-row, per-lane sums from an integral image (one row and column larger than the image).
+    """
+    at_columns = table[:, columns]
+    return np.diff(np.diff(at_columns, axis=1), axis=0)
+
+def note_row_masks(gray, bounds, threshold, max_std=NOTE_MAX_STD):
+    """
+    Classifies every row of every lane at once: an (H, lanes) mask, True where
+    the row of that lane looks like part of a note.
+
+    The lanes are adjacent column ranges, so every statistic is computed for
+    all of them in one sweep: the max with one reduceat over the lane start
+    columns, the sums from integral images sampled at the lane boundaries.
+    Each check only looks at the rows that passed the previous ones (in a
+    chart most rows have no note), and the result is the same as checking
+    every row.
+    """
+    # --- Improved Detection Logic ---
+    # Instead of segmenting first then validating, we validate PER ROW.
+    # This allows us to "slice" the solid note bar out of a larger background icon.
+    columns = np.array([x_start for x_start, _ in bounds] + [bounds[-1][1]])
+    widths = np.diff(columns)
+    gray = gray[:, :columns[-1]] # Columns right of the last lane belong to no lane
+
+    # 1. Brightness Check (Max Channel)
+    # Lower threshold to catch dim colored notes (purple/blue)
+    # User reported purple note missed -> likely too dim.
+    detection_thresh = max(100, threshold - 50)
+    row_maxes = np.maximum.reduceat(gray, columns[:-1], axis=1)
+    is_note = row_maxes > detection_thresh
+
+    # 2. Width/Fill Check
+    # The "Note" is a bar that spans the lane. Background icons are usually narrower or hollow.
+    # We calculate how many pixels in the row are "bright enough".
+    # We use a slightly lower threshold for fill calculation to include edges.
+    # (x > 0.8 * t is x > floor(0.8 * t) for integer pixels, without a float copy of the image)
+    fill_thresh = detection_thresh * 0.8
+    rows = np.flatnonzero(is_note.any(axis=1))
+    bright = (gray[rows] > math.floor(fill_thresh)).view(np.uint8)
+    row_bright_counts = lane_row_sums(cv2.integral(bright), columns)
+    row_fill_ratios = row_bright_counts / widths
+    is_note[rows] &= row_fill_ratios > 0.6 # Must span 60% of lane
+
+    # 3. Solid Color Check (Variance)
+    # The "Note" is usually a solid color. Icons have details/gradients.
+    # std < max_std is checked exactly on integers: n * sum(x^2) - sum(x)^2 < max_std^2 * n^2
+    rows = np.flatnonzero(is_note.any(axis=1))
+    if len(rows) > 0:
+        # The int32 sums of the integral image must not overflow: tall images go in blocks
+        block = max(1, (2 ** 31 - 1) // (max(gray.shape[1], 1) * 255))
+        for top in range(0, len(rows), block):
+            block_rows = rows[top:top + block]
+            sums, square_sums = cv2.integral2(gray[block_rows])
+            row_sums = lane_row_sums(sums, columns).astype(np.int64)
+            row_square_sums = lane_row_sums(square_sums, columns).astype(np.int64)
+            is_solid = widths * row_square_sums - row_sums * row_sums < max_std * max_std * widths * widths # Allow some gradient but reject high noise
+            is_note[block_rows] &= is_solid
+
+    return is_note
+
+def classify_rows(gray, bounds, threshold, max_std=NOTE_MAX_STD):
+    """
+    Everything the segmentation needs to know about each row of a brightness plane:
+    which lanes hold a note there, whether it is a bar line row (mean above BAR_LEVEL * threshold),
+    and its bright pixel count (for the bar line fill ratio; 0 on other rows).
+    """
+    note_rows = note_row_masks(gray, bounds, threshold, max_std)
+    # Bar lines are bright rows spanning most of the image
+    bar_level = BAR_LEVEL * threshold
+    is_bar_row = np.mean(gray, axis=1) > bar_level
+    bar_counts = np.zeros(gray.shape[0], dtype=np.int64)
+    bar_counts[is_bar_row] = np.sum(gray[is_bar_row] > bar_level, axis=1)
+    return note_rows, is_bar_row, bar_counts
+
+class RunTracker:
+    """
+    Finds runs of True in a boolean stream that arrives in pieces.
+    A run that touches the end of a piece stays open until a False row arrives.
+    """
+
+    def __init__(self):
+        self.open_lo = None # First row of the run still in progress
+
+    def feed(self, mask, base):
+        """
+        mask covers global rows base .. base + len(mask). Returns the runs that closed, as (lo, hi).
+        """
+        if len(mask) == 0:
+            return []
+        padded = np.concatenate(([False], mask, [False]))
+        diff = np.diff(padded.astype(np.int8))
+        runs = [(base + int(lo), base + int(hi)) for lo, hi in zip(np.nonzero(diff == 1)[0], np.nonzero(diff == -1)[0])]
+
+        if self.open_lo is not None:
+            if runs and runs[0][0] == base:
+                runs[0] = (self.open_lo, runs[0][1]) # Continues the open run
+            else:
+                runs.insert(0, (self.open_lo, base)) # Ended exactly at the previous piece's end
+            self.open_lo = None
+        if runs and runs[-1][1] == base + len(mask):
+            self.open_lo = runs.pop()[0]
+        return runs
+
+    def close(self, end):
+        """
+        Closes the open run at row end (end of stream). Returns it as a list of 0 or 1 runs.
+        """
+        if self.open_lo is None:
+            return []
+        run = (self.open_lo, end)
+        self.open_lo = None
+        return [run]
+
+class StreamingDetector:
+    """
+    Note and bar line detection on a waterfall that arrives a few rows at a time
+    (a chunk at a time in main(), the strip of each frame in live_capture.py).
+
+    Rows are fed in time order (the bottom of the chart first), so row numbers
+    are the same global rows the batch detector uses. Every check is per row,
+    so only the segmentation needs state: the open run of each lane, the last
+    segment (it may still merge with a run that starts within merge_gap rows)
+    and the bar line run in progress.
+
+    A note is reported once nothing that arrives later can change it: its
+    segment can no longer merge, and any bar line close enough to suppress it
+    has ended. flush(force_row) gives that up for rows below force_row, which
+    bounds the latency at the cost of splitting notes with a late merge.
+    """
+
+    def __init__(self, width, normalized_ratios, threshold, min_height, merge_gap):
+        self.width = width
+        self.bounds = lane_bounds(width, normalized_ratios)
+        self.threshold = threshold
+        self.min_height = min_height
+        self.merge_gap = merge_gap
+        self.rows = 0 # Rows consumed so far
+
+        self.lane_runs = [RunTracker() for _ in self.bounds]
+        self.segments = [None] * len(self.bounds) # (lo, hi) per lane, waiting to see if it merges
+        self.bar_runs = RunTracker()
+        self.bar_counts = np.zeros(0, dtype=np.int64) # Bright pixels per row of the last rows (for bar runs across pieces)
+        self.bars = [] # Recent bar line centres
+        self.pending = [] # Candidate notes waiting for nearby bar lines to end: (global_y, lane, h)
+
+    def feed(self, gray):
+        """
+        Consumes (n, width) max-channel rows, earliest row first. Returns the events that became final.
+        """
+        return self.feed_rows(*classify_rows(gray, self.bounds, self.threshold))
+
+    def feed_rows(self, note_rows, is_bar_row, bar_counts):
+        """
+        Consumes rows that were already classified (classify_rows), earliest row first.
+        """
+        base = self.rows
+        self.rows += len(is_bar_row)
+        events = self.detect_bars(is_bar_row, bar_counts, base)
+
+        for lane_idx in range(len(self.bounds)):
+            for lo, hi in self.lane_runs[lane_idx].feed(note_rows[:, lane_idx], base):
+                self.add_run(lane_idx, lo, hi)
+            self.close_segment(lane_idx)
+
+        return events + self.release_notes()
+
+    def detect_bars(self, is_bar_row, bar_counts, base):
+        counts = np.concatenate((self.bar_counts, bar_counts))
+        counts_base = self.rows - len(counts)
+
+        events = []
+        for lo, hi in self.bar_runs.feed(is_bar_row, base):
+            events += self.add_bar(lo, hi, counts, counts_base)
+        # Keep enough rows for a bar line run that is still open
+        self.bar_counts = counts[-BAR_MAX_HEIGHT:]
+        return events
+
+    def add_bar(self, lo, hi, counts, counts_base):
+        h = hi - lo
+        if h >= BAR_MAX_HEIGHT:
+            return []
+        # Verify fill ratio across the whole width
+        fill_ratio = np.sum(counts[lo - counts_base:hi - counts_base]) / (h * self.width)
+        if fill_ratio <= 0.8:
+            return []
+        global_y = lo + h / 2
+        self.bars.append(global_y)
+        return [{"type": "bar", "global_y": float(global_y)}]
+
+    def add_run(self, lane_idx, lo, hi):
+        # Merge close segments
+        segment = self.segments[lane_idx]
+        if segment is not None and lo - segment[1] < self.merge_gap:
+            self.segments[lane_idx] = (segment[0], hi)
+        else:
+            self.finish_segment(lane_idx)
+            self.segments[lane_idx] = (lo, hi)
+
+    def close_segment(self, lane_idx, force_row=None):
+        """
+        Finishes the lane's segment if no later run can merge with it (or it ends below force_row).
+        """
+        segment = self.segments[lane_idx]
+        if segment is None:
+            return
+        open_lo = self.lane_runs[lane_idx].open_lo
+        next_lo = open_lo if open_lo is not None else self.rows
+        if next_lo - segment[1] >= self.merge_gap or (force_row is not None and segment[1] <= force_row):
+            self.finish_segment(lane_idx)
+
+    def finish_segment(self, lane_idx):
+        segment = self.segments[lane_idx]
+        self.segments[lane_idx] = None
+        if segment is None:
+            return
+        lo, hi = segment
+        h = hi - lo
+        # Filter tiny noise
+        if h < self.min_height:
+            return
+        self.pending.append((lo + h / 2, lane_idx, h))
+
+    def release_notes(self, force_row=None):
+        """
+        Reports the pending notes that no bar line can suppress anymore (or that are below force_row).
+        """
+        # A bar line within BAR_TOLERANCE of a note has ended once we are this far past the note
+        settled = self.rows - BAR_TOLERANCE - BAR_MAX_HEIGHT
+        ready = []
+        waiting = []
+        for global_y, lane_idx, h in self.pending:
+            if global_y > settled and (force_row is None or global_y > force_row):
+                waiting.append((global_y, lane_idx, h))
+            else:
+                ready.append((global_y, lane_idx, h))
+        self.pending = waiting
+
+        # Check against detected bar lines
+        on_bar = near_bar_lines([global_y for global_y, _, _ in ready], np.sort(self.bars))
+        events = [{"type": "note", "lane": lane_idx, "global_y": float(global_y), "h": float(h)}
+                  for (global_y, lane_idx, h), drop in zip(ready, on_bar) if not drop]
+
+        # Bar lines only matter for notes that are still to come. A note's centre
+        # lies above its first row, so for the segments and runs still open
+        # (a long hold may have started far below `settled`) their start is the bound.
+        starts = [global_y for global_y, _, _ in self.pending]
+        starts += [segment[0] for segment in self.segments if segment is not None]
+        starts += [runs.open_lo for runs in self.lane_runs if runs.open_lo is not None]
+        oldest = min(starts + [settled])
+        self.bars = [bar_y for bar_y in self.bars if bar_y > oldest - BAR_TOLERANCE]
+        return events
+
+    def flush(self, force_row=None):
+        """
+        Without force_row: end of stream, reports everything.
+        With force_row: reports what lies below that row even if later rows could still change it.
+        """
+        if force_row is None:
+            events = []
+            for lo, hi in self.bar_runs.close(self.rows):
+                events += self.add_bar(lo, hi, self.bar_counts, self.rows - len(self.bar_counts))
+            for lane_idx, runs in enumerate(self.lane_runs):
+                for lo, hi in runs.close(self.rows):
+                    self.add_run(lane_idx, lo, hi)
+                self.finish_segment(lane_idx)
+            return events + self.release_notes(force_row=float('inf')) # Nothing else is coming
+
+        for lane_idx in range(len(self.bounds)):
+            self.close_segment(lane_idx, force_row)
+        return self.release_notes(force_row)
+
+def read_chunk(config, chunk):
+    """
+    The brightness plane of a chunk (latest row at the top), or None if it can't be read.
+    chunk is a chunk file, or a chunk index of the waterfall store.
+    """
+    if config["store"]:
+        # A view of the memory-mapped rows, latest at the top like the JPEG chunks
+        img = chunk_view(load_store(config["input"]), chunk, config["chunk_size"])
+    else:
+        # cv2.imread doesn't support non-ASCII paths on Windows
+        # Use fromfile + imdecode
+        try:
+            with open(chunk, "rb") as f:
+                file_bytes = np.frombuffer(f.read(), dtype=np.uint8)
+                img = cv2.imdecode(file_bytes, config["read_flags"])
+        except Exception as e:
+            print(f"Error reading chunk {chunk}: {e}")
+            return None
+
+    if img is None:
+        return None
+
+    # Use Max-Channel brightness instead of weighted Grayscale
+    # This ensures colored notes (like pink/red) retain high brightness.
+    # (Single-channel chunks were reduced by slit_scan.py already.)
+    gray = img if config["single_channel"] else np.max(img, axis=2)
+    if config["luma"]:
+        gray = cv2.LUT(gray, LUMA_TO_BRIGHTNESS)
+    return gray
+
+def classify_chunk(job):
+    """
+    Classifies the rows of one chunk (classify_rows). Runs in a worker process when --workers > 1.
+    Returns None for an unreadable chunk, otherwise its width and the row classes, earliest row first.
+    The segmentation into notes and bar lines happens in main(), across chunk boundaries.
+    """
+    config, chunk = job
+    gray = read_chunk(config, chunk)
+    if gray is None:
+        return None
+    bounds = lane_bounds(gray.shape[1], config["normalized_ratios"])
+    note_rows, is_bar_row, bar_counts = classify_rows(gray, bounds, config["threshold"], config["max_std"])
+    # Chunks hold the latest row at the top
+    return gray.shape[1], note_rows[::-1], is_bar_row[::-1], bar_counts[::-1]
 
 def main():
     parser = argparse.ArgumentParser(description='Detect notes in Slit-Scan chunks')
@@ -17,6 +443,11 @@ def main():
     parser.add_argument('--bars-per-line', type=int, default=1, help='Number of bars between detected lines')
     parser.add_argument('--min-height', type=int, default=3, help='Minimum note height in pixels')
     parser.add_argument('--merge-gap', type=int, default=5, help='Max gap to merge segments')
+    parser.add_argument('--source', choices=['auto', 'store', 'jpeg'], default='auto',
+                        help='Read the waterfall store (slit_scan.py --store) or the JPEG chunks (auto: the store if there is one)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes detecting chunks in parallel')
+    parser.add_argument('--progress', action='store_true', help='Also print JSON-lines progress events on stdout (see telemetry.py)')
+    parser.add_argument('--progress-interval', type=float, default=0.5, help='Seconds between progress events')
     
     args = parser.parse_args()
 
@@ -47,6 +478,33 @@ def main():
         with open(metadata_path, 'r') as f:
             metadata = json.load(f)
 
+    # Frame index written by slit_scan.py (maps every row to the frame it came from)
+    frame_index = FrameIndex.load(args.input)
+
+    def rows_to_time(global_ys):
+        """
+        Converts global rows (an array) to seconds. Uses the frame index when available,
+        otherwise assumes every frame contributed exactly 'speed' rows.
+        """
+        global_ys = np.asarray(global_ys, dtype=np.float64)
+        if frame_index is not None and 'fps' in metadata:
+            return frame_index.row_to_time(global_ys, metadata['fps'])
+        if 'speed' in metadata and 'fps' in metadata and 'start_time' in metadata:
+            return metadata['start_time'] + (global_ys / metadata['speed']) / metadata['fps']
+        return np.zeros(global_ys.shape)
+
+    # Chunks saved with --channels max already hold the max-channel plane, --channels luma the luma plane
+    single_channel = metadata.get('channels') in ('max', 'luma')
+    luma = metadata.get('channels') == 'luma'
+    read_flags = cv2.IMREAD_GRAYSCALE if single_channel else cv2.IMREAD_COLOR
+
+    # The waterfall store holds the same rows without JPEG loss: we slice it
+    # into chunks of the scan's chunk size instead of decoding files
+    store = load_store(args.input) if args.source != 'jpeg' else None
+    if args.source == 'store' and store is None:
+        print(f"Error: No waterfall store in {args.input} (scan with --store)")
+        sys.exit(1)
+
     # Find all chunk files
     chunk_files = glob.glob(os.path.join(args.input, "chunk_*.jpg"))
     
@@ -57,167 +515,106 @@ def main():
         return int(match.group(1)) if match else -1
         
     chunk_files.sort(key=get_index)
+    chunk_size = None
+    if store is not None:
+        chunk_size = metadata.get('chunk_size', 5000)
+        chunk_files = list(range(math.ceil(len(store) / chunk_size)))
+        get_index = int
 
     detected_notes = []
     detected_bar_lines_y = [] # Store global Y coordinates of bar lines
     current_base_y = 0.0 # Accumulate height of processed chunks
 
-    print(f"Found {len(chunk_files)} chunks in {args.input}")
+    print(f"Found {len(chunk_files)} chunks in {args.input}" + (" (waterfall store)" if store is not None else ""))
+    progress = ProgressReporter("detect", "chunks", len(chunk_files), args.progress, args.progress_interval)
 
-    for chunk_file in chunk_files:
-        chunk_idx = get_index(chunk_file)
-        print(f"Processing chunk {chunk_idx}...")
-        
-        # cv2.imread doesn't support non-ASCII paths on Windows
-        # Use fromfile + imdecode
-        try:
-            with open(chunk_file, "rb") as f:
-                file_bytes = np.frombuffer(f.read(), dtype=np.uint8)
-                img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-        except Exception as e:
-            print(f"Error reading chunk {chunk_file}: {e}")
-            continue
+    # Chunks are classified independently (in parallel with --workers); their rows
+    # are then fed, in order, through one StreamingDetector. It carries the open
+    # runs and merge gaps from chunk to chunk, so a note straddling a boundary
+    # is found whole and the chunk size doesn't change the result.
+    config = {
+        "input": args.input,
+        "store": store is not None,
+        "chunk_size": chunk_size,
+        "read_flags": read_flags,
+        "single_channel": single_channel,
+        "luma": luma,
+        "threshold": args.threshold,
+        "max_std": LUMA_NOTE_MAX_STD if luma else NOTE_MAX_STD,
+        "normalized_ratios": normalized_ratios
+    }
+    jobs = [(config, chunk_file) for chunk_file in chunk_files]
+    pool = None
+    if args.workers > 1 and len(jobs) > 1:
+        print(f"Detecting with {args.workers} workers")
+        pool = ProcessPoolExecutor(max_workers=args.workers)
 
-        if img is None:
-            continue
-            
-        height, width, _ = img.shape
-        
-        # Use Max-Channel brightness instead of weighted Grayscale
-        # This ensures colored notes (like pink/red) retain high brightness.
-        gray = np.max(img, axis=2)
-        
-        # --- Pass 1: Detect Bar Lines (Global Scanline) ---
-        # Calculate mean brightness of each row across the whole image
-        global_row_means = np.mean(gray, axis=1)
-        
-        # Bar lines are bright rows spanning most of the image
-        is_bar_row = global_row_means > args.threshold
-        
-        padded_bar_mask = np.pad(is_bar_row, (1, 1), 'constant', constant_values=False)
-        diff_bar = np.diff(padded_bar_mask.astype(int))
-        starts_bar = np.where(diff_bar == 1)[0]
-        ends_bar = np.where(diff_bar == -1)[0]
-        
-        for start, end in zip(starts_bar, ends_bar):
-            h = end - start
-            # Bar lines are thin (e.g. < 10px)
-            if h < 10:
-                # Verify fill ratio across the whole width
-                bar_rows = gray[start:end, :]
-                bright_pixels = np.sum(bar_rows > args.threshold)
-                total_pixels = bar_rows.size
-                fill_ratio = bright_pixels / total_pixels
-                
-                if fill_ratio > 0.8:
-                    center_y = start + h/2
-                    global_y = current_base_y + (height - center_y)
-                    detected_bar_lines_y.append(global_y)
-
-        # --- Pass 2: Detect Notes (Per Lane Scanline) ---
-        current_x = 0.0
-        for lane_idx in range(args.lanes):
-            this_lane_width_ratio = normalized_ratios[lane_idx]
-            this_lane_width_px = width * this_lane_width_ratio
-            
-            x_start = int(current_x)
-            x_end = int(current_x + this_lane_width_px)
-            current_x += this_lane_width_px
-            
-            # Extract lane strip
-            lane_gray = gray[:, x_start:x_end]
-            
-            # --- Improved Detection Logic ---
-            # Instead of segmenting first then validating, we validate PER ROW.
-            # This allows us to "slice" the solid note bar out of a larger background icon.
-            
-            # 1. Brightness Check (Max Channel)
-            # Lower threshold to catch dim colored notes (purple/blue)
-            # User reported purple note missed -> likely too dim.
-            detection_thresh = max(100, args.threshold - 50) 
-            row_maxes = np.max(lane_gray, axis=1)
-            is_bright = row_maxes > detection_thresh
-            
-            # 2. Width/Fill Check
-            # The "Note" is a bar that spans the lane. Background icons are usually narrower or hollow.
-            # We calculate how many pixels in the row are "bright enough".
-            # We use a slightly lower threshold for fill calculation to include edges.
-            fill_thresh = detection_thresh * 0.8
-            row_bright_counts = np.sum(lane_gray > fill_thresh, axis=1)
-            lane_w_px = x_end - x_start
-            row_fill_ratios = row_bright_counts / lane_w_px
-            is_wide = row_fill_ratios > 0.6 # Must span 60% of lane
-            
-            # 3. Solid Color Check (Variance)
-            # The "Note" is usually a solid color. Icons have details/gradients.
-            row_stds = np.std(lane_gray, axis=1)
-            is_solid = row_stds < 80.0 # Allow some gradient but reject high noise
-            
-            # Combine checks
-            is_note_row = is_bright & is_wide & is_solid
-            
-            # 4. Segment Detection on Valid Rows
-            padded_mask = np.pad(is_note_row, (1, 1), 'constant', constant_values=False)
-            diff = np.diff(padded_mask.astype(int))
-            starts = np.where(diff == 1)[0]
-            ends = np.where(diff == -1)[0]
-            
-            # Merge close segments
-            merged_segments = []
-            if len(starts) > 0:
-                curr_start = starts[0]
-                curr_end = ends[0]
-                for i in range(1, len(starts)):
-                    if starts[i] - curr_end < args.merge_gap:
-                        curr_end = ends[i]
-                    else:
-                        merged_segments.append((curr_start, curr_end))
-                        curr_start = starts[i]
-                        curr_end = ends[i]
-                merged_segments.append((curr_start, curr_end))
-            
-            for start, end in merged_segments:
-                h = end - start
-                
-                # Filter tiny noise
-                if h < args.min_height: continue
-                
-                # Extract segment for final verification (optional, but good for debugging)
-                # segment_pixels = lane_gray[start:end, :]
-                
-                # Calculate centroid Y
-                center_y = start + h / 2
-                
-                # D. Bar Line Check (Local)
-                global_y = current_base_y + (height - center_y)
-                
-                # Check against detected bar lines
-                is_bar_line = False
-                for bar_y in detected_bar_lines_y:
-                    if abs(bar_y - global_y) < 5: # 5px tolerance
-                        is_bar_line = True
-                        break
-                if is_bar_line:
-                    continue
-
-                # Calculate Time
-                time_sec = 0.0
-                if 'speed' in metadata and 'fps' in metadata and 'start_time' in metadata:
-                    time_sec = metadata['start_time'] + (global_y / metadata['speed']) / metadata['fps']
-
-                detected_notes.append({
-                    "chunk_index": chunk_idx,
-                    "chunk_height": height,
-                    "chunk_base_y": current_base_y,
-                    "lane": lane_idx,
-                    "y": float(center_y),
-                    "h": float(h),
-                    "global_y": float(global_y),
-                    "time": float(time_sec),
-                    "type": "hit"
-                })
-        
-        current_base_y += height
+    detector = None
+    note_events = []
+    chunks = [] # (chunk index, global row of its bottom, height) of every chunk read
+
+    def collect(events):
+        for event in events:
+            if event["type"] == "bar":
+                detected_bar_lines_y.append(event["global_y"])
+            else:
+                note_events.append(event)
+
+    futures = []
+    try:
+        if pool is not None:
+            futures = [pool.submit(classify_chunk, job) for job in jobs]
+            results = (future.result() for future in futures)
+        else:
+            results = map(classify_chunk, jobs)
+        for i, (chunk_file, result) in enumerate(zip(chunk_files, results)):
+            progress.update(i, rows=int(current_base_y), notes=len(note_events))
+            chunk_idx = get_index(chunk_file)
+            print(f"Processing chunk {chunk_idx}...")
+
+            if result is None:
+                continue
+            width, note_rows, is_bar_row, bar_counts = result
+            if detector is None:
+                detector = StreamingDetector(width, normalized_ratios, args.threshold, args.min_height, args.merge_gap)
+
+            # Candidates on a bar line are dropped by the detector (once the bar lines around them are known)
+            collect(detector.feed_rows(note_rows, is_bar_row, bar_counts))
+            chunks.append((chunk_idx, current_base_y, len(is_bar_row)))
+            current_base_y += len(is_bar_row)
+    finally:
+        # Also on an error, so no worker outlives the run. The chunks that
+        # have not started are cancelled by hand (shutdown(cancel_futures=True) needs Python 3.9)
+        if pool is not None:
+            for future in futures:
+                future.cancel()
+            pool.shutdown()
+
+    if detector is not None:
+        collect(detector.flush()) # End of the waterfall: close what is still open
+
+    # Every note belongs to the chunk that holds its center
+    note_ys = np.array([event["global_y"] for event in note_events], dtype=np.float64)
+    chunk_bases = np.array([base for _, base, _ in chunks], dtype=np.float64)
+    owners = np.searchsorted(chunk_bases, note_ys, side='right') - 1
+    times = rows_to_time(note_ys)
+    for event, owner, time_sec in zip(note_events, owners.tolist(), times.tolist()):
+        chunk_idx, base, height = chunks[owner]
+        detected_notes.append({
+            "chunk_index": chunk_idx,
+            "chunk_height": height,
+            "chunk_base_y": base,
+            "lane": event["lane"],
+            "y": float(height - (event["global_y"] - base)),
+            "h": event["h"],
+            "global_y": event["global_y"],
+            "time": time_sec,
+            "type": "hit"
+        })
+    # Chunk by chunk, lane by lane, top to bottom (the order of the chunk images)
+    detected_notes.sort(key=lambda note: (note["chunk_index"], note["lane"], -note["global_y"]))
+
+    progress.update(len(chunk_files), force=True, rows=int(current_base_y), notes=len(detected_notes))
 
     # Calculate BPM and Generate Grid
     bpm = 0
@@ -240,7 +637,9 @@ def main():
         # 2. Calculate robust median height (pixels per line)
         if len(filtered_lines) > 1:
             diffs = np.diff(filtered_lines)
-            median_diff = np.median(diffs)
+            # Lines hidden under notes are missed, which leaves gaps of two or three
+            # line heights: the shortest quarter of the gaps are single lines
+            median_diff = np.percentile(diffs, 25)
             
             # Filter diffs to get a clean average
             valid_diffs = [d for d in diffs if 0.8 * median_diff < d < 1.2 * median_diff]
@@ -259,38 +658,13 @@ def main():
                         print(f"Estimated BPM: {bpm:.2f} (Avg Line Height: {avg_diff_px:.1f}px)")
 
                 # 3. Generate Standardized Grid
-                # We interpolate between filtered lines to fill gaps
-                final_grid = [filtered_lines[0]]
-                
-                for i in range(1, len(filtered_lines)):
-                    prev_line = filtered_lines[i-1]
-                    curr_line = filtered_lines[i]
-                    dist = curr_line - prev_line
-                    
-                    # How many lines fit here?
-                    num_segments = round(dist / avg_diff_px)
-                    
-                    if num_segments <= 1:
-                        final_grid.append(curr_line)
-                    else:
-                        # Interpolate
-                        step = dist / num_segments
-                        for k in range(1, num_segments):
-                            final_grid.append(prev_line + k * step)
-                        final_grid.append(curr_line)
-                
-                # 4. Extrapolate Grid (Start and End)
-                # Cover all notes
-                min_note_y = min([n['global_y'] for n in detected_notes]) if detected_notes else 0
-                max_note_y = max([n['global_y'] for n in detected_notes]) if detected_notes else 0
-                
-                # Backwards
-                while final_grid[0] > min_note_y:
-                    final_grid.insert(0, final_grid[0] - avg_diff_px)
-                    
-                # Forwards
-                while final_grid[-1] < max_note_y:
-                    final_grid.append(final_grid[-1] + avg_diff_px)
+                # We interpolate between filtered lines to fill gaps,
+                # 4. and extrapolate the grid (start and end) to cover all notes
+                note_ys = np.array([n['global_y'] for n in detected_notes], dtype=np.float64)
+                min_note_y = note_ys.min() if len(note_ys) > 0 else 0
+                max_note_y = note_ys.max() if len(note_ys) > 0 else 0
+                grid = generate_grid(filtered_lines, avg_diff_px, min_note_y, max_note_y)
+                final_grid = grid.tolist()
 
                 # 5. Quantize Notes
                 print("Quantizing notes to grid...")
@@ -302,31 +676,20 @@ def main():
                 # 192 = 48 * 4.
                 subdivisions = 192 
                 
-                for note in detected_notes:
-                    gy = note['global_y']
-                    
-                    # Find grid segment
-                    idx = bisect.bisect_right(final_grid, gy) - 1
-                    
-                    if 0 <= idx < len(final_grid) - 1:
-                        grid_start = final_grid[idx]
-                        grid_end = final_grid[idx+1]
-                        segment_height = grid_end - grid_start
-                        
-                        relative_y = gy - grid_start
-                        fraction = relative_y / segment_height
-                        
-                        # Snap
-                        snapped_fraction = round(fraction * subdivisions) / subdivisions
-                        
-                        new_global_y = grid_start + (snapped_fraction * segment_height)
-                        
-                        # Update note
-                        note['global_y'] = new_global_y
-                        note['y'] = note['chunk_height'] - (new_global_y - note['chunk_base_y'])
-                        
-                        if 'speed' in metadata and 'fps' in metadata and 'start_time' in metadata:
-                            note['time'] = metadata['start_time'] + (new_global_y / metadata['speed']) / metadata['fps']
+                # All notes at once, as columns; only the notes inside the grid are updated
+                snapped_ys, inside = quantize_rows(note_ys, grid, subdivisions)
+                inside = np.flatnonzero(inside)
+                new_global_ys = snapped_ys[inside]
+                chunk_heights = np.array([detected_notes[i]['chunk_height'] for i in inside], dtype=np.float64)
+                chunk_base_ys = np.array([detected_notes[i]['chunk_base_y'] for i in inside], dtype=np.float64)
+                new_ys = chunk_heights - (new_global_ys - chunk_base_ys)
+                new_times = rows_to_time(new_global_ys)
+
+                for i, new_global_y, new_y, new_time in zip(inside.tolist(), new_global_ys.tolist(), new_ys.tolist(), new_times.tolist()):
+                    note = detected_notes[i]
+                    note['global_y'] = new_global_y
+                    note['y'] = new_y
+                    note['time'] = new_time
 
     # Save results
     output_file = os.path.join(args.input, "notes.json")
@@ -338,6 +701,7 @@ def main():
     with open(output_file, 'w') as f:
         json.dump(output_data, f, indent=2)
         
+    progress.finish(len(chunk_files), rows=int(current_base_y), notes=len(detected_notes), bpm=round(bpm, 2))
     print(f"Saved {len(detected_notes)} notes and BPM {bpm:.2f} to {output_file}")
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+import os
+
+import cv2
+import numpy as np
+
+from frame_sources import clamp_crop
+
+# =============================================================================
+# DUPLICATE FRAMES
+# =============================================================================
+# Many uploads are 30fps gameplay re-encoded at 60fps (every frame shown
+# twice), or have frames the recorder duplicated to cover for dropped ones. A
+# duplicate frame shows the chart where the previous one did, so its strip
+# repeats rows we already have, and the rows that really scrolled past the
+# scan line meanwhile are missing.
+#
+# DETECTION:
+# The region above the scan line (where the notes fall) is shrunk 8x and
+# compared with the same region of the previous frame. A mean absolute
+# difference below --duplicate-threshold (on 0-255) makes the frame a
+# duplicate. The downscale averages away the encoder noise of re-encodes:
+# on a 30-in-60 re-encode of the bundled video (x264 and mpeg4) repeated
+# frames differ by at most 0.19, new frames by 0.88 or more, except where
+# nothing moves above the scan line.
+#
+# STATIC SCREENS:
+# Where nothing moves (a paused or frozen screen, an empty stretch of chart)
+# every frame looks like a repeat of the previous one. A run of more than
+# --max-duplicate-run such frames is a static screen, not repeated frames:
+# none of its frames count as duplicates. The decision is made when the run
+# gets too long, so its first frames have already given their rows to the
+# frame that ends the run (the frame index spreads them over the run, so
+# row -> time is still right).
+#
+# COLLAPSE (--duplicates collapse):
+# A duplicate frame contributes no rows. Its scheduled rows are carried over
+# to the next unique frame, whose strip is that much taller: it covers
+# everything that scrolled since the last unique frame. The chart keeps its
+# geometry (speed rows per frame on average), and the frame index spreads the
+# taller strip over the skipped frames, exactly like stride mode, so row ->
+# time stays correct.
+# At most --max-duplicate-run frames in a row are collapsed, which is also
+# as far as the scan band reaches below the scan line.
+# =============================================================================
+
+DUPLICATE_MODES = ['off', 'detect', 'collapse']
+
+# Duplicate frame numbers (absolute), next to metadata.json
+DUPLICATES_FILENAME = "duplicate_frames.npy"
+
+# Shrink factor of the compared region
+SIGNATURE_SCALE = 8
+
+def duplicate_region(y, x1, x2, height, width, frame_height):
+    """
+    (x, y, w, h) of the compared region: `height` rows above the scan line and the line itself, clipped to the frame.
+    """
+    top = max(y - height, 0)
+    return clamp_crop((x1, top, x2 - x1, y + 1 - top), width, frame_height)
+
+class DuplicateDetector:
+    """
+    Compares each frame with the previous one and decides whether it is a duplicate.
+    rect is the compared region inside the decoded crop.
+    """
+
+    def __init__(self, rect, threshold, collapse=False, max_run=3):
+        self.rect = rect
+        self.threshold = threshold
+        self.collapse = collapse
+        self.max_run = max_run
+        self.previous = None
+        self.run = 0 # Frames in a row that repeat the previous one
+        self.carry = 0 # Rows carried over to the next unique frame
+        self.frames = [] # Offsets (from the first scanned frame) of the duplicates
+
+    def signature(self, band):
+        x, y, w, h = self.rect
+        region = band[y:y + h, x:x + w]
+        size = (max(1, w // SIGNATURE_SCALE), max(1, h // SIGNATURE_SCALE))
+        return cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+
+    def check(self, frame_offset, band):
+        """
+        True if the frame is a duplicate of the previous one.
+        The frames of a run longer than max_run are not (a static screen): once the
+        run gets that long, its first frames are taken back out of self.frames.
+        """
+        signature = self.signature(band)
+        repeated = self.previous is not None and cv2.absdiff(signature, self.previous).mean() < self.threshold
+        self.previous = signature
+        if not repeated:
+            self.run = 0
+            return False
+        self.run += 1
+        if self.run <= self.max_run:
+            self.frames.append(frame_offset)
+            return True
+        if self.run == self.max_run + 1:
+            del self.frames[len(self.frames) - self.max_run:]
+        return False
+
+    def slit_height(self, frame_offset, band, slit_height):
+        """
+        Rows this frame contributes. Duplicates give theirs to the next unique frame when collapsing.
+        """
+        duplicate = self.check(frame_offset, band)
+        if not self.collapse:
+            return slit_height
+        if duplicate:
+            self.carry += slit_height
+            return 0
+        slit_height += self.carry
+        self.carry = 0
+        return slit_height
+
+def save_duplicates(output_dir, frames):
+    np.save(os.path.join(output_dir, DUPLICATES_FILENAME), np.asarray(frames, dtype=np.uint32))
@@ -4,6 +4,8 @@ import os
 import sys
 import json
 
+from seek_index import SeekIndex
+
 def main():
     parser = argparse.ArgumentParser(description='Extract frames for calibration')
     parser.add_argument('--video', required=True, help='Path to input video file')
@@ -20,9 +22,22 @@ def main():
         sys.exit(1)
 
     # Seek to start time
+    # The seek index is cached next to the video, so repeated calibration clicks
+    # only pay for building it once. Without it we fall back to OpenCV's own seek.
     fps = cap.get(cv2.CAP_PROP_FPS)
-    start_frame = int(args.start * fps)
-    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    try:
+        seek_index = SeekIndex.load_or_build(args.video)
+    except IOError:
+        seek_index = None
+    if seek_index is not None:
+        start_frame = seek_index.frame_at_time(args.start)
+        if not seek_index.seek(cap, start_frame):
+            # Not worth failing calibration over: OpenCV's seek is usually close enough
+            print(f"Warning: Could not seek to frame {start_frame} with the seek index, using OpenCV's seek", file=sys.stderr)
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    else:
+        start_frame = int(args.start * fps)
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
 
     if not os.path.exists(args.output):
         os.makedirs(args.output)
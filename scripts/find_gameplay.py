@@ -0,0 +1,260 @@
+import argparse
+import json
+import subprocess
+import sys
+
+import cv2
+import numpy as np
+
+from frame_sources import clamp_crop, passthrough_args
+from seek_index import SeekIndex
+
+# =============================================================================
+# GAMEPLAY FINDER
+# =============================================================================
+# Stream VODs and recordings spend a lot of their runtime outside gameplay:
+# intros, song select, results screens. Scanning those wastes decode time and
+# turns menus into garbage notes.
+#
+# This pre-pass looks at the HIGHWAY (the part of the track above the scan
+# line, where the notes fall) in a sparse set of frames:
+# 1. Keyframes only, decoded by ffmpeg at low resolution (-skip_frame nokey).
+#    Without ffmpeg, frames every --step seconds are fetched by seeking, which
+#    is far slower (11 s instead of 4 s on 100 s of 1080p60): install ffmpeg.
+# 2. Each sample is scored: during gameplay the highway is mostly dark, with
+#    something bright on it (lane lines, notes, the judgement line). Menus are
+#    bright and busy, fades are black.
+# 3. Where two neighbouring samples disagree, the boundary is refined by
+#    bisecting with seeks down to --resolution seconds.
+# 4. Short gaps are merged, short runs dropped, and every interval padded.
+#
+# The result is a list of [start, end] intervals in seconds, which
+# slit_scan.py --intervals accepts.
+# =============================================================================
+
+# A pixel darker than this counts as highway background
+DARK_LEVEL = 60
+# Fraction of the highway that has to be background
+MIN_DARK_FRACTION = 0.8
+# ...and the brightest pixels have to reach this (a black fade is not gameplay)
+MIN_PEAK = 64
+
+def highway_region(y, x1, x2, highway_height, width, height):
+    """
+    (x, y, w, h) of the highway above the scan line, clipped to the frame.
+    """
+    top = max(y - highway_height, 0)
+    return clamp_crop((x1, top, x2 - x1, y - top), width, height)
+
+def highway_present(region_bgr):
+    """
+    True if the highway region of a frame looks like gameplay.
+    """
+    gray = np.max(region_bgr, axis=2)
+    dark_fraction = np.mean(gray < DARK_LEVEL)
+    peak = np.percentile(gray, 99.5)
+    return bool(dark_fraction >= MIN_DARK_FRACTION and peak >= MIN_PEAK)
+
+def sample_keyframes(video, region, scale, seek_index, ffmpeg='ffmpeg'):
+    """
+    Decodes only the keyframes (cropped and downscaled by ffmpeg).
+    Returns [(time, region_bgr)], or None if ffmpeg is missing or the frames do not match the index.
+    """
+    x, y, w, h = region
+    out_w = max(2, int(w * scale))
+    out_h = max(2, int(h * scale))
+    cmd = [ffmpeg, '-v', 'error', '-nostdin', '-skip_frame', 'nokey', '-i', video, '-map', '0:v:0',
+           *passthrough_args(ffmpeg), '-vf', f"crop={w}:{h}:{x}:{y},scale={out_w}:{out_h},format=bgr24",
+           '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+    try:
+        data = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    frames = np.frombuffer(data, dtype=np.uint8)
+    frame_size = out_w * out_h * 3
+    if len(frames) != frame_size * len(seek_index.keyframes):
+        return None # Some decoders do not honour skip_frame; the timestamps would not line up
+    frames = frames.reshape(-1, out_h, out_w, 3)
+    return [(seek_index.time_of_frame(int(k)), frames[i]) for i, k in enumerate(seek_index.keyframes)]
+
+class SeekSampler:
+    """
+    Fetches the highway region of the frame at a given time with a (frame-accurate) seek.
+    """
+
+    def __init__(self, video, region, scale, seek_index):
+        self.cap = cv2.VideoCapture(video)
+        if not self.cap.isOpened():
+            raise IOError(f"Could not open video {video}")
+        self.region = region
+        self.scale = scale
+        self.seek_index = seek_index
+        self.count = 0
+
+    def sample(self, seconds):
+        frame = self.seek_index.frame_at_time(seconds)
+        if not self.seek_index.seek(self.cap, frame):
+            return None
+        ret, image = self.cap.read()
+        if not ret:
+            return None
+        self.count += 1
+        x, y, w, h = self.region
+        crop = image[y:y + h, x:x + w]
+        return cv2.resize(crop, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def release(self):
+        self.cap.release()
+
+def refine_boundary(sampler, t_before, t_after, present_before, resolution):
+    """
+    Bisects between two samples that disagree. Returns the time where the class changes.
+    """
+    while t_after - t_before > resolution:
+        middle = (t_before + t_after) / 2
+        region = sampler.sample(middle)
+        if region is None:
+            break
+        if highway_present(region) == present_before:
+            t_before = middle
+        else:
+            t_after = middle
+    return (t_before + t_after) / 2
+
+def find_intervals(samples, sampler, duration, resolution, min_length, min_gap, pad):
+    """
+    Turns classified samples [(time, present)] into gameplay intervals [[start, end], ...].
+    """
+    intervals = []
+    start = 0.0 if samples and samples[0][1] else None
+    for (t0, present0), (t1, present1) in zip(samples, samples[1:]):
+        if present0 == present1:
+            continue
+        boundary = refine_boundary(sampler, t0, t1, present0, resolution)
+        if present1:
+            start = boundary
+        else:
+            intervals.append([start, boundary])
+            start = None
+    if start is not None:
+        intervals.append([start, duration])
+
+    # Merge intervals separated by short gaps (a pause screen, a flash in the highway)
+    merged = []
+    for interval in intervals:
+        if merged and interval[0] - merged[-1][1] < min_gap:
+            merged[-1][1] = interval[1]
+        else:
+            merged.append(interval)
+
+    # Drop short runs, pad the rest (and keep them apart)
+    result = []
+    for start, end in merged:
+        if end - start < min_length:
+            continue
+        start = max(start - pad, 0.0)
+        end = min(end + pad, duration)
+        if result and start <= result[-1][1]:
+            result[-1][1] = end
+        else:
+            result.append([start, end])
+    return [[round(start, 3), round(end, 3)] for start, end in result]
+
+def detect_gameplay(video, y, x1, x2, highway_height=300, step=5.0, resolution=1.0, scale=0.25,
+                    min_length=20.0, min_gap=10.0, pad=1.0, ffmpeg='ffmpeg', log=print):
+    """
+    Runs the whole pre-pass. Returns (intervals, stats).
+    """
+    seek_index = SeekIndex.load_or_build(video)
+    cap = cv2.VideoCapture(video)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    duration = seek_index.time_of_frame(seek_index.frame_count - 1) + 1.0 / max(seek_index.fps, 1.0)
+
+    region = highway_region(y, x1, x2, highway_height, width, height)
+    if region[2] == 0 or region[3] == 0:
+        raise ValueError(f"Highway region above y={y} is outside the {width}x{height} frame")
+
+    sampler = SeekSampler(video, region, scale, seek_index)
+    try:
+        coarse = sample_keyframes(video, region, scale, seek_index, ffmpeg)
+        if coarse is not None:
+            log(f"Sampled {len(coarse)} keyframes")
+        else:
+            log(f"Keyframe decode unavailable (is ffmpeg installed?), seeking every {step}s; this is slow")
+            coarse = []
+            for t in np.arange(0.0, duration, step):
+                region_bgr = sampler.sample(float(t))
+                if region_bgr is not None:
+                    coarse.append((float(t), region_bgr))
+
+        samples = [(t, highway_present(region_bgr)) for t, region_bgr in coarse]
+        intervals = find_intervals(samples, sampler, duration, resolution, min_length, min_gap, pad)
+        stats = {
+            "duration": round(duration, 3),
+            "samples": len(samples),
+            "gameplay_samples": sum(1 for _, present in samples if present),
+            "seeks": sampler.count
+        }
+    finally:
+        sampler.release()
+    return intervals, stats
+
+def parse_intervals(value):
+    """
+    Reads intervals from a JSON file written by this script, or from "start-end,start-end" (seconds).
+    """
+    try:
+        with open(value, 'r') as f:
+            intervals = json.load(f)["intervals"]
+    except FileNotFoundError:
+        intervals = []
+        for part in value.split(','):
+            start, end = part.split('-')
+            intervals.append([float(start), float(end)])
+    intervals = sorted([float(start), float(end)] for start, end in intervals)
+    for start, end in intervals:
+        if end <= start:
+            raise ValueError(f"Interval {start}-{end} is empty")
+    return intervals
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the gameplay parts of a video')
+    parser.add_argument('--video', required=True, help='Path to input video file')
+    parser.add_argument('--y', type=int, required=True, help='Y coordinate of the scan line')
+    parser.add_argument('--x1', type=int, required=True, help='Left X coordinate of the track')
+    parser.add_argument('--x2', type=int, required=True, help='Right X coordinate of the track')
+    parser.add_argument('--highway-height', type=int, default=300, help='Rows of track above the scan line to look at')
+    parser.add_argument('--step', type=float, default=5.0, help='Seconds between samples when keyframes cannot be decoded')
+    parser.add_argument('--resolution', type=float, default=1.0, help='Refine interval boundaries to this many seconds')
+    parser.add_argument('--min-length', type=float, default=20.0, help='Ignore gameplay runs shorter than this (seconds)')
+    parser.add_argument('--min-gap', type=float, default=10.0, help='Merge runs separated by less than this (seconds)')
+    parser.add_argument('--pad', type=float, default=1.0, help='Seconds added before and after each interval')
+    parser.add_argument('--ffmpeg', default='ffmpeg', help='Path to the ffmpeg executable')
+    parser.add_argument('--output', type=str, help='Also write the result to this JSON file')
+
+    args = parser.parse_args()
+
+    try:
+        intervals, stats = detect_gameplay(args.video, args.y, args.x1, args.x2, args.highway_height, args.step,
+                                           args.resolution, min_length=args.min_length, min_gap=args.min_gap,
+                                           pad=args.pad, ffmpeg=args.ffmpeg)
+    except (IOError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    kept = sum(end - start for start, end in intervals)
+    print(f"Gameplay: {kept:.1f}s of {stats['duration']:.1f}s in {len(intervals)} interval(s)")
+
+    result = dict(stats, intervals=intervals)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    # Output JSON for the server to parse
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import os
+
+import numpy as np
+
+# =============================================================================
+# FRAME <-> ROW INDEX
+# =============================================================================
+# Every scanned frame contributes a strip of rows to the waterfall. This file
+# stores that mapping in both directions, so a row can be turned into a time
+# (and a frame into a row) with a single array lookup.
+#
+# FILE LAYOUT (frame_index.bin, little-endian):
+#   4 bytes   magic "M2FI"
+#   uint32    start_frame   (absolute frame number of the first scanned frame)
+#   uint32    frame_count   (number of scanned frames, N)
+#   uint32    row_count     (total waterfall height, R)
+#   uint32[N+1] frame_rows  (global row where each frame's strip starts; last = R)
+#   uint32[R]   row_frames  (absolute frame number that produced each row)
+#
+# The scanned frames are start_frame, start_frame + 1, ... When only some
+# intervals of the video were scanned (slit_scan.py --intervals), the magic is
+# "M2F2" and uint32[N] frames (absolute frame number of each scanned frame)
+# follows the header, before frame_rows.
+#
+# For a variable frame rate video, float64[] times (presentation time in
+# seconds of every frame from start_frame to one past the last scanned frame,
+# from the seek index) follows row_frames. Without it a frame lasts 1 / fps.
+#
+# Global rows count from the bottom of the chart (the earliest frame) upwards,
+# the same "global_y" that detect_notes.py uses.
+# =============================================================================
+
+INDEX_FILENAME = "frame_index.bin"
+MAGIC = b"M2FI"
+MAGIC_FRAMES = b"M2F2" # With an explicit frame list
+
+def write_index(output_dir, start_frame, strip_heights, frames=None, times=None):
+    """
+    Writes the index for frames start_frame, start_frame + 1, ... with the given strip heights.
+    frames lists the absolute frame numbers instead, when they are not consecutive.
+    times (optional) are the presentation times of the frames from the first to one past the last scanned one.
+    """
+    heights = np.asarray(strip_heights, dtype=np.int64)
+    if frames is None:
+        frames = np.arange(start_frame, start_frame + len(heights))
+    frames = np.asarray(frames, dtype='<u4')
+    consecutive = len(frames) == 0 or int(frames[-1]) - int(frames[0]) == len(frames) - 1
+    if len(frames) > 0:
+        start_frame = int(frames[0])
+
+    frame_rows = np.zeros(len(heights) + 1, dtype='<u4')
+    np.cumsum(heights, out=frame_rows[1:])
+    row_frames = np.repeat(frames, heights)
+    header = np.array([start_frame, len(heights), frame_rows[-1]], dtype='<u4')
+
+    path = os.path.join(output_dir, INDEX_FILENAME)
+    with open(path, 'wb') as f:
+        f.write(MAGIC if consecutive else MAGIC_FRAMES)
+        f.write(header.tobytes())
+        if not consecutive:
+            f.write(frames.tobytes())
+        f.write(frame_rows.tobytes())
+        f.write(row_frames.tobytes())
+        if times is not None and len(frames) > 0:
+            times = np.asarray(times, dtype='<f8')
+            if len(times) != int(frames[-1]) - start_frame + 2:
+                raise ValueError(f"Expected {int(frames[-1]) - start_frame + 2} frame times, got {len(times)}")
+            f.write(times.tobytes())
+    return path
+
+class FrameIndex:
+    """
+    Read-only view of frame_index.bin.
+    """
+
+    def __init__(self, path):
+        data = np.fromfile(path, dtype=np.uint8)
+        magic = data[:4].tobytes()
+        if magic not in (MAGIC, MAGIC_FRAMES):
+            raise ValueError(f"{path} is not a frame index")
+        self.start_frame, self.frame_count, self.row_count = (int(v) for v in data[4:16].view('<u4'))
+
+        offset = 16
+        if magic == MAGIC_FRAMES:
+            self.frames = data[offset:offset + 4 * self.frame_count].view('<u4').astype(np.int64)
+            offset += 4 * self.frame_count
+        else:
+            self.frames = np.arange(self.start_frame, self.start_frame + self.frame_count, dtype=np.int64)
+        # First index of the run of consecutive frames each frame belongs to
+        breaks = np.zeros(self.frame_count, dtype=np.int64)
+        if self.frame_count > 1:
+            breaks[1:] = np.where(np.diff(self.frames) != 1, np.arange(1, self.frame_count), 0)
+        self.run_starts = np.maximum.accumulate(breaks) if self.frame_count > 0 else breaks
+        self.frame_rows = data[offset:offset + 4 * (self.frame_count + 1)].view('<u4')
+        offset += 4 * (self.frame_count + 1)
+        self.row_frames = data[offset:offset + 4 * self.row_count].view('<u4')
+        offset += 4 * self.row_count
+        # Frame times of a variable frame rate video (None: a frame lasts 1 / fps)
+        self.times = data[offset:].view('<f8') if len(data) > offset else None
+
+    @classmethod
+    def load(cls, output_dir):
+        """
+        Returns the index of an output directory, or None if it has none.
+        """
+        path = os.path.join(output_dir, INDEX_FILENAME)
+        if not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def frame_to_row(self, frame):
+        """
+        Global row where the strip of an absolute frame number starts
+        (for a frame that was not scanned, where the next scanned one starts).
+        """
+        i = np.searchsorted(self.frames, np.asarray(frame), side='left')
+        return self.frame_rows[i]
+
+    def row_to_frame(self, row):
+        """
+        Fractional absolute frame number for a (possibly fractional) global row.
+        A row halfway up a 10px strip of frame F maps to F + 0.5.
+
+        In stride mode a strip also covers the frames before it that took no
+        rows, so a strip of frame F after two empty frames spans F - 2 .. F + 1
+        (but never reaches back across a gap between scanned intervals).
+        """
+        row = np.asarray(row, dtype=np.float64)
+        if self.row_count == 0:
+            return np.full(row.shape, float(self.start_frame))
+        r = np.clip(np.floor(row).astype(np.int64), 0, self.row_count - 1)
+        i = np.searchsorted(self.frames, self.row_frames[r].astype(np.int64))
+        strip_start = self.frame_rows[i]
+        strip_height = self.frame_rows[i + 1].astype(np.int64) - strip_start
+        # First frame of the group: empty strips start on the same row as the one that follows them
+        first = np.maximum(np.searchsorted(self.frame_rows, strip_start, side='left'), self.run_starts[i])
+        span = self.frames[i] + 1 - self.frames[first]
+        return self.frames[first] + (row - strip_start) * span / np.maximum(strip_height, 1)
+
+    def row_to_time(self, row, fps):
+        """
+        Time in seconds (from the start of the video) for a global row.
+        """
+        if self.times is None:
+            return self.row_to_frame(row) / fps
+        # Interpolate within each frame, between its timestamp and the next one
+        return np.interp(self.row_to_frame(row) - self.start_frame, np.arange(len(self.times)), self.times)
@@ -0,0 +1,509 @@
+import cv2
+import functools
+import numpy as np
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+
+# =============================================================================
+# FRAME SOURCES
+# =============================================================================
+# The slit-scan only ever looks at a thin band of each frame (the Scan Line
+# plus a few rows below it). A "source" decodes the video and hands out just
+# that crop rectangle, frame by frame.
+#
+# BACKENDS:
+# - opencv: cv2.VideoCapture decodes the full frame to BGR, we slice the crop.
+# - ffmpeg: an ffmpeg subprocess applies the crop (and pixel format) itself
+#           and pipes only the cropped pixels to us as raw bytes.
+#
+# Live capture (live_capture.py) also reads from a capture device (opencv
+# with a device index) or raw frames on a pipe (RawVideoSource).
+#
+# Both return a (h, w, 3) view that is only valid until the next read().
+# Callers must copy what they want to keep.
+#
+# With luma=True the ffmpeg backend skips the conversion to BGR and returns
+# (h, w) crops of the Y plane instead (extractplanes=y). The values are the raw
+# video luma (16-235 for limited range video), not a BGR grey. OpenCV has no
+# dependable way to hand out the Y plane, so it only decodes BGR. Either
+# backend can be wrapped in a PrefetchSource, which decodes ahead on a
+# background thread.
+#
+# read() is grab() + retrieve(). Callers that do not need every frame call
+# grab() alone for the frames they skip, which advances without converting.
+#
+# An IntervalSource reads several frame ranges back to back (the gameplay
+# intervals of find_gameplay.py), seeking over the gaps between them.
+# =============================================================================
+
+BACKENDS = ['opencv', 'ffmpeg']
+
+def probe_video(video):
+    """
+    Returns (fps, width, height, frame_count) using OpenCV.
+    """
+    cap = cv2.VideoCapture(video)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video {video}")
+    info = (
+        cap.get(cv2.CAP_PROP_FPS),
+        int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    )
+    cap.release()
+    return info
+
+def parse_ffmpeg_version(text):
+    """
+    (major, minor) from the output of ffmpeg -version, or None for builds without
+    a release number (git snapshots print "ffmpeg version N-12345-g...").
+    """
+    match = re.search(r"ffmpeg version n?(\d+)\.(\d+)", text)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+@functools.lru_cache(maxsize=None)
+def passthrough_args(ffmpeg='ffmpeg'):
+    """
+    The options that keep every decoded frame as it is (no frames dropped or
+    duplicated to a constant rate). -fps_mode arrived in ffmpeg 5.1 and replaces
+    -vsync, which older versions need instead. Snapshots and unknown versions
+    get -fps_mode; an ffmpeg that does not run fails later, where it is started.
+    """
+    try:
+        result = subprocess.run([ffmpeg, '-hide_banner', '-version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        version = parse_ffmpeg_version(result.stdout)
+    except OSError:
+        version = None
+    if version is not None and version < (5, 1):
+        return ['-vsync', 'passthrough']
+    return ['-fps_mode', 'passthrough']
+
+def clamp_crop(crop, width, height):
+    """
+    Clips an (x, y, w, h) rectangle to the frame, the same way numpy slicing would.
+    """
+    x, y, w, h = crop
+    x_start = min(max(x, 0), width)
+    y_start = min(max(y, 0), height)
+    x_end = min(max(x + w, x_start), width)
+    y_end = min(max(y + h, y_start), height)
+    return x_start, y_start, x_end - x_start, y_end - y_start
+
+class OpenCVSource:
+    """
+    Decodes full frames with cv2.VideoCapture and slices the crop out of them.
+    """
+
+    def __init__(self, video, crop, start_frame=0, end_frame=None, seek_index=None):
+        self.cap = cv2.VideoCapture(video)
+        if not self.cap.isOpened():
+            raise IOError(f"Could not open video {video}")
+        self.luma = False
+
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.crop = clamp_crop(crop, self.width, self.height)
+
+        if seek_index is not None and seek_index.seek(self.cap, start_frame):
+            # Frame-accurate: the index checks where the seek landed
+            self.position = start_frame # Index of the next frame read() will return
+        else:
+            if seek_index is not None:
+                # The failed seek may have left the capture anywhere
+                print(f"Warning: Could not seek to frame {start_frame} of {video} with the seek index, using OpenCV's seek",
+                      file=sys.stderr)
+            if start_frame > 0 or seek_index is not None:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            self.position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        self.end_frame = end_frame
+        self.frame = None # Reused decode buffer
+
+    def grab(self):
+        """
+        Advances to the next frame without converting it. False at the end of the range.
+        """
+        if self.end_frame is not None and self.position >= self.end_frame:
+            return False
+        if not self.cap.grab():
+            return False
+        self.position += 1
+        return True
+
+    def retrieve(self):
+        """
+        Decodes the grabbed frame and returns its crop.
+        """
+        ret, self.frame = self.cap.retrieve(self.frame)
+        if not ret:
+            return None
+        x, y, w, h = self.crop
+        return self.frame[y:y + h, x:x + w]
+
+    def read(self):
+        """
+        Returns the crop of the next frame, or None at the end of the range.
+        """
+        if not self.grab():
+            return None
+        return self.retrieve()
+
+    def release(self):
+        self.cap.release()
+
+class FFmpegSource:
+    """
+    Streams only the crop rectangle out of an ffmpeg subprocess.
+
+    ffmpeg does the crop and the YUV -> BGR conversion, so the conversion and
+    the pipe copy only touch the pixels we actually use. Every frame is read
+    into the same buffer with readinto() and exposed through np.frombuffer.
+    """
+
+    def __init__(self, video, crop, start_frame=0, end_frame=None, ffmpeg='ffmpeg', seek_index=None, luma=False):
+        self.fps, self.width, self.height, _ = probe_video(video)
+        self.luma = luma
+        self.crop = clamp_crop(crop, self.width, self.height)
+        x, y, w, h = self.crop
+        if w == 0 or h == 0:
+            raise ValueError(f"Crop {crop} is outside the {self.width}x{self.height} frame")
+
+        cmd = [ffmpeg, '-v', 'error', '-nostdin']
+        if start_frame > 0:
+            # Accurate input seek: frames before this timestamp are decoded and dropped.
+            # Half a frame early, so rounding can never skip the start frame itself.
+            if seek_index is not None:
+                # Real timestamps (variable frame rate safe): halfway between the previous frame and the start frame
+                seek_time = (seek_index.time_of_frame(start_frame - 1) + seek_index.time_of_frame(start_frame)) / 2
+            else:
+                seek_time = (start_frame - 0.5) / self.fps
+            cmd += ['-ss', f"{seek_time:.6f}"]
+        # extractplanes copies the Y plane as it is (format=gray would rescale it to full range)
+        pixel_format = 'gray' if luma else 'bgr24'
+        conversion = 'extractplanes=y' if luma else 'format=bgr24'
+        # ffmpeg crops a rectangle aligned to 2 pixels around ours, which we slice in retrieve():
+        # - without exact=1 the crop of a 4:2:0 video snaps to even offsets and sizes,
+        #   and the frames in the pipe no longer have the size we read
+        # - with it, an odd edge interpolates the subsampled chroma differently than
+        #   converting the whole frame (what opencv does) would
+        x0, y0 = x - x % 2, y - y % 2
+        w0 = min(x + w + (x + w) % 2, self.width) - x0
+        h0 = min(y + h + (y + h) % 2, self.height) - y0
+        cmd += ['-i', video, '-map', '0:v:0', *passthrough_args(ffmpeg), '-vf', f"crop={w0}:{h0}:{x0}:{y0}:exact=1,{conversion}"]
+        if end_frame is not None:
+            cmd += ['-frames:v', str(max(end_frame - start_frame, 0))]
+        cmd += ['-f', 'rawvideo', '-pix_fmt', pixel_format, '-']
+
+        try:
+            self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        except FileNotFoundError:
+            raise IOError(f"Could not run {ffmpeg}. Install FFmpeg or use the opencv backend.")
+
+        self.position = start_frame
+        self.end_frame = end_frame
+        shape = (h0, w0) if luma else (h0, w0, 3)
+        self.buffer = bytearray(int(np.prod(shape)))
+        self.view = memoryview(self.buffer)
+        self.frame = np.frombuffer(self.buffer, dtype=np.uint8).reshape(shape)[y - y0:y - y0 + h, x - x0:x - x0 + w]
+
+    def grab(self):
+        """
+        Reads the next frame's bytes into the buffer. False at the end of the stream.
+        """
+        filled = 0
+        while filled < len(self.buffer):
+            n = self.proc.stdout.readinto(self.view[filled:])
+            if not n:
+                break
+            filled += n
+        if filled == len(self.buffer):
+            self.position += 1
+            return True
+
+        # End of stream: only a clean exit after whole frames is the end of the video
+        if self.proc.wait() != 0:
+            raise IOError(f"ffmpeg failed (exit code {self.proc.returncode}) at frame {self.position}")
+        if filled > 0:
+            raise IOError(f"ffmpeg returned a partial frame ({filled} of {len(self.buffer)} bytes) at frame {self.position}")
+        return False
+
+    def retrieve(self):
+        """
+        Returns the crop of the grabbed frame (a view of the shared buffer).
+        """
+        return self.frame
+
+    def read(self):
+        """
+        Returns the crop of the next frame, or None at the end of the range.
+        """
+        if not self.grab():
+            return None
+        return self.retrieve()
+
+    def release(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.stdout.close()
+        self.proc.wait()
+
+class RawVideoSource:
+    """
+    Reads raw bgr24 frames of a known size from a binary stream (a named pipe,
+    stdin, or anything ffmpeg -f rawvideo writes to) and hands out the crop.
+    """
+
+    def __init__(self, stream, width, height, crop, fps):
+        self.stream = stream
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.crop = clamp_crop(crop, width, height)
+        self.luma = False
+        self.position = 0
+        self.buffer = bytearray(width * height * 3)
+        self.view = memoryview(self.buffer)
+        self.frame = np.frombuffer(self.buffer, dtype=np.uint8).reshape(height, width, 3)
+
+    def grab(self):
+        """
+        Reads the next frame's bytes into the buffer. False at the end of the stream.
+        """
+        filled = 0
+        while filled < len(self.buffer):
+            n = self.stream.readinto(self.view[filled:])
+            if not n:
+                return False # Writer closed the pipe (or a truncated last frame)
+            filled += n
+        self.position += 1
+        return True
+
+    def retrieve(self):
+        x, y, w, h = self.crop
+        return self.frame[y:y + h, x:x + w]
+
+    def read(self):
+        """
+        Returns the crop of the next frame, or None at the end of the stream.
+        """
+        if not self.grab():
+            return None
+        return self.retrieve()
+
+    def release(self):
+        self.stream.close()
+
+class IntervalSource:
+    """
+    Reads the frames of several (start_frame, end_frame) ranges one after the
+    other, as if they were one video. open_range(start, end) opens a backend
+    source for a range; the next one is only opened once the previous one ends.
+    """
+
+    def __init__(self, open_range, ranges):
+        self.open_range = open_range
+        self.ranges = list(ranges)
+        self.current = 0 # Range being read
+        self.source = open_range(*self.ranges[0])
+        self.fps = self.source.fps
+        self.width = self.source.width
+        self.height = self.source.height
+        self.crop = self.source.crop
+        self.luma = self.source.luma
+
+    @property
+    def position(self):
+        """
+        Absolute frame number of the next frame read() will return.
+        """
+        end = self.ranges[self.current][1]
+        if end is not None and self.source.position >= end and self.current + 1 < len(self.ranges):
+            return self.ranges[self.current + 1][0]
+        return self.source.position
+
+    def grab(self):
+        """
+        Advances to the next frame, moving on to the next range at the end of one.
+        """
+        while not self.source.grab():
+            if self.current + 1 >= len(self.ranges):
+                return False
+            self.source.release()
+            self.current += 1
+            self.source = self.open_range(*self.ranges[self.current])
+        return True
+
+    def retrieve(self):
+        return self.source.retrieve()
+
+    def read(self):
+        """
+        Returns the crop of the next frame, or None after the last range.
+        """
+        if not self.grab():
+            return None
+        return self.retrieve()
+
+    def release(self):
+        self.source.release()
+
+class PrefetchSource:
+    """
+    Decodes ahead of the consumer on a background thread.
+
+    The producer thread calls grab()/retrieve() on the wrapped source and
+    copies each crop into a ring of preallocated buffers. The consumer's
+    read() hands out those buffers in order, so decoding overlaps with strip
+    handling and chunk management (cv2 and the ffmpeg pipe release the GIL).
+
+    Occupancy stats tell which side is the bottleneck: a ring that is
+    usually empty means decode-bound, a ring that is usually full means
+    consume-bound.
+
+    wanted is an optional iterator of booleans, one per frame. Frames it marks
+    False are only grabbed: the consumer may grab() them but not retrieve().
+    """
+
+    SKIPPED = -1 # Queue marker for a frame that was grabbed without pixels
+
+    def __init__(self, source, depth=4, wanted=None):
+        self.source = source
+        self.fps = source.fps
+        self.width = source.width
+        self.height = source.height
+        self.crop = source.crop
+        self.luma = source.luma
+
+        _, _, w, h = source.crop
+        shape = (h, w) if source.luma else (h, w, 3)
+        self.ring = [np.empty(shape, dtype=np.uint8) for _ in range(depth)]
+        self.free_slots = queue.Queue()
+        self.filled_slots = queue.Queue()
+        for slot in range(depth):
+            self.free_slots.put(slot)
+        self.current = None # Slot the consumer is reading, recycled on the next grab()
+        self.wanted = wanted
+        self.stopping = False
+
+        # Stats
+        self.frames = 0
+        self.occupancy_total = 0 # Sum of filled slots seen at each read()
+        self.consumer_wait = 0.0 # Consumer waited for decode
+        self.producer_wait = 0.0 # Producer waited for a free slot
+
+        self.thread = threading.Thread(target=self.produce, daemon=True)
+        self.thread.start()
+
+    def produce(self):
+        try:
+            while True:
+                t0 = time.perf_counter()
+                slot = self.free_slots.get()
+                self.producer_wait += time.perf_counter() - t0
+                if self.stopping or not self.source.grab():
+                    break
+                if self.wanted is not None and not next(self.wanted):
+                    self.free_slots.put(slot)
+                    self.filled_slots.put(self.SKIPPED)
+                    continue
+                band = self.source.retrieve()
+                if band is None:
+                    break
+                np.copyto(self.ring[slot], band)
+                self.filled_slots.put(slot)
+        except Exception as e:
+            self.filled_slots.put(e)
+            return
+        self.filled_slots.put(None)
+
+    @property
+    def position(self):
+        """
+        Index of the next frame read() will return.
+        """
+        return self.source.position - self.filled_slots.qsize()
+
+    def grab(self):
+        """
+        Moves to the next decoded frame. False at the end of the range.
+        """
+        if self.current is not None:
+            if self.current != self.SKIPPED:
+                self.free_slots.put(self.current)
+            self.current = None
+
+        self.occupancy_total += self.filled_slots.qsize()
+        t0 = time.perf_counter()
+        slot = self.filled_slots.get()
+        self.consumer_wait += time.perf_counter() - t0
+
+        if slot is None:
+            self.filled_slots.put(None) # Stay at the end on further reads
+            return False
+        if isinstance(slot, Exception):
+            raise slot
+        self.frames += 1
+        self.current = slot
+        return True
+
+    def retrieve(self):
+        """
+        Returns the crop of the grabbed frame.
+        """
+        if self.current == self.SKIPPED:
+            raise ValueError("Frame was not prefetched (wanted marked it as skipped)")
+        return self.ring[self.current]
+
+    def read(self):
+        """
+        Returns the crop of the next frame, or None at the end of the range.
+        """
+        if not self.grab():
+            return None
+        return self.retrieve()
+
+    def summary(self):
+        average = self.occupancy_total / max(self.frames, 1)
+        bottleneck = "decode-bound" if self.consumer_wait > self.producer_wait else "consume-bound"
+        return (f"{average:.1f}/{len(self.ring)} frames buffered on average, "
+                f"consumer waited {self.consumer_wait:.1f}s, producer waited {self.producer_wait:.1f}s ({bottleneck})")
+
+    def release(self):
+        # Unblock the producer (it may be waiting for a free slot) and let it finish
+        self.stopping = True
+        self.free_slots.put(0)
+        self.thread.join()
+        self.source.release()
+
+def open_source(backend, video, crop, start_frame=0, end_frame=None, ffmpeg='ffmpeg', prefetch=0, wanted=None, seek_index=None,
+                ranges=None, luma=False):
+    """
+    Creates a frame source for the given backend name.
+    A SeekIndex (seek_index.py) makes the initial seek frame-accurate.
+    ranges is an optional list of (start_frame, end_frame) to read instead of
+    start_frame .. end_frame. luma=True returns Y plane crops instead of BGR (ffmpeg backend only).
+    With prefetch > 0 frames are decoded ahead on a background thread,
+    converting only the frames the optional wanted iterator asks for.
+    """
+    if luma and backend != 'ffmpeg':
+        raise ValueError("Only the ffmpeg backend decodes the luma plane")
+
+    def open_range(start, end):
+        if backend == 'ffmpeg':
+            return FFmpegSource(video, crop, start, end, ffmpeg=ffmpeg, seek_index=seek_index, luma=luma)
+        return OpenCVSource(video, crop, start, end, seek_index=seek_index)
+
+    if ranges is not None and len(ranges) > 1:
+        source = IntervalSource(open_range, ranges)
+    else:
+        if ranges is not None:
+            start_frame, end_frame = ranges[0]
+        source = open_range(start_frame, end_frame)
+    if prefetch > 0:
+        source = PrefetchSource(source, prefetch, wanted)
+    return source
@@ -0,0 +1,213 @@
+import argparse
+import collections
+import json
+import math
+import sys
+import time
+
+import numpy as np
+
+from detect_notes import StreamingDetector
+from frame_sources import OpenCVSource, RawVideoSource
+from slit_scan import slit_schedule
+
+# =============================================================================
+# LIVE CAPTURE
+# =============================================================================
+# Slit-scan and note detection while the video is still being played.
+#
+# Frames come from a capture device (OpenCV) or as raw bgr24 frames on a pipe
+# or stdin. The scan strip of every frame is reduced to its max channel (what
+# detection looks at) and appended to an in-memory ring buffer of waterfall
+# rows, and the new rows go straight into the streaming detector. There are
+# no chunk files.
+#
+# Notes and bar lines are written to stdout (or --output) as NDJSON, one
+# object per line, as soon as they are final. --max-latency bounds how long
+# that may take: rows older than that are forced through the detector even if
+# a later row could still have merged a note. Log messages go to stderr.
+#
+# TESTING WITH A FILE:
+#   ffmpeg -re -i video.mp4 -f rawvideo -pix_fmt bgr24 - | \
+#     python scripts/live_capture.py --input - --width 1920 --height 1080 --fps 60 \
+#       --y 700 --x1 444 --x2 1220 --speed 7.3 --lanes 4
+# (-re plays the file in real time, like a capture card would deliver it.)
+# =============================================================================
+
+class WaterfallRing:
+    """
+    The last `capacity` waterfall rows (max channel), in time order, with the
+    video time and the wall-clock arrival time of every row.
+    Row g of the waterfall lives at slot g % capacity.
+    """
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.gray = np.zeros((capacity, width), dtype=np.uint8)
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.arrivals = np.zeros(capacity, dtype=np.float64)
+        self.rows = 0 # Rows appended so far
+
+    def append(self, rows, times, arrival):
+        """
+        Appends (n, width) rows, earliest first. Returns their global row range.
+        """
+        start = self.rows
+        slots = np.arange(start, start + len(rows)) % self.capacity
+        self.gray[slots] = rows
+        self.times[slots] = times
+        self.arrivals[slots] = arrival
+        self.rows += len(rows)
+        return start, self.rows
+
+    def rows_between(self, start, end):
+        """
+        Rows start .. end as a contiguous array (they must still be in the ring).
+        """
+        if end - start > self.capacity or start < self.rows - self.capacity:
+            raise ValueError(f"Rows {start}..{end} are no longer in the ring buffer")
+        return self.gray[np.arange(start, end) % self.capacity]
+
+    def row_value(self, values, row):
+        """
+        Linear interpolation of a per-row array at a fractional global row.
+        """
+        row = min(max(row, max(self.rows - self.capacity, 0)), self.rows - 1)
+        lo = int(math.floor(row))
+        hi = min(lo + 1, self.rows - 1)
+        frac = row - lo
+        return float(values[lo % self.capacity] * (1 - frac) + values[hi % self.capacity] * frac)
+
+    def time_at(self, row):
+        return self.row_value(self.times, row)
+
+    def arrival_at(self, row):
+        return self.row_value(self.arrivals, row)
+
+def open_live_source(args, crop):
+    if args.device is not None:
+        source = OpenCVSource(args.device, crop)
+        fps = args.fps or source.fps or 60.0
+        return source, fps
+    if args.width is None or args.height is None:
+        raise ValueError("--input needs --width and --height (raw bgr24 frames)")
+    stream = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+    fps = args.fps or 60.0
+    return RawVideoSource(stream, args.width, args.height, crop, fps), fps
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Live slit-scan with streaming note detection (NDJSON output)')
+    parser.add_argument('--device', type=int, help='Capture device index (OpenCV)')
+    parser.add_argument('--input', type=str, help='Raw bgr24 video from a named pipe or file, "-" for stdin')
+    parser.add_argument('--width', type=int, help='Frame width of the raw input')
+    parser.add_argument('--height', type=int, help='Frame height of the raw input')
+    parser.add_argument('--fps', type=float, default=0.0, help='Frame rate (raw input defaults to 60, devices report their own)')
+    parser.add_argument('--output', type=str, help='NDJSON output file (default stdout)')
+    parser.add_argument('--y', type=int, required=True, help='Y coordinate of the scan line')
+    parser.add_argument('--x1', type=int, required=True, help='Left X coordinate of the track')
+    parser.add_argument('--x2', type=int, required=True, help='Right X coordinate of the track')
+    parser.add_argument('--speed', type=float, default=10.0, help='Scroll speed in pixels per frame (Slit Height)')
+    parser.add_argument('--lanes', type=int, default=9, help='Number of lanes')
+    parser.add_argument('--lane-ratios', type=str, help='Comma-separated lane width ratios (e.g. "1,1.5,1")')
+    parser.add_argument('--threshold', type=int, default=200, help='Brightness threshold (0-255)')
+    parser.add_argument('--min-height', type=int, default=3, help='Minimum note height in pixels')
+    parser.add_argument('--merge-gap', type=int, default=5, help='Max gap to merge segments')
+    parser.add_argument('--max-latency', type=float, default=250.0,
+                        help='Report every note at most this many ms after its rows arrived (0 waits for certainty)')
+    parser.add_argument('--ring-rows', type=int, default=20000, help='Waterfall rows kept in memory')
+
+    args = parser.parse_args()
+
+    if (args.device is None) == (args.input is None):
+        log("Error: Pass exactly one of --device or --input")
+        sys.exit(1)
+
+    lane_ratios = [1.0] * args.lanes
+    if args.lane_ratios:
+        try:
+            lane_ratios = [float(x) for x in args.lane_ratios.split(',')]
+        except ValueError:
+            log("Error: --lane-ratios expects comma-separated numbers")
+            sys.exit(1)
+        if len(lane_ratios) != args.lanes:
+            log(f"Error: Number of ratios ({len(lane_ratios)}) does not match lanes ({args.lanes})")
+            sys.exit(1)
+    normalized_ratios = [r / sum(lane_ratios) for r in lane_ratios]
+
+    crop = (args.x1, args.y, args.x2 - args.x1, max(1, math.ceil(args.speed)))
+    try:
+        source, fps = open_live_source(args, crop)
+    except (IOError, ValueError) as e:
+        log(f"Error: {e}")
+        sys.exit(1)
+    x, y, w, h = source.crop
+    if w == 0 or h == 0:
+        log(f"Error: Scan line is outside the {source.width}x{source.height} frame")
+        sys.exit(1)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    ring = WaterfallRing(args.ring_rows, w)
+    detector = StreamingDetector(w, normalized_ratios, args.threshold, args.min_height, args.merge_gap)
+    schedule = slit_schedule(args.speed)
+    frame_rows = collections.deque() # (end row, arrival) of recent frames, for the latency bound
+
+    def emit(events, now):
+        for event in events:
+            event["time"] = ring.time_at(event["global_y"])
+            # Measured from the arrival of the row that completed the note
+            top = event["global_y"] + event.get("h", 0) / 2 - 1
+            event["latency_ms"] = round((now - ring.arrival_at(top)) * 1000.0, 1)
+            out.write(json.dumps(event) + "\n")
+        if events:
+            out.flush()
+
+    log(f"Live capture: {w}x{h} band at ({x}, {y}), {fps:.2f} fps, max latency {args.max_latency:.0f} ms")
+    frames = 0
+    notes = 0
+    try:
+        while source.grab():
+            now = time.perf_counter()
+            frame = frames
+            frames += 1
+            slit_height, _, _ = next(schedule)
+            band = source.retrieve()
+            strip = band[:min(slit_height, h)]
+
+            # Bottom row of the strip is the earliest: reverse to time order, reduce to the max channel
+            rows = np.max(strip[::-1], axis=2)
+            times = (frame + np.arange(len(rows)) / max(len(rows), 1)) / fps
+            start, end = ring.append(rows, times, now)
+            events = detector.feed(ring.rows_between(start, end))
+
+            # Force out whatever has waited longer than the latency budget
+            frame_rows.append((end, now))
+            if args.max_latency > 0:
+                force_row = None
+                while frame_rows and now - frame_rows[0][1] >= args.max_latency / 1000.0:
+                    force_row = frame_rows.popleft()[0]
+                if force_row is not None:
+                    events += detector.flush(force_row)
+            elif len(frame_rows) > 1:
+                frame_rows.popleft()
+
+            notes += sum(1 for event in events if event["type"] == "note")
+            emit(events, now)
+    except KeyboardInterrupt:
+        log("Interrupted")
+    finally:
+        events = detector.flush()
+        notes += sum(1 for event in events if event["type"] == "note")
+        emit(events, time.perf_counter())
+        out.write(json.dumps({"type": "end", "frames": frames, "rows": ring.rows, "notes": notes}) + "\n")
+        out.flush()
+        source.release()
+        if out is not sys.stdout:
+            out.close()
+
+    log(f"Done: {frames} frames, {ring.rows} rows, {notes} notes")
+
+if __name__ == "__main__":
+    main()
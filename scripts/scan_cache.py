@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+# =============================================================================
+# SLIT-SCAN CACHE
+# =============================================================================
+# Scanning a long video takes minutes, but the result only depends on the
+# video and a handful of parameters. The cache stores finished outputs under a
+# key built from both, so scanning the same thing again is a copy.
+#
+# KEY:
+# - A fast video fingerprint: file size, mtime and a hash of a few sampled
+#   blocks (we never read the whole file).
+# - The canonicalised scan parameters (sorted keys, normalised numbers).
+#
+# LAYOUT:
+#   <cache_dir>/index.json     key -> {size, created, last_used, video, params}
+#   <cache_dir>/<key>/...      copy of the output directory
+#
+# Entries are evicted least-recently-used first when the cache grows past its
+# quota.
+# =============================================================================
+
+INDEX_FILENAME = "index.json"
+LOCK_FILENAME = "index.lock"
+SAMPLE_COUNT = 16
+SAMPLE_SIZE = 64 * 1024
+
+# Files in an output directory that are not part of the scan result
+EXCLUDED_FILES = {"notes.json"}
+
+# What a scan writes into its output directory (besides chunk_*.jpg, roi_* directories and shard checkpoints)
+SCAN_OUTPUTS = {"metadata.json", "frame_index.bin", "frame_index.partial", "waterfall.npy", "duplicate_frames.npy",
+                "pyramid.json", "pyramid", "preview"}
+SCAN_OUTPUT_PREFIXES = ("chunk_", "roi_", "checkpoint_shard_", "frame_index_shard_")
+
+def video_fingerprint(path):
+    """
+    Size, mtime and a hash of SAMPLE_COUNT evenly spaced blocks of the file.
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for i in range(SAMPLE_COUNT):
+            offset = max(stat.st_size - SAMPLE_SIZE, 0) * i // max(SAMPLE_COUNT - 1, 1)
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_SIZE))
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sample_sha1": digest.hexdigest()
+    }
+
+def canonical(value):
+    """
+    Normalises parameters so equal scans produce equal keys (10 and 10.0 are the same speed).
+    """
+    if isinstance(value, dict):
+        return {str(k): canonical(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    return str(value)
+
+def cache_key(video, params):
+    """
+    Content-addressed key for scanning this video with these parameters.
+    """
+    payload = json.dumps({"video": video_fingerprint(video), "params": canonical(params)}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def tree_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def copy_tree(src, dst):
+    """
+    Copies a directory's files (recursively) into dst, skipping EXCLUDED_FILES.
+    """
+    os.makedirs(dst, exist_ok=True)
+    for name in os.listdir(src):
+        if name in EXCLUDED_FILES:
+            continue
+        src_path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+        if os.path.isdir(src_path):
+            copy_tree(src_path, dst_path)
+        else:
+            shutil.copyfile(src_path, dst_path)
+
+def clear_scan_outputs(output_dir):
+    """
+    Removes everything an earlier scan wrote into output_dir (chunks of a longer
+    scan would otherwise survive next to the new ones). Other files are kept.
+    """
+    if not os.path.isdir(output_dir):
+        return
+    for name in os.listdir(output_dir):
+        if name in SCAN_OUTPUTS or name.startswith(SCAN_OUTPUT_PREFIXES):
+            path = os.path.join(output_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+class ScanCache:
+    """
+    Directory of finished slit-scan outputs with an LRU index.
+    """
+
+    def __init__(self, cache_dir, quota_bytes):
+        self.cache_dir = cache_dir
+        self.quota_bytes = quota_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def lock(self, timeout=60.0):
+        """
+        Cross-process lock around index.json (several scans may share the cache).
+        """
+        return IndexLock(os.path.join(self.cache_dir, LOCK_FILENAME), timeout)
+
+    def read_index(self):
+        path = os.path.join(self.cache_dir, INDEX_FILENAME)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            return {} # A corrupt index only costs us the cached entries
+
+    def write_index(self, index):
+        path = os.path.join(self.cache_dir, INDEX_FILENAME)
+        with open(path + ".tmp", 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def restore(self, key, output_dir):
+        """
+        Replaces the scan outputs in output_dir with a cached output. Returns False on a miss.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        with self.lock():
+            index = self.read_index()
+            if key not in index or not os.path.isdir(entry_dir):
+                return False
+            # Mark it used first, so a concurrent store() does not evict it while we copy
+            index[key]["last_used"] = time.time()
+            self.write_index(index)
+        # Copy next to the output first, so a failed copy leaves the output as it was
+        staging_dir = f"{os.path.abspath(output_dir)}.tmp-{os.getpid()}"
+        try:
+            copy_tree(entry_dir, staging_dir)
+        except OSError:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return False # Evicted under our feet after all
+        os.makedirs(output_dir, exist_ok=True)
+        clear_scan_outputs(output_dir)
+        for name in os.listdir(staging_dir):
+            os.replace(os.path.join(staging_dir, name), os.path.join(output_dir, name))
+        os.rmdir(staging_dir)
+        return True
+
+    def store(self, key, output_dir, video, params):
+        """
+        Adds a finished output to the cache, then evicts older entries over the quota.
+        Returns the evicted keys, or None if the output alone is larger than the quota (it is not cached).
+        """
+        if tree_size(output_dir) > self.quota_bytes:
+            return None
+        # Copy outside the lock (it can take a while), then swap it in
+        entry_dir = os.path.join(self.cache_dir, key)
+        staging_dir = f"{entry_dir}.tmp-{os.getpid()}"
+        copy_tree(output_dir, staging_dir)
+        with self.lock():
+            index = self.read_index()
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir)
+            os.replace(staging_dir, entry_dir)
+            now = time.time()
+            index[key] = {
+                "size": tree_size(entry_dir),
+                "created": now,
+                "last_used": now,
+                "video": os.path.basename(video),
+                "params": canonical(params)
+            }
+            evicted = self.evict(index, keep=key)
+            self.write_index(index)
+        return evicted
+
+    def evict(self, index, keep=None):
+        """
+        Removes least-recently-used entries (other than keep) until the cache fits its quota.
+        Returns the evicted keys.
+        """
+        evicted = []
+        total = sum(entry["size"] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]["last_used"]):
+            if total <= self.quota_bytes:
+                break
+            if key == keep:
+                continue
+            total -= index[key]["size"]
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            del index[key]
+            evicted.append(key)
+        return evicted
+
+class IndexLock:
+    """
+    Lock file created with O_EXCL. A lock older than the timeout is assumed stale.
+    """
+
+    def __init__(self, path, timeout):
+        self.path = path
+        self.timeout = timeout
+
+    def __enter__(self):
+        t0 = time.time()
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.timeout:
+                        os.remove(self.path) # Left behind by a crashed process
+                        continue
+                except OSError:
+                    continue # Released while we were looking
+                if time.time() - t0 > self.timeout:
+                    raise IOError(f"Timed out waiting for {self.path}")
+                time.sleep(0.05)
+
+    def __exit__(self, *exc):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
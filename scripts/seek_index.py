@@ -0,0 +1,183 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+from scan_cache import video_fingerprint
+
+# =============================================================================
+# SEEK INDEX
+# =============================================================================
+# cap.set(CAP_PROP_POS_FRAMES, n) guesses where frame n is from the frame rate
+# and the timestamps it lands on. On long-GOP or variable frame rate captures
+# that guess can land on the wrong frame, and every calibration click pays for
+# it again.
+#
+# The seek index is built once per video, from the packets alone (no frame is
+# decoded, so it takes well under a second per minute of video):
+# - pts_ms:    presentation time of every frame, in display order
+# - keyframes: frame numbers of the keyframes
+# - vfr:       whether the frame durations vary
+#
+# It is cached next to the video as <video>.seekindex.npz and rebuilt when the
+# video changes. With it we can turn times into frame numbers exactly, and
+# check (and fix) where a seek actually landed.
+# =============================================================================
+
+INDEX_SUFFIX = ".seekindex.npz"
+
+# Frame durations within this fraction of the median still count as constant
+# (timestamps in a 1/1000 time base jitter by a millisecond)
+VFR_TOLERANCE = 0.25
+
+class SeekIndex:
+    """
+    Frame timestamps and keyframes of one video.
+    """
+
+    def __init__(self, pts_ms, keyframes, fps):
+        self.pts_ms = np.asarray(pts_ms, dtype=np.float64)
+        self.keyframes = np.asarray(keyframes, dtype=np.int64)
+        self.fps = fps
+        self.frame_count = len(self.pts_ms)
+
+        durations = np.diff(self.pts_ms)
+        if len(durations) > 0:
+            median = np.median(durations)
+            self.vfr = bool(np.any(np.abs(durations - median) > VFR_TOLERANCE * median))
+            self.min_duration = float(durations.min())
+            self.frame_duration = float(median)
+        else:
+            self.vfr = False
+            self.min_duration = 1000.0 / fps if fps > 0 else 1000.0
+            self.frame_duration = self.min_duration
+
+    @classmethod
+    def build(cls, video):
+        """
+        Reads every packet of the video stream (without decoding) and records
+        its timestamp and keyframe flag.
+        """
+        cap = cv2.VideoCapture(video, cv2.CAP_FFMPEG)
+        if not cap.isOpened():
+            raise IOError(f"Could not open video {video}")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        # Raw mode: grab() returns the next packet instead of decoding it
+        if not cap.set(cv2.CAP_PROP_FORMAT, -1):
+            cap.release()
+            raise IOError(f"Could not read the packets of {video}")
+
+        pts_ms = []
+        is_key = []
+        while cap.grab():
+            pts_ms.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+            is_key.append(bool(cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME)))
+        cap.release()
+
+        # Packets come in decode order. With B-frames that is not display order,
+        # so sort by timestamp: frame n is the n-th smallest timestamp.
+        pts_ms = np.asarray(pts_ms, dtype=np.float64)
+        order = np.argsort(pts_ms, kind='stable')
+        keyframes = np.nonzero(np.asarray(is_key, dtype=bool)[order])[0]
+        return cls(pts_ms[order], keyframes, fps)
+
+    @classmethod
+    def load_or_build(cls, video):
+        """
+        Loads the cached index next to the video, or builds (and caches) it.
+        """
+        path = video + INDEX_SUFFIX
+        fingerprint = json.dumps(video_fingerprint(video), sort_keys=True)
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    if str(data["fingerprint"]) == fingerprint:
+                        return cls(data["pts_ms"], data["keyframes"], float(data["fps"]))
+            except (OSError, ValueError, KeyError):
+                pass # Unreadable cache, rebuild it
+
+        index = cls.build(video)
+        try:
+            with open(path + ".tmp", 'wb') as f:
+                np.savez(f, pts_ms=index.pts_ms, keyframes=index.keyframes, fps=index.fps,
+                         fingerprint=np.array(fingerprint))
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Warning: Could not cache the seek index ({e})")
+        return index
+
+    def frame_at_time(self, seconds):
+        """
+        The frame on screen at this time (the last one that starts at or before it).
+        """
+        i = np.searchsorted(self.pts_ms, seconds * 1000.0 + 1e-6, side='right') - 1
+        return int(min(max(i, 0), self.frame_count))
+
+    def frame_at_ms(self, ms):
+        """
+        Frame number of a decoded frame, from the timestamp the decoder reports.
+        """
+        i = np.searchsorted(self.pts_ms, ms + 0.5 * self.min_duration, side='right') - 1
+        return int(max(i, 0))
+
+    def time_of_frame(self, frame):
+        """
+        Presentation time of a frame in seconds.
+        """
+        if self.frame_count == 0:
+            return 0.0
+        return float(self.pts_ms[min(max(frame, 0), self.frame_count - 1)]) / 1000.0
+
+    def times_of_frames(self, first, end):
+        """
+        Presentation times in seconds of frames first .. end - 1
+        (frames past the last one follow it a median frame duration apart).
+        """
+        frames = np.arange(first, end)
+        last = self.frame_count - 1
+        if last < 0:
+            return frames * self.frame_duration / 1000.0
+        clipped = np.clip(frames, 0, last)
+        return (self.pts_ms[clipped] + (frames - clipped) * self.frame_duration) / 1000.0
+
+    def keyframe_before(self, frame):
+        """
+        The last keyframe at or before a frame (decoding has to start there).
+        """
+        i = np.searchsorted(self.keyframes, frame, side='right') - 1
+        return int(self.keyframes[i]) if i >= 0 else 0
+
+    def seek(self, cap, frame):
+        """
+        Positions a decoding cv2.VideoCapture so that the next grab() returns this frame.
+
+        OpenCV's seek already starts decoding at a keyframe, but it works out
+        which frame it reached from the frame rate. We grab the frame before
+        the target instead and check its timestamp against the index: if the
+        seek landed short we decode forward, if it overshot we seek again from
+        an earlier keyframe.
+        """
+        if frame <= 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            return True
+        target = frame - 1 # The last frame we grab ourselves
+        seek_to = target
+        while True:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, seek_to)
+            if not cap.grab():
+                return False
+            current = self.frame_at_ms(cap.get(cv2.CAP_PROP_POS_MSEC))
+            if current <= target:
+                break
+            if seek_to == 0:
+                return False # Even the first frame is past the target: the timestamps do not match this video
+            # Overshot: try again from an earlier keyframe
+            seek_to = self.keyframe_before(min(seek_to, self.keyframe_before(target)) - 1)
+
+        # Decode forward to the frame before the target
+        while current < target:
+            if not cap.grab():
+                return False
+            current = self.frame_at_ms(cap.get(cv2.CAP_PROP_POS_MSEC))
+        return current == target
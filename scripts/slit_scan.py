@@ -4,6 +4,39 @@ import argparse
 import os
 import sys
 import json
+import math
+import queue
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from duplicate_frames import DUPLICATE_MODES, DuplicateDetector, duplicate_region, save_duplicates
+from find_gameplay import detect_gameplay, parse_intervals
+from frame_index import write_index
+from frame_sources import BACKENDS, clamp_crop, open_source, probe_video
+from scan_cache import ScanCache, cache_key, clear_scan_outputs
+from seek_index import SeekIndex
+from telemetry import ProgressReporter
+from waterfall_store import STORE_FILENAME, StoreWriter, create_store, finalize_store
+
+# Strip heights saved at each checkpoint, turned into frame_index.bin when the scan completes
+PARTIAL_INDEX_FILENAME = "frame_index.partial"
+# A scan split into shards (--workers) checkpoints every shard on its own, in these files
+SHARD_CHECKPOINT_FILENAME = "checkpoint_shard_{}.json"
+SHARD_PARTIAL_INDEX_FILENAME = "frame_index_shard_{}.partial"
+
+# Chunk storage: full colour, only the max-channel brightness plane (what detection looks at),
+# or the video's Y plane straight from the decoder (no BGR conversion at all)
+CHANNEL_MODES = ['bgr', 'max', 'luma']
+
+# Subdirectory for the downscaled colour preview chunks (--preview-scale)
+PREVIEW_DIRNAME = "preview"
+
+# Downsampled copies of the displayed chunks (1/2, 1/4, ...) for zoomed-out views,
+# in <display dir>/pyramid/<factor>/, described by OUTPUT/pyramid.json
+PYRAMID_DIRNAME = "pyramid"
+PYRAMID_MANIFEST_FILENAME = "pyramid.json"
 
 # =============================================================================
 # SLIT-SCAN GENERATOR
@@ -28,166 +61,1305 @@ def main():
     parser = argparse.ArgumentParser(description='Generate Slit-Scan Waterfall from Video')
     parser.add_argument('--video', required=True, help='Path to input video file')
     parser.add_argument('--output', required=True, help='Directory to save output chunks')
-    parser.add_argument('--y', type=int, required=True, help='Y coordinate of the scan line')
-    parser.add_argument('--x1', type=int, required=True, help='Left X coordinate of the track')
-    parser.add_argument('--x2', type=int, required=True, help='Right X coordinate of the track')
+    parser.add_argument('--y', type=int, help='Y coordinate of the scan line')
+    parser.add_argument('--x1', type=int, help='Left X coordinate of the track')
+    parser.add_argument('--x2', type=int, help='Right X coordinate of the track')
+    parser.add_argument('--roi', action='append', default=[], metavar='Y,X1,X2',
+                        help='Scan line as "y,x1,x2". Repeat to scan several ROIs in one pass (each goes to OUTPUT/roi_{i})')
     parser.add_argument('--chunk-size', type=int, default=5000, help='Height of each output image chunk')
     parser.add_argument('--start', type=float, default=0.0, help='Start time in seconds')
     parser.add_argument('--end', type=float, default=0.0, help='End time in seconds (0 for end of video)')
+    parser.add_argument('--intervals', type=str,
+                        help='Only scan these parts of the video: "auto" (find the gameplay with find_gameplay.py), '
+                             'a JSON file written by find_gameplay.py, or "start-end,start-end" in seconds')
     parser.add_argument('--speed', type=float, default=10.0, help='Scroll speed in pixels per frame (Slit Height)')
+    parser.add_argument('--stride', type=int, default=0,
+                        help='Stride mode: retrieve every N-th frame and take N * speed rows from it; frames without rows are only grabbed. '
+                             'Use 1 for speeds below 1 px/frame (0 keeps the legacy 1 px minimum)')
+    parser.add_argument('--duplicates', choices=DUPLICATE_MODES, default='off',
+                        help='Find frames that repeat the previous one (detect: record them in metadata, '
+                             'collapse: also give their rows to the next unique frame, see duplicate_frames.py)')
+    parser.add_argument('--duplicate-threshold', type=float, default=0.3,
+                        help='Mean absolute difference (0-255) of the shrunk region below which a frame is a duplicate')
+    parser.add_argument('--duplicate-height', type=int, default=64, help='Rows above the scan line compared between frames')
+    parser.add_argument('--max-duplicate-run', type=int, default=3,
+                        help='Longest run of duplicates; a longer one is a static screen and has none')
+    parser.add_argument('--channels', choices=CHANNEL_MODES, default='bgr',
+                        help='Chunk storage: full colour (bgr), the max-channel brightness plane detection uses (max), '
+                             'or the luma plane decoded without any colour conversion (luma, --backend ffmpeg only)')
+    parser.add_argument('--preview-scale', type=float, default=0.0,
+                        help='Also save colour chunks downscaled by this factor in OUTPUT/preview (e.g. 0.25, 0 for none)')
+    parser.add_argument('--pyramid-levels', type=int, default=0,
+                        help='Also save the displayed chunks at 1/2, 1/4, ... size for zoomed-out viewing (3 goes down to 1/8, 0 for none)')
+    parser.add_argument('--store', action='store_true',
+                        help='Also write the whole waterfall losslessly to OUTPUT/waterfall.npy (time ascending, see waterfall_store.py)')
+    parser.add_argument('--backend', choices=BACKENDS, default='opencv', help='Decode backend (ffmpeg crops inside an ffmpeg subprocess)')
+    parser.add_argument('--ffmpeg', default='ffmpeg', help='Path to the ffmpeg executable (ffmpeg backend)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes scanning time shards in parallel')
+    parser.add_argument('--prefetch', type=int, default=4, help='Frames decoded ahead on a background thread (0 decodes inline)')
+    parser.add_argument('--writer-threads', type=int, default=1, help='Background threads encoding chunks (0 encodes on the decode thread)')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted scan from its checkpoints (metadata.json, and one file per shard of a parallel scan)')
+    parser.add_argument('--cache-dir', type=str, help='Reuse (and store) finished scans in this cache directory')
+    parser.add_argument('--cache-quota', type=float, default=10240, help='Cache size limit in MB (least recently used entries are evicted)')
+    parser.add_argument('--progress', action='store_true', help='Also print JSON-lines progress events on stdout (see telemetry.py)')
+    parser.add_argument('--progress-interval', type=float, default=0.5, help='Seconds between progress events')
     
     args = parser.parse_args()
 
-    # 1. Open the video file
-    cap = cv2.VideoCapture(args.video)
-    if not cap.isOpened():
+    error = validate_args(args)
+    if error:
+        print(f"Error: {error}")
+        sys.exit(1)
+    intervals = None
+    if args.intervals and args.intervals != 'auto':
+        try:
+            intervals = parse_intervals(args.intervals)
+        except (ValueError, KeyError, OSError) as e:
+            print(f"Error: Could not read --intervals {args.intervals} ({e})")
+            sys.exit(1)
+
+    # 1. Probe the video
+    try:
+        fps, frame_width, frame_height, frame_count = probe_video(args.video)
+    except IOError:
         print(f"Error: Could not open video {args.video}")
         sys.exit(1)
 
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    
-    # Save metadata
-    metadata = {
-        "fps": fps,
-        "speed": args.speed,
-        "chunk_size": args.chunk_size,
-        "y": args.y,
-        "x1": args.x1,
-        "x2": args.x2,
-        "start_time": args.start,
-        "end_time": args.end
-    }
-    
-    if not os.path.exists(args.output):
-        os.makedirs(args.output)
-        
-    with open(os.path.join(args.output, "metadata.json"), 'w') as f:
-        json.dump(metadata, f, indent=2)
+    # Collect the ROIs: either the single --y/--x1/--x2 one, or every --roi
+    try:
+        rois = collect_rois(args)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    # The done event of the whole run (the shards report their own progress), for throughput logs
+    run_progress = ProgressReporter("scan", "frames", enabled=args.progress, backend=args.backend,
+                                    channels=args.channels, workers=args.workers, speed=args.speed)
 
+    # Same video, same parameters: copy the finished output out of the cache,
+    # before the seek index (and the gameplay pre-pass) cost anything
+    cache = None
+    if args.cache_dir and not args.resume:
+        cache = ScanCache(args.cache_dir, int(args.cache_quota * 1024 * 1024))
+        params = cache_params(args, rois, intervals)
+        key = cache_key(args.video, params)
+        if cache.restore(key, args.output):
+            print(f"Cache hit ({key[:12]}), restored {args.output}")
+            run_progress.finish(0, cached=True)
+            print("Done! Waterfall generation complete.")
+            return
+
+    # Keyframes and frame timestamps (built once, cached next to the video)
+    try:
+        seek_index = SeekIndex.load_or_build(args.video)
+        frame_count = seek_index.frame_count
+        if seek_index.vfr:
+            print("Warning: Variable frame rate video, note times use the frame timestamps")
+    except IOError as e:
+        print(f"Warning: No seek index ({e}), seeking by frame rate")
+        seek_index = None
+    
     # Seek to start time
+    start_frame = 0
     if args.start > 0:
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        start_frame = int(args.start * fps)
-        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        start_frame = seek_index.frame_at_time(args.start) if seek_index is not None else int(args.start * fps)
         print(f"Seeking to {args.start}s (Frame {start_frame})")
 
     # Calculate end frame
-    end_frame = float('inf')
+    end_frame = None
     if args.end > 0:
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        end_frame = int(args.end * fps)
+        end_frame = seek_index.frame_at_time(args.end) if seek_index is not None else int(args.end * fps)
         print(f"Processing until {args.end}s (Frame {end_frame})")
 
-    # Ensure output directory exists
-    if not os.path.exists(args.output):
-        os.makedirs(args.output)
+    # The band we need from each frame: the scan line plus the tallest slit below it.
+    # Every ROI is clipped to the frame, and the decoder crops their bounding box.
+    band_height = max(1, math.ceil(args.speed * max(args.stride, 1)))
+    if args.duplicates == 'collapse':
+        # A unique frame also takes the rows of the duplicates before it
+        band_height = max(1, math.ceil(args.speed * (args.max_duplicate_run + 1)))
+    for roi in rois:
+        roi["rect"] = clamp_crop((roi["x1"], roi["y"], roi["x2"] - roi["x1"], band_height), frame_width, frame_height)
+    rects = [roi["rect"] for roi in rois]
+    duplicate_rect = None
+    if args.duplicates != 'off':
+        # Duplicates are judged on the first ROI's track above its scan line
+        duplicate_rect = duplicate_region(rois[0]["y"], rois[0]["x1"], rois[0]["x2"], args.duplicate_height, frame_width, frame_height)
+        rects.append(duplicate_rect)
+    crop = bounding_rect(rects)
 
-    print(f"Processing video: {args.video}")
-    print(f"Scan Line Y: {args.y}, Range X: {args.x1} to {args.x2}")
+    print(f"Processing video: {args.video} ({args.backend} backend)")
+    for roi in rois:
+        print(f"Scan Line Y: {roi['y']}, Range X: {roi['x1']} to {roi['x2']} -> {roi['output']}")
     print(f"Scroll Speed: {args.speed} px/frame")
+    if args.stride > 0:
+        print(f"Stride: {args.stride} frame(s) per strip")
+    if args.channels == 'luma':
+        print("Storing the luma plane (decoded without colour conversion)")
+    elif args.channels != 'bgr':
+        print(f"Storing the {args.channels}-channel plane" + (f" with a {args.preview_scale}x colour preview" if args.preview_scale > 0 else ""))
+    if args.duplicates != 'off':
+        print(f"Duplicate frames: {args.duplicates} (threshold {args.duplicate_threshold}, {args.duplicate_height} rows above the scan line)")
 
-    # Buffer to hold the scan lines for the current chunk
-    chunk_buffer = []
-    chunk_index = 0
-    frame_count = 0
-    current_frame_idx = cap.get(cv2.CAP_PROP_POS_FRAMES)
-    
-    # Accumulator for fractional speed
-    y_accumulator = 0.0
+    if args.intervals == 'auto':
+        print("Finding gameplay intervals...")
+        try:
+            intervals, _ = detect_gameplay(args.video, rois[0]["y"], rois[0]["x1"], rois[0]["x2"], ffmpeg=args.ffmpeg)
+        except (IOError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break # End of video
-        
-        current_frame_idx += 1
-        if current_frame_idx > end_frame:
-            break
+    # The frame ranges to scan, in order. Without --intervals that is just start .. end.
+    ranges = [(start_frame, end_frame)]
+    if intervals is not None:
+        ranges = interval_ranges(intervals, args.start, args.end, seek_index, fps)
+        if not ranges:
+            print("Error: No part of --intervals lies between --start and --end")
+            sys.exit(1)
+        start_frame = ranges[0][0]
+        kept = sum(end - start for start, end in ranges)
+        print(f"Scanning {len(ranges)} interval(s), {kept} frames: " +
+              ", ".join(f"{start}-{end}" for start, end in ranges))
 
-        # 2. Calculate Slit Height for this frame
-        # We add the speed to the accumulator
-        y_accumulator += args.speed
-        
-        # The number of pixels to take this frame is the integer part of the accumulator
-        # minus what we took previously (which is implicitly handled by resetting/decrementing)
-        # Actually, simpler:
-        # We want to advance 'speed' pixels.
-        # We take 'int(speed)' pixels.
-        # We keep the remainder.
-        
-        slit_height = int(y_accumulator)
-        y_accumulator -= slit_height
-        
-        # Ensure we take at least 1 pixel if speed is very slow, or handle 0?
-        # If speed < 1, we might skip frames. For now, let's assume speed >= 1.
-        if slit_height < 1:
-            slit_height = 1 # Force at least 1 pixel to avoid gaps/stalls
-            y_accumulator = 0 # Reset to avoid infinite buildup if speed is tiny
-
-        # 3. Extract the Region of Interest (ROI)
-        # We capture from y downwards
-        # frame.shape is (Height, Width, Channels)
-        y_start = args.y
-        y_end = min(args.y + slit_height, frame.shape[0])
-        
-        scan_strip = frame[y_start:y_end, args.x1:args.x2]
-
-        # 4. Add to buffer
-        if scan_strip.shape[0] > 0:
-            chunk_buffer.append(scan_strip)
-        
-        frame_count += 1
+    # Metadata (one file per ROI)
+    for roi in rois:
+        roi["metadata"] = scan_metadata(args, roi, fps, intervals)
+
+    # Shards and checkpoints count frames through the ranges (offset 0 is the first scanned frame)
+    total_frames = sum((end if end is not None else frame_count) - start for start, end in ranges)
+
+    strip_heights = set(roi["rect"][3] for roi in rois)
+    # Chunk boundaries must fall on the same frames for every ROI.
+    # Duplicates depend on the frame before, and collapsing moves rows between frames:
+    # neither a checkpoint nor a shard can start in the middle of that
+    checkpointing = len(strip_heights) == 1 and args.duplicates == 'off'
 
-        # 5. Check if buffer is full (Chunking)
-        # We check the total height of the buffer
-        # Since each strip has variable height, we can't just count frames.
-        # But for performance, checking len(chunk_buffer) is okay if we assume avg height.
-        # Let's check estimated height.
-        current_chunk_height = len(chunk_buffer) * args.speed
-        if current_chunk_height >= args.chunk_size:
-            save_chunk(chunk_buffer, args.output, chunk_index)
-            chunk_buffer = [] # Clear buffer
-            chunk_index += 1
-            print(f"Processed {frame_count} frames...")
-
-    # 6. Save any remaining lines in the buffer
-    if len(chunk_buffer) > 0:
-        save_chunk(chunk_buffer, args.output, chunk_index)
-
-    cap.release()
+    if args.resume:
+        # Continue from the last checkpoint instead of starting over
+        try:
+            shards, prior_heights = resume_shards(rois)
+        except ValueError as e:
+            print(f"Error: Cannot resume: {e}")
+            sys.exit(1)
+        if shards is None:
+            print("Nothing to resume, the scan is already complete.")
+            return
+        if args.workers > 1 and len(shards) == 1:
+            print("Warning: Resumed scans run serially (the scan was not split into shards)")
+    else:
+        shards = plan_run(args, strip_heights, total_frames)
+        prior_heights = [[] for _ in shards]
+        checkpoint = None
+        if checkpointing:
+            checkpoint = initial_checkpoint(shards, start_frame)
+        prepare_outputs(args.output, rois, checkpoint)
+
+    # A resumed scan only reads the rest
+    run_progress.total = sum(shard_frames(shard, total_frames) for shard in shards if not shard.get("complete"))
+
+    prepare_stores(args, rois, total_frames)
+    config = scan_config(args, rois, crop, ranges, seek_index, total_frames, duplicate_rect)
+    config["checkpoint"] = checkpointing
+    config["sharded"] = len(shards) > 1
+    try:
+        results = run_shards(config, shards, args.workers)
+    except (IOError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    scanned_frames, scanned_rows = merge_shards(args, rois, ranges, start_frame, seek_index, prior_heights, results)
+
+    if cache is not None:
+        evicted = cache.store(key, args.output, args.video, params)
+        if evicted is None:
+            print(f"Not cached: the output is larger than the cache quota ({args.cache_quota:.0f} MB)")
+        else:
+            print(f"Stored in cache ({key[:12]})" + (f", evicted {len(evicted)} old entries" if evicted else ""))
+
+    run_progress.finish(scanned_frames, rows=scanned_rows, cached=False, resumed=args.resume)
     print("Done! Waterfall generation complete.")
 
-def save_chunk(buffer, output_dir, index):
+def validate_args(args):
+    """
+    Checks option values and combinations. Returns an error message, or None.
+    """
+    if args.stride < 0:
+        return "--stride must be 0 (off) or a positive number of frames"
+    if not 0.0 <= args.preview_scale <= 1.0:
+        return "--preview-scale must be between 0 and 1"
+    if args.channels == 'luma' and args.backend != 'ffmpeg':
+        return "--channels luma needs --backend ffmpeg (OpenCV only decodes colour)"
+    if args.channels == 'luma' and args.preview_scale > 0:
+        return "--channels luma never decodes colour, so it cannot write a --preview-scale preview"
+    if args.chunk_size < 1:
+        return "--chunk-size must be at least 1 row"
+    if args.pyramid_levels < 0:
+        return "--pyramid-levels must be 0 (none) or more"
+    if args.duplicates != 'off' and args.stride > 0:
+        return "--duplicates compares every frame, so it cannot be combined with --stride"
+    if args.duplicates != 'off' and args.resume:
+        return "Scans with --duplicates keep no checkpoint, so they cannot be resumed"
+    return None
+
+def collect_rois(args):
+    """
+    The ROIs to scan, each with its output directory: a single ROI writes straight
+    into --output, several get a subdirectory each. Raises ValueError for bad options.
+    """
+    rois = []
+    try:
+        for value in args.roi:
+            y, x1, x2 = (int(v) for v in value.split(','))
+            rois.append({"y": y, "x1": x1, "x2": x2})
+    except ValueError:
+        raise ValueError(f"--roi expects \"y,x1,x2\", got {args.roi}")
+    if not rois:
+        if args.y is None or args.x1 is None or args.x2 is None:
+            raise ValueError("Pass --y, --x1 and --x2, or at least one --roi")
+        rois.append({"y": args.y, "x1": args.x1, "x2": args.x2})
+
+    for i, roi in enumerate(rois):
+        roi["output"] = args.output if len(rois) == 1 else os.path.join(args.output, f"roi_{i}")
+    return rois
+
+def scan_metadata(args, roi, fps, intervals):
+    """
+    The metadata.json of one ROI's output (without the checkpoint).
+    """
+    metadata = {
+        "fps": fps,
+        "speed": args.speed,
+        "stride": args.stride,
+        "channels": args.channels,
+        "preview_scale": args.preview_scale,
+        "pyramid_levels": args.pyramid_levels,
+        "store": args.store,
+        "chunk_size": args.chunk_size,
+        "y": roi["y"],
+        "x1": roi["x1"],
+        "x2": roi["x2"],
+        "start_time": args.start,
+        "end_time": args.end
+    }
+    if intervals is not None:
+        metadata["intervals"] = intervals
+    if args.duplicates != 'off':
+        metadata["duplicates"] = {
+            "mode": args.duplicates,
+            "threshold": args.duplicate_threshold,
+            "height": args.duplicate_height,
+            "max_run": args.max_duplicate_run
+        }
+    return metadata
+
+def cache_params(args, rois, intervals):
+    """
+    The options that decide what a scan produces, for its cache key.
+    """
+    params = {
+        "rois": [[roi["y"], roi["x1"], roi["x2"]] for roi in rois],
+        "speed": args.speed,
+        "stride": args.stride,
+        "channels": args.channels,
+        "preview_scale": args.preview_scale,
+        "pyramid_levels": args.pyramid_levels,
+        "chunk_size": args.chunk_size,
+        "start": args.start,
+        "end": args.end,
+        # The backends decode to slightly different pixels on some videos (batch_scan.job_key keeps it too)
+        "backend": args.backend
+    }
+    if args.intervals:
+        params["intervals"] = intervals if intervals is not None else args.intervals
+    if args.store:
+        params["store"] = True
+    if args.duplicates != 'off':
+        params["duplicates"] = [args.duplicates, args.duplicate_threshold, args.duplicate_height, args.max_duplicate_run]
+    return params
+
+def resume_shards(rois):
+    """
+    The shards that continue an interrupted scan from its checkpoints, and the
+    strip heights each of them saved before (one list per shard). Shards that
+    already finished are marked "complete". Returns (None, None) if the whole
+    scan is complete. Raises ValueError if it cannot be resumed.
+    """
+    checkpoint = load_checkpoint(rois)
+    if checkpoint.get("complete"):
+        return None, None
+
+    if "shards" not in checkpoint:
+        # A serial scan: one checkpoint in metadata.json
+        heights = load_partial_index(rois, PARTIAL_INDEX_FILENAME, checkpoint["frames_done"])
+        print(f"Resuming at chunk {checkpoint['last_chunk'] + 1} (Frame {checkpoint['resume_frame']})")
+        return [resumed_shard(serial_shard(), checkpoint, len(heights))], [heights]
+
+    shards = []
+    prior_heights = []
+    for plan in checkpoint["shards"]:
+        k = plan["shard"]
+        state = load_shard_checkpoint(rois, k)
+        if state is None:
+            # Killed before its first checkpoint
+            shards.append(dict(plan, prior_frames=0))
+            prior_heights.append([])
+            print(f"Shard {k}: starting over at chunk {plan['chunk_index']}")
+            continue
+        heights = load_partial_index(rois, SHARD_PARTIAL_INDEX_FILENAME.format(k), state["frames_done"])
+        prior_heights.append(heights)
+        if state.get("complete"):
+            shards.append(dict(plan, complete=True))
+            print(f"Shard {k}: complete")
+        else:
+            shards.append(resumed_shard(plan, state, len(heights)))
+            print(f"Shard {k}: resuming at chunk {state['last_chunk'] + 1} (Frame {state['resume_frame']})")
+    return shards, prior_heights
+
+def resumed_shard(plan, state, prior_frames):
+    """
+    The rest of a planned shard, from its checkpoint state.
+    """
+    return dict(plan,
+                start_offset=plan["start_offset"] + state["frames_done"],
+                chunk_index=state["last_chunk"] + 1,
+                y_accumulator=state["y_accumulator"],
+                skip_rows=state["skip_rows"],
+                frames=None if plan["frames"] is None else plan["frames"] - state["frames_done"],
+                prior_frames=prior_frames)
+
+def initial_checkpoint(shards, start_frame):
+    """
+    The checkpoint a new scan starts with: where the first chunk starts, or the
+    plan of the shards (each shard then checkpoints in its own files).
+    """
+    if len(shards) > 1:
+        return {"shards": shards}
+    return {"last_chunk": -1, "resume_frame": start_frame, "y_accumulator": 0.0, "skip_rows": 0, "frames_done": 0}
+
+def prepare_outputs(output, rois, checkpoint):
+    """
+    Clears what an earlier scan left in the output and writes the metadata of every ROI,
+    with the initial checkpoint (None: the scan keeps no checkpoints).
+    """
+    # Chunks of an earlier, longer scan (or its store) would be read along with the new ones
+    clear_scan_outputs(output)
+    for roi in rois:
+        if not os.path.exists(roi["output"]):
+            os.makedirs(roi["output"])
+        metadata = dict(roi["metadata"])
+        if checkpoint is not None:
+            metadata["checkpoint"] = checkpoint
+        write_metadata(roi["output"], metadata)
+
+def serial_shard():
     """
-    Stacks the list of single-row arrays into one image and saves it.
+    The single shard of a serial scan: every frame, from the first chunk.
     """
-    # np.vstack stacks arrays vertically.
-    # Input: List of (1, W, 3) arrays
-    # Output: (H, W, 3) array
+    return {"shard": 0, "start_offset": 0, "end_offset": None, "chunk_index": 0, "end_chunk": None,
+            "y_accumulator": 0.0, "skip_rows": 0, "frames": None}
+
+def shard_frames(shard, total_frames):
+    """
+    Number of frames the shard owns.
+    """
+    return shard["frames"] if shard["frames"] is not None else total_frames - shard["start_offset"]
+
+def plan_run(args, strip_heights, total_frames):
+    """
+    The shards of a new scan: the whole range, or one shard per worker when the scan can be split.
+    """
+    if args.workers > 1 and len(strip_heights) > 1:
+        # Chunk boundaries would fall on different frames for each ROI
+        print("Warning: ROIs are clipped to different heights by the frame edge, scanning serially")
+    elif args.workers > 1 and args.duplicates != 'off':
+        print("Warning: Scans with --duplicates run serially")
+    elif args.workers > 1:
+        shards = plan_shards(args.speed, args.stride, next(iter(strip_heights)), args.chunk_size, total_frames, args.workers)
+        print(f"Scanning {len(shards)} shards with {args.workers} workers")
+        return shards
+    return [serial_shard()]
+
+def prepare_stores(args, rois, total_frames):
+    """
+    Creates (or keeps, when resuming) the waterfall store of every ROI, or removes a stale one.
+    """
+    for roi in rois:
+        if args.store:
+            # Room for a full strip from every frame; the unused rows are cut off at the end
+            create_store(roi["output"], roi["rect"][2], args.channels, total_frames * roi["rect"][3])
+        else:
+            # This run won't finalize a store: one left behind would shadow the chunks in detect_notes.py
+            remove_file(os.path.join(roi["output"], STORE_FILENAME))
+
+def scan_config(args, rois, crop, ranges, seek_index, total_frames, duplicate_rect):
+    """
+    Everything a worker needs, with the ROI rectangles relative to the decoded crop.
+    """
+    def relative(rect):
+        return rect[0] - crop[0], rect[1] - crop[1], rect[2], rect[3]
+
+    return {
+        "backend": args.backend,
+        "ffmpeg": args.ffmpeg,
+        "video": args.video,
+        "crop": crop,
+        "chunk_size": args.chunk_size,
+        "speed": args.speed,
+        "stride": args.stride,
+        "ranges": ranges,
+        "seek_index": seek_index,
+        "channels": args.channels,
+        "preview_scale": args.preview_scale,
+        "pyramid_levels": args.pyramid_levels,
+        "prefetch": args.prefetch,
+        "writer_threads": args.writer_threads,
+        "checkpoint": False,
+        "sharded": False,
+        "total_frames": total_frames,
+        "progress": args.progress,
+        "store": args.store,
+        "duplicates": None if duplicate_rect is None else {
+            "rect": relative(duplicate_rect),
+            "threshold": args.duplicate_threshold,
+            "collapse": args.duplicates == 'collapse',
+            "max_run": args.max_duplicate_run
+        },
+        "progress_interval": args.progress_interval,
+        "rois": [{"output": roi["output"], "rect": relative(roi["rect"])} for roi in rois]
+    }
+
+def run_shards(config, shards, workers):
+    """
+    Scans every shard that is not complete yet (in worker processes if there are several).
+    Returns scan_shard()'s result for each shard, in order (nothing new for the complete ones).
+    """
+    jobs = [(config, dict(shard, shards=len(shards))) for shard in shards if not shard.get("complete")]
+    if len(jobs) == 1:
+        results = iter([scan_shard(jobs[0])])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = iter(list(pool.map(scan_shard, jobs)))
+    nothing = ([[] for _ in config["rois"]], [])
+    return [nothing if shard.get("complete") else next(results) for shard in shards]
+
+def merge_shards(args, rois, ranges, start_frame, seek_index, prior_heights, results):
+    """
+    Completes every ROI's output from the shard results: the frame index, the duplicates,
+    the store, the pyramid manifest and the final metadata. Returns the (frames, rows) scanned.
+    """
+    # Each shard reports the strip height of every frame it owns (per ROI), and the duplicates it found.
+    # A resumed shard continues the heights saved at its checkpoint (the same for every ROI).
+    scanned_frames = sum(len(shard_heights[0]) for shard_heights, _ in results)
+    scanned_rows = sum(sum(shard_heights[0]) for shard_heights, _ in results)
+    for i, roi in enumerate(rois):
+        roi_heights = []
+        for heights, (shard_heights, _) in zip(prior_heights, results):
+            roi_heights.extend(heights)
+            roi_heights.extend(shard_heights[i])
+        frames = sequence_frames(ranges, len(roi_heights))
+        # Variable frame rate: store the real frame times, 1 / fps would drift from them
+        times = None
+        if seek_index is not None and seek_index.vfr and len(frames) > 0:
+            times = seek_index.times_of_frames(frames[0], frames[-1] + 2)
+        write_index(roi["output"], start_frame, roi_heights, frames, times)
+        print(f"Saved frame index for {roi['output']} ({len(roi_heights)} frames, {sum(roi_heights)} rows)")
+
+        if args.duplicates != 'off':
+            # Scans with --duplicates are a single shard from the first frame, so offsets index `frames`
+            duplicates = [frames[offset] for offset in results[0][1]]
+            save_duplicates(roi["output"], duplicates)
+            roi["metadata"]["duplicates"]["count"] = len(duplicates)
+            print(f"Found {len(duplicates)} duplicate frames" + (" (collapsed)" if args.duplicates == 'collapse' else ""))
+
+        if args.store:
+            finalize_store(roi["output"], sum(roi_heights))
+
+        if args.pyramid_levels > 0:
+            write_pyramid_manifest(roi["output"], roi["rect"][2], args.preview_scale, args.pyramid_levels)
+
+        # The scan is complete: nothing left to resume
+        metadata = dict(roi["metadata"])
+        metadata["checkpoint"] = {"complete": True}
+        write_metadata(roi["output"], metadata)
+        remove_file(os.path.join(roi["output"], PARTIAL_INDEX_FILENAME))
+        for k in range(len(results)):
+            remove_file(os.path.join(roi["output"], SHARD_CHECKPOINT_FILENAME.format(k)))
+            remove_file(os.path.join(roi["output"], SHARD_PARTIAL_INDEX_FILENAME.format(k)))
+    return scanned_frames, scanned_rows
+
+def bounding_rect(rects):
+    """
+    Smallest (x, y, w, h) rectangle containing every non-empty rectangle.
+    """
+    rects = [r for r in rects if r[2] > 0 and r[3] > 0] or rects
+    x_start = min(r[0] for r in rects)
+    y_start = min(r[1] for r in rects)
+    x_end = max(r[0] + r[2] for r in rects)
+    y_end = max(r[1] + r[3] for r in rects)
+    return x_start, y_start, x_end - x_start, y_end - y_start
+
+def next_slit_height(y_accumulator, speed):
+    """
+    Advances the fractional-speed accumulator by one frame.
+    Returns (slit_height, y_accumulator).
+    """
+    # We add the speed to the accumulator
+    y_accumulator += speed
     
-    # User requested "Reverse the concat order".
-    # By reversing the buffer before stacking, we stack the LATEST frame at the TOP.
-    # [ Frame T+N ]
-    # ...
-    # [ Frame T ]
-    # This creates an UP-SCROLL chart (Time flows upwards).
-    # This is necessary for falling notes to appear "upright" (Top of note above Bottom of note).
-    waterfall_image = np.vstack(buffer[::-1])
+    # The number of pixels to take this frame is the integer part of the accumulator
+    # minus what we took previously (which is implicitly handled by resetting/decrementing)
+    # Actually, simpler:
+    # We want to advance 'speed' pixels.
+    # We take 'int(speed)' pixels.
+    # We keep the remainder.
     
-    # If we wanted to follow "flip upside down at the end", we would do:
-    # waterfall_image = cv2.flip(waterfall_image, 0)
-    # But this would invert the time axis back to Down-scroll, making the notes upside-down again.
-    # We will stick with the Up-scroll chart as it is the "Correct Scan" for shape.
+    slit_height = int(y_accumulator)
+    y_accumulator -= slit_height
     
+    # Ensure we take at least 1 pixel if speed is very slow, or handle 0?
+    # If speed < 1, we might skip frames. For now, let's assume speed >= 1.
+    if slit_height < 1:
+        slit_height = 1 # Force at least 1 pixel to avoid gaps/stalls
+        y_accumulator = 0 # Reset to avoid infinite buildup if speed is tiny
+
+    return slit_height, y_accumulator
+
+def slit_schedule(speed, stride=0, y_accumulator=0.0, frame_offset=0):
+    """
+    Endless generator of (slit_height, accumulator_before, accumulator_after), one per frame.
+    frame_offset is the position of the first frame counted from the start of the scan.
+
+    Without a stride every frame takes next_slit_height() rows (at least 1).
+    In stride mode only every stride-th frame takes rows: all the rows that
+    scrolled past the scan line since the previous one. The others get 0 rows
+    and never need to be converted. With stride 1 this is just the accumulator
+    without the 1 px minimum, which is what speeds below 1 px/frame need.
+    """
+    while True:
+        accumulator_before = y_accumulator
+        if stride > 0:
+            y_accumulator += speed
+            slit_height = 0
+            if (frame_offset + 1) % stride == 0:
+                slit_height = int(y_accumulator)
+                y_accumulator -= slit_height
+        else:
+            slit_height, y_accumulator = next_slit_height(y_accumulator, speed)
+        frame_offset += 1
+        yield slit_height, accumulator_before, y_accumulator
+
+def scan_frames(source, schedule, rois, skip_rows=0, encoder=None, checkpoint=None, progress=None, duplicates=None):
+    """
+    Reads every frame of the source and feeds the scan strip of each ROI to its writer.
+    schedule is a slit_schedule() generator starting at the source's first frame.
+    rois is a list of (rect, writer), rect being (x, y, w, h) inside the decoded crop.
+    skip_rows drops the bottom rows of the first strip (already written by the previous shard).
+    progress is an optional ProgressReporter, updated with the frames read and the rows produced.
+    duplicates is an optional DuplicateDetector, which sees every frame and may move its rows to a later one.
+    Returns (strip heights, one list per ROI with one entry per frame, number of frames retrieved).
+    """
+    strip_heights = [[] for _ in rois]
+    frame_count = 0
+    retrieved = 0
+    rows = 0 # Rows produced for the first ROI
+
+    while True:
+        if progress is not None:
+            progress.update(frame_count, rows=rows, retrieved=retrieved)
+        if not source.grab():
+            break # End of video (or of the requested range)
+        frame_count += 1
+
+        # 2. Calculate Slit Height for this frame
+        slit_height, accumulator_before, y_accumulator = next(schedule)
+        if slit_height == 0:
+            # Stride mode: nothing scrolled past the scan line yet, so skip the colour conversion
+            for heights in strip_heights:
+                heights.append(0)
+            continue
+
+        band = source.retrieve()
+        if band is None:
+            break
+        retrieved += 1
+
+        if duplicates is not None:
+            slit_height = duplicates.slit_height(frame_count - 1, band, slit_height)
+            if slit_height == 0:
+                # A collapsed duplicate: its rows go to the next unique frame
+                for heights in strip_heights:
+                    heights.append(0)
+                continue
+
+        flushed = 0
+        for i, ((x, y, w, h), writer) in enumerate(rois):
+            # 3. Extract the Region of Interest (ROI)
+            # The rect already starts at the scan line and is clipped to the frame,
+            # so we just take the first slit_height rows of it.
+            scan_strip = band[y:y + min(slit_height, h), x:x + w]
+            strip_heights[i].append(scan_strip.shape[0])
+
+            if skip_rows > 0:
+                # The bottom of the strip is the earliest part, so that is what we drop
+                scan_strip = scan_strip[:max(scan_strip.shape[0] - skip_rows, 0)]
+
+            # 4. Add to chunk (a strip that does not fit is split across two chunks)
+            if scan_strip.shape[0] > 0:
+                flushed += writer.add(scan_strip)
+
+        # Tell the checkpointer where the next chunk starts (all ROIs share the boundaries)
+        if checkpoint is not None:
+            for chunk_index, rows_used in rois[0][1].flushes:
+                rows_used += skip_rows
+                if rows_used >= strip_heights[0][-1]:
+                    # The chunk ended with this frame's strip
+                    checkpoint.chunk_flushed(chunk_index, frame_count, y_accumulator, 0, strip_heights[0])
+                else:
+                    # The next chunk starts inside this frame's strip
+                    checkpoint.chunk_flushed(chunk_index, frame_count - 1, accumulator_before, rows_used, strip_heights[0])
+        skip_rows = 0
+        rows += strip_heights[0][-1]
+
+        if flushed:
+            if encoder is not None:
+                print(f"Processed {frame_count} frames... (chunk writer: {encoder.summary()})")
+            else:
+                print(f"Processed {frame_count} frames...")
+
+    # 5. Save any remaining lines in the buffers
+    for _, writer in rois:
+        writer.flush()
+    if progress is not None:
+        progress.update(frame_count, force=True, rows=rows, retrieved=retrieved)
+    return strip_heights, retrieved
+
+def pyramid_size(width, height):
+    """
+    Size of the next (half size) pyramid level, rounded up so nothing becomes empty.
+    """
+    return max(1, (width + 1) // 2), max(1, (height + 1) // 2)
+
+def write_pyramid_manifest(output_dir, strip_width, preview_scale, levels):
+    """
+    Describes the pyramid of the displayed chunks (the colour preview if there
+    is one): the directory and chunk width of every level, full size first.
+    """
+    display_dir = PREVIEW_DIRNAME if preview_scale > 0 else ""
+    width = max(1, round(strip_width * preview_scale)) if preview_scale > 0 else strip_width
+    manifest = {"levels": [{"factor": 1, "dir": display_dir, "width": width}]}
+    for level in range(1, levels + 1):
+        width, _ = pyramid_size(width, 1)
+        level_dir = os.path.join(display_dir, PYRAMID_DIRNAME, str(2 ** level)).replace(os.sep, '/')
+        manifest["levels"].append({"factor": 2 ** level, "dir": level_dir, "width": width})
+    with open(os.path.join(output_dir, PYRAMID_MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+def interval_ranges(intervals, start, end, seek_index, fps):
+    """
+    Turns [[start, end], ...] intervals in seconds into sorted, non-overlapping
+    (start_frame, end_frame) ranges, clipped to the --start/--end window (end 0 = no limit).
+    """
+    def frame_at(seconds):
+        return seek_index.frame_at_time(seconds) if seek_index is not None else int(seconds * fps)
+
+    ranges = []
+    for interval_start, interval_end in sorted(intervals):
+        interval_start = max(interval_start, start)
+        if end > 0:
+            interval_end = min(interval_end, end)
+        first, last = frame_at(interval_start), frame_at(interval_end)
+        if last <= first:
+            continue
+        if ranges and first <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], max(last, ranges[-1][1]))
+        else:
+            ranges.append((first, last))
+    return ranges
+
+def sequence_frame(ranges, offset):
+    """
+    Absolute frame number of the frame `offset` frames into the scanned ranges.
+    """
+    for start, end in ranges:
+        if end is None or offset < end - start:
+            return start + offset
+        offset -= end - start
+    return ranges[-1][1] + offset # Past the end
+
+def sequence_ranges(ranges, first, last=None):
+    """
+    The (start_frame, end_frame) ranges holding offsets first .. last of the
+    scanned ranges (last None = to the end). An end_frame of None is the end of the video.
+    """
+    result = []
+    offset = 0
+    for start, end in ranges:
+        length = None if end is None else end - start
+        lo = max(first - offset, 0)
+        hi = None if last is None else last - offset
+        if length is not None:
+            hi = length if hi is None else min(hi, length)
+        if (hi is None or hi > lo) and (length is None or lo < length):
+            result.append((start + lo, None if hi is None else start + hi))
+        if length is None:
+            break
+        offset += length
+    if not result:
+        # Nothing left: an empty range at the right place
+        frame = sequence_frame(ranges, first)
+        result.append((frame, frame))
+    return result
+
+def sequence_frames(ranges, count):
+    """
+    Absolute frame numbers of the first `count` scanned frames.
+    """
+    frames = []
+    for start, end in ranges:
+        length = count - len(frames) if end is None else min(end - start, count - len(frames))
+        frames.extend(range(start, start + length))
+    return frames
+
+def plan_shards(speed, stride, strip_height, chunk_size, total_frames, workers):
+    """
+    Splits the scanned frames into contiguous shards that start exactly on a chunk boundary.
+    Frames are counted through the scanned ranges (offset 0 is the first one).
+
+    The slit heights only depend on the accumulator, so we can replay it without
+    decoding anything and find where each chunk starts: the frame containing
+    its first row, the accumulator value before that frame, and how many rows
+    of that frame's strip still belong to the previous chunk. A worker that
+    starts there produces the same chunks as the serial run, with the same
+    chunk indices.
+    """
+    # Replay the accumulator and find the frame containing row k * chunk_size
+    chunk_starts = [(0, 0.0, 0)] # (frame offset, accumulator before it, rows to skip)
+    schedule = slit_schedule(speed, stride)
+    rows = 0
+    for i in range(total_frames):
+        slit_height, accumulator_before, _ = next(schedule)
+        h = min(slit_height, strip_height)
+        while rows + h > len(chunk_starts) * chunk_size:
+            chunk_starts.append((i, accumulator_before, len(chunk_starts) * chunk_size - rows))
+        rows += h
+
+    # Give each worker a contiguous, roughly equal run of chunks
+    shard_count = max(1, min(workers, len(chunk_starts)))
+    first_chunks = [round(k * len(chunk_starts) / shard_count) for k in range(shard_count)]
+
+    shards = []
+    for k, chunk_index in enumerate(first_chunks):
+        offset, y_accumulator, skip_rows = chunk_starts[chunk_index]
+        if k + 1 < shard_count:
+            end_chunk = first_chunks[k + 1]
+            next_offset, _, next_skip = chunk_starts[end_chunk]
+            # A strip split across the boundary is read by both shards
+            shard_end = next_offset + 1 if next_skip > 0 else next_offset
+            owned_frames = next_offset - offset
+        else:
+            end_chunk = None
+            shard_end = None # The last shard runs to the real end of the video
+            owned_frames = None
+        shards.append({
+            "shard": k,
+            "start_offset": offset,
+            "end_offset": shard_end,
+            "chunk_index": chunk_index,
+            "end_chunk": end_chunk,
+            "y_accumulator": y_accumulator,
+            "skip_rows": skip_rows,
+            "frames": owned_frames
+        })
+    return shards
+
+def scan_shard(job):
+    """
+    Scans one shard of the video. Runs in a worker process when --workers > 1.
+    Returns the strip heights of the frames this shard owns (one list per ROI)
+    and the offsets of the duplicate frames it found.
+    """
+    config, shard = job
+    frame_offset = shard["start_offset"] # Stride groups are counted from the first scanned frame
+    schedule = slit_schedule(config["speed"], config["stride"], shard["y_accumulator"], frame_offset)
+    # The prefetch thread replays the same schedule, so it only converts frames that take rows
+    wanted = None
+    if config["stride"] > 0:
+        wanted = (slit_height > 0 for slit_height, _, _ in slit_schedule(config["speed"], config["stride"], shard["y_accumulator"], frame_offset))
+    source = open_source(config["backend"], config["video"], config["crop"], ffmpeg=config["ffmpeg"],
+                         prefetch=config["prefetch"], wanted=wanted, seek_index=config["seek_index"],
+                         ranges=sequence_ranges(config["ranges"], shard["start_offset"], shard["end_offset"]),
+                         luma=config["channels"] == 'luma')
+    encoder = ChunkEncoder(config["writer_threads"]) if config["writer_threads"] > 0 else None
+    checkpoint = None
+    if config["checkpoint"]:
+        checkpoint = Checkpointer([roi["output"] for roi in config["rois"]], config["ranges"], shard["start_offset"],
+                                  shard["chunk_index"], shard.get("prior_frames", 0),
+                                  files_per_chunk=2 if config["preview_scale"] > 0 else 1,
+                                  shard=shard["shard"] if config["sharded"] else None)
+    # Preallocated buffer for the current chunk of each ROI.
+    # Strips are copied into it as they arrive, so decoded frames are not kept alive.
+    rois = []
+    for roi in config["rois"]:
+        writer = ChunkWriter(roi["output"], config["chunk_size"], shard["chunk_index"], shard["end_chunk"], encoder,
+                             channels=config["channels"])
+        if config["preview_scale"] > 0:
+            preview_dir = os.path.join(roi["output"], PREVIEW_DIRNAME)
+            os.makedirs(preview_dir, exist_ok=True)
+            writer.preview = ChunkWriter(preview_dir, config["chunk_size"], shard["chunk_index"], shard["end_chunk"], encoder,
+                                         scale=config["preview_scale"])
+        # The pyramid is built from whatever the viewer shows
+        display = writer.preview if writer.preview is not None else writer
+        display.levels = config["pyramid_levels"]
+        for level in range(1, display.levels + 1):
+            os.makedirs(os.path.join(display.output_dir, PYRAMID_DIRNAME, str(2 ** level)), exist_ok=True)
+        if config["store"]:
+            writer.store = StoreWriter(roi["output"], roi["rect"][2], config["channels"], config["chunk_size"])
+        if checkpoint is not None:
+            writer.on_written = checkpoint.chunk_written
+            if writer.preview is not None:
+                writer.preview.on_written = checkpoint.chunk_written
+        rois.append((roi["rect"], writer))
+
+    # Frames this shard reads (the last one runs to the end of the scanned ranges)
+    end_offset = shard["end_offset"] if shard["end_offset"] is not None else config["total_frames"]
+    fields = {"shard": shard["shard"], "shards": shard["shards"]} if shard["shards"] > 1 else {}
+    writers = [writer for _, writer in rois] + [writer.preview for _, writer in rois if writer.preview is not None]
+    progress = ProgressReporter("scan", "frames", max(end_offset - shard["start_offset"], 0), config["progress"],
+                                config["progress_interval"], encode_ms=lambda: chunk_encode_ms(encoder, writers), **fields)
+    duplicates = None
+    if config["duplicates"] is not None:
+        duplicates = DuplicateDetector(config["duplicates"]["rect"], config["duplicates"]["threshold"],
+                                       config["duplicates"]["collapse"], config["duplicates"]["max_run"])
+    try:
+        strip_heights, retrieved = scan_frames(source, schedule, rois, shard["skip_rows"], encoder, checkpoint, progress,
+                                               duplicates)
+    finally:
+        source.release()
+        # Always drain the writers, so every chunk that was flushed is on disk
+        if encoder is not None:
+            encoder.close()
+        for _, writer in rois:
+            if writer.store is not None:
+                writer.store.close()
+    if encoder is not None:
+        print(f"Chunk writer: {encoder.summary()}")
+    if config["prefetch"] > 0:
+        print(f"Prefetch: {source.summary()}")
+    frames = len(strip_heights[0])
+    print(f"Retrieved {retrieved} of {frames} frames ({frames - retrieved} grabbed only)")
+
+    # A frame split across the shard boundary is owned by the next shard
+    if shard["frames"] is not None:
+        strip_heights = [heights[:shard["frames"]] for heights in strip_heights]
+    if checkpoint is not None and checkpoint.shard is not None:
+        # Resuming must not scan this shard again, even if another one fails
+        checkpoint.finish(strip_heights[0])
+    return strip_heights, duplicates.frames if duplicates is not None else []
+
+class Checkpointer:
+    """
+    Records a resume point in each ROI's metadata.json once a chunk is on disk.
+
+    A checkpoint is only written when chunk N (and every chunk before it) has
+    been written for every ROI. It stores where chunk N + 1 starts: the frame,
+    the accumulator value before that frame, and how many rows of that frame's
+    strip already went into chunk N. The strip heights of all earlier frames
+    are appended to frame_index.partial, so the final index can be rebuilt.
+
+    The shards of a parallel scan run in separate processes, so each one keeps
+    its checkpoint in its own files (SHARD_CHECKPOINT_FILENAME and
+    SHARD_PARTIAL_INDEX_FILENAME, frames counted from the shard's start), and
+    metadata.json holds the shard plan.
+    """
+
+    def __init__(self, outputs, ranges, start_offset, first_chunk, prior_frames, files_per_chunk=1, shard=None):
+        self.outputs = outputs
+        self.shard = shard # Shard index of a parallel scan, None for a serial one
+        self.partial_filename = PARTIAL_INDEX_FILENAME if shard is None else SHARD_PARTIAL_INDEX_FILENAME.format(shard)
+        self.files_per_chunk = files_per_chunk # Chunk (+ preview) files each ROI writes per chunk
+        self.ranges = ranges # Scanned frame ranges
+        self.start_offset = start_offset # First frame of this run (counted through the ranges)
+        self.prior_frames = prior_frames # Frames already covered by the partial index
+        self.lock = threading.Lock()
+        self.pending = {} # chunk index -> resume state, queued by the decode loop
+        self.written = {} # chunk index -> number of ROIs that have written it
+        self.next_chunk = first_chunk # Next chunk a checkpoint is waiting for
+        self.saved_frames = 0 # Frames of this run already in the partial index
+
+    def chunk_flushed(self, chunk_index, frames_done, y_accumulator, skip_rows, strip_heights):
+        """
+        Called by the decode loop: chunk_index is complete, the next one starts
+        frames_done frames into this run (skipping skip_rows rows of that frame's strip).
+        """
+        with self.lock:
+            self.pending[chunk_index] = {
+                "last_chunk": chunk_index,
+                "resume_frame": sequence_frame(self.ranges, self.start_offset + frames_done),
+                "y_accumulator": y_accumulator,
+                "skip_rows": skip_rows,
+                "frames_done": self.prior_frames + frames_done,
+                "heights": strip_heights[self.saved_frames:frames_done]
+            }
+            self.saved_frames = frames_done
+            self.commit()
+
+    def chunk_written(self, output_dir, chunk_index):
+        """
+        Called (possibly from a writer thread) once a chunk file is on disk.
+        """
+        with self.lock:
+            self.written[chunk_index] = self.written.get(chunk_index, 0) + 1
+            self.commit()
+
+    def commit(self):
+        while self.next_chunk in self.pending and self.written.get(self.next_chunk, 0) == len(self.outputs) * self.files_per_chunk:
+            state = self.pending.pop(self.next_chunk)
+            del self.written[self.next_chunk]
+            self.save(state.pop("heights"), state)
+            self.next_chunk += 1
+
+    def finish(self, strip_heights):
+        """
+        Marks the shard complete once all of it is on disk, with the heights of its remaining frames.
+        """
+        with self.lock:
+            self.save(strip_heights[self.saved_frames:], {"complete": True, "frames_done": self.prior_frames + len(strip_heights)})
+            self.saved_frames = len(strip_heights)
+
+    def save(self, heights, state):
+        heights = np.asarray(heights, dtype='<u4')
+        for output_dir in self.outputs:
+            with open(os.path.join(output_dir, self.partial_filename), 'ab') as f:
+                f.write(heights.tobytes())
+            if self.shard is None:
+                metadata = read_metadata(output_dir)
+                metadata["checkpoint"] = state
+                write_metadata(output_dir, metadata)
+            else:
+                write_json(os.path.join(output_dir, SHARD_CHECKPOINT_FILENAME.format(self.shard)), state)
+
+def load_checkpoint(rois):
+    """
+    Reads the checkpoint shared by every ROI from metadata.json.
+    Raises ValueError if the outputs cannot be resumed with these parameters.
+    """
+    checkpoint = None
+    for roi in rois:
+        path = os.path.join(roi["output"], "metadata.json")
+        if not os.path.exists(path):
+            raise ValueError(f"{path} not found")
+        metadata = read_metadata(roi["output"])
+        saved = metadata.pop("checkpoint", None)
+        if saved is None:
+            raise ValueError(f"{path} has no checkpoint")
+        if metadata != roi["metadata"]:
+            raise ValueError(f"{path} was written with different parameters")
+        if checkpoint is not None and saved != checkpoint:
+            raise ValueError("The ROIs have different checkpoints")
+        checkpoint = saved
+    return checkpoint
+
+def load_shard_checkpoint(rois, shard):
+    """
+    The checkpoint of one shard of a parallel scan, or None if it never wrote one.
+    """
+    states = []
+    for roi in rois:
+        try:
+            with open(os.path.join(roi["output"], SHARD_CHECKPOINT_FILENAME.format(shard)), 'r') as f:
+                states.append(json.load(f))
+        except FileNotFoundError:
+            states.append(None)
+    if any(state != states[0] for state in states):
+        raise ValueError(f"The ROIs have different checkpoints for shard {shard}")
+    return states[0]
+
+def load_partial_index(rois, filename, frames_done):
+    """
+    The strip heights saved up to a checkpoint. Anything after it came from chunks
+    that never finished, and is cut off the file of every ROI.
+    """
+    heights = np.fromfile(os.path.join(rois[0]["output"], filename), dtype='<u4') \
+        if frames_done > 0 else np.zeros(0, dtype='<u4')
+    if len(heights) < frames_done:
+        raise ValueError(f"{filename} is shorter than the checkpoint")
+    heights = heights[:frames_done]
+    for roi in rois:
+        with open(os.path.join(roi["output"], filename), 'wb') as f:
+            f.write(heights.tobytes())
+    return [int(h) for h in heights]
+
+def read_metadata(output_dir):
+    with open(os.path.join(output_dir, "metadata.json"), 'r') as f:
+        return json.load(f)
+
+def write_metadata(output_dir, metadata):
+    """
+    Writes metadata.json atomically, so an interrupted scan never leaves half a file.
+    """
+    write_json(os.path.join(output_dir, "metadata.json"), metadata)
+
+def write_json(path, value):
+    with open(path + ".tmp", 'w') as f:
+        json.dump(value, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+class ChunkWriter:
+    """
+    Collects scan strips into one preallocated (chunk_size, W, 3) array
+    ((chunk_size, W) when only the max channel or the luma plane is stored).
+
+    Strips are written bottom-up, so the LATEST frame ends up at the TOP:
+    [ Frame T+N ]
+    ...
+    [ Frame T ]
+    This creates an UP-SCROLL chart (Time flows upwards).
+    This is necessary for falling notes to appear "upright" (Top of note above Bottom of note).
+
+    Every chunk is exactly chunk_size rows high (except the last one). A strip
+    that does not fit is split: its bottom rows finish the current chunk and
+    the rest starts the next one.
+
+    An optional preview writer receives the same colour strips, and with a
+    scale below 1 its chunks are downscaled when they are saved.
+
+    With levels > 0 every saved chunk is also halved that many times into
+    pyramid/2, pyramid/4, ... (from the in-memory image, when it is encoded).
+
+    An optional StoreWriter receives every row as well, in time order, at its
+    global row (chunk index * chunk_size + rows already in the chunk).
+    """
+
+    def __init__(self, output_dir, chunk_size, first_index=0, end_index=None, encoder=None, channels='bgr', scale=1.0):
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size
+        self.channels = channels
+        self.scale = scale
+        self.preview = None # ChunkWriter for the colour preview, fed the same strips
+        self.levels = 0 # Pyramid levels saved with every chunk
+        self.store = None # StoreWriter for the waterfall store (--store)
+        self.buffer = None # Allocated on the first strip, once we know its width
+        self.rows = 0 # Number of rows filled in the current chunk
+        self.index = first_index # Index of the current chunk
+        self.end_index = end_index # Rows of this chunk (and later ones) are dropped
+        self.flushes = [] # (chunk index, rows of the strip used) for each flush of the last add()
+        self.on_written = None # Called with (output_dir, chunk index) once a chunk is on disk
+        self.encode_seconds = 0.0 # Time spent saving chunks without a background encoder
+        self.encoded = 0
+
+        # With a background encoder, full buffers are handed over and come back
+        # through this free list once they are written.
+        self.encoder = encoder
+        self.free_buffers = queue.Queue()
+        self.allocated = 0
+
+    def take_buffer(self, strip):
+        """
+        Gets an empty chunk buffer: a new one while we are under the limit, else a recycled one.
+        """
+        shape = (self.chunk_size,) + strip.shape[1:]
+        max_buffers = 1 if self.encoder is None else self.encoder.max_pending + 1
+        if self.allocated < max_buffers and self.free_buffers.empty():
+            self.allocated += 1
+            return np.empty(shape, dtype=strip.dtype)
+
+        # Every buffer is still being encoded: the decode loop has to wait
+        t0 = time.perf_counter()
+        buffer = self.free_buffers.get()
+        self.encoder.add_stall(time.perf_counter() - t0)
+        return buffer
+
+    def add(self, strip):
+        """
+        Copies a strip into the chunk(s). Returns the number of chunks flushed.
+        """
+        if self.preview is not None:
+            self.preview.add(strip)
+        if self.channels == 'max':
+            # Same reduction detect_notes.py does, on a few rows instead of a whole chunk
+            strip = np.max(strip, axis=2)
+
+        self.flushes = []
+        remaining = strip.shape[0]
+        while remaining > 0:
+            if self.end_index is not None and self.index >= self.end_index:
+                break # Belongs to the next shard
+
+            if self.buffer is None:
+                self.buffer = self.take_buffer(strip)
+
+            # The earliest (bottom) rows of what is left go in first
+            take = min(self.chunk_size - self.rows, remaining)
+            bottom = self.chunk_size - self.rows
+            self.buffer[bottom - take:bottom] = strip[remaining - take:remaining]
+            if self.store is not None:
+                # The store ascends in time: the same rows, earliest first
+                self.store.write(self.index * self.chunk_size + self.rows, strip[remaining - take:remaining][::-1])
+            self.rows += take
+            remaining -= take
+
+            if self.rows == self.chunk_size:
+                self.flushes.append((self.index, strip.shape[0] - remaining))
+                self.save()
+        return len(self.flushes)
+
+    def flush(self):
+        """
+        Saves whatever is left in the current chunk (and the preview's) at the end of the scan.
+        """
+        if self.preview is not None:
+            self.preview.flush()
+        self.save()
+
+    def save(self):
+        """
+        Encodes the filled part of the buffer (no copy) and starts a new chunk.
+        The preview fills (and saves) its own chunks as strips are added.
+        """
+        if self.rows == 0:
+            return
+        image = self.buffer[self.chunk_size - self.rows:]
+        if self.scale != 1.0:
+            height = max(1, round(image.shape[0] * self.scale))
+            width = max(1, round(image.shape[1] * self.scale))
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        if self.encoder is None:
+            t0 = time.perf_counter()
+            save_chunk(image, self.output_dir, self.index, self.levels)
+            self.encode_seconds += time.perf_counter() - t0
+            self.encoded += 1
+            if self.on_written is not None:
+                self.on_written(self.output_dir, self.index)
+        else:
+            # The encoder owns the buffer until it is written, then returns it to us
+            buffer = self.buffer
+            index = self.index
+
+            def on_done(written):
+                self.free_buffers.put(buffer)
+                if written and self.on_written is not None:
+                    self.on_written(self.output_dir, index)
+
+            self.encoder.submit(image, self.output_dir, index, on_done, self.levels)
+            self.buffer = None
+        self.rows = 0
+        self.index += 1
+
+class ChunkEncoder:
+    """
+    Encodes and writes chunks on background threads.
+
+    cv2.imencode releases the GIL, so JPEG encoding and the file write overlap
+    with decoding instead of stalling it every chunk. The queue is bounded:
+    when the writers fall behind, submit() blocks, and that wait is counted
+    as stall time.
+    """
+
+    def __init__(self, threads=1, queue_size=2):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.max_pending = queue_size + threads # Queued + being encoded
+        self.lock = threading.Lock()
+        self.error = None
+        self.encode_seconds = 0.0 # Time spent encoding and writing (on the writer threads)
+        self.encoded = 0 # Chunks written
+        self.stall_seconds = 0.0 # Time the decode loop spent waiting for the writers
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, image, output_dir, index, on_done, levels=0):
+        """
+        Queues one chunk (and its pyramid levels). on_done(written) is called once the image is no longer needed.
+        """
+        self.raise_error()
+        t0 = time.perf_counter()
+        self.queue.put((image, output_dir, index, on_done, levels))
+        self.add_stall(time.perf_counter() - t0)
+
+    def add_stall(self, seconds):
+        with self.lock:
+            self.stall_seconds += seconds
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            image, output_dir, index, on_done, levels = item
+            written = False
+            try:
+                if self.error is None: # After a failure, just drain the queue
+                    t0 = time.perf_counter()
+                    save_chunk(image, output_dir, index, levels)
+                    written = True
+                    with self.lock:
+                        self.encode_seconds += time.perf_counter() - t0
+                        self.encoded += 1
+            except Exception as e:
+                with self.lock:
+                    self.error = self.error or e
+            finally:
+                try:
+                    on_done(written)
+                except Exception as e:
+                    with self.lock:
+                        self.error = self.error or e
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """
+        Waits for every queued chunk to be written. Re-raises the first write error.
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.raise_error()
+
+    def summary(self):
+        saved = max(self.encode_seconds - self.stall_seconds, 0.0)
+        return f"encode {self.encode_seconds:.1f}s, decode stalled {self.stall_seconds:.1f}s, saved {saved:.1f}s"
+
+def chunk_encode_ms(encoder, writers):
+    """
+    Mean time to encode and write one chunk (with its pyramid levels) so far, in ms.
+    """
+    if encoder is not None:
+        seconds, encoded = encoder.encode_seconds, encoder.encoded
+    else:
+        seconds = sum(writer.encode_seconds for writer in writers)
+        encoded = sum(writer.encoded for writer in writers)
+    return round(seconds * 1000.0 / encoded, 1) if encoded else None
+
+def save_chunk(waterfall_image, output_dir, index, levels=0):
+    """
+    Encodes one (H, W, 3) or single-channel (H, W) waterfall image and saves it,
+    followed by `levels` halved copies in the pyramid directories.
+    """
     filename = os.path.join(output_dir, f"chunk_{index}.jpg")
-    
+    write_jpeg(waterfall_image, filename)
+            
+    # One write call, so lines from the writer threads do not interleave
+    print(f"Saved {filename} (Height: {waterfall_image.shape[0]})\n", end='')
+
+    # Each level is halved from the previous one, not from the full image
+    image = waterfall_image
+    for level in range(1, levels + 1):
+        image = cv2.resize(image, pyramid_size(image.shape[1], image.shape[0]), interpolation=cv2.INTER_AREA)
+        write_jpeg(image, os.path.join(output_dir, PYRAMID_DIRNAME, str(2 ** level), f"chunk_{index}.jpg"))
+
+def write_jpeg(image, filename):
     # cv2.imwrite doesn't support non-ASCII paths on Windows
-    is_success, im_buf = cv2.imencode(".jpg", waterfall_image)
+    is_success, im_buf = cv2.imencode(".jpg", image)
     if is_success:
         with open(filename, "wb") as f:
             im_buf.tofile(f)
-            
-    print(f"Saved {filename} (Height: {waterfall_image.shape[0]})")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,89 @@
+import json
+import os
+import time
+
+# =============================================================================
+# PROGRESS TELEMETRY
+# =============================================================================
+# With --progress, slit_scan.py and detect_notes.py print machine-readable
+# progress events next to their normal log lines: one JSON object per line on
+# stdout, always starting with {"event": ...}, so the server can pick them out
+# of the log without guessing at the free-form text.
+#
+# EVENTS:
+#   {"event": "progress", "stage": "scan", "unit": "frames", "done": 1200, "total": 1800,
+#    "rate": 125.2, "eta_s": 4.6, "elapsed_s": 9.6, "rss_mb": 212.4, ...}
+#   {"event": "done", "stage": "scan", "unit": "frames", "done": 1800, "rate": 121.0, ...}
+# - rate is units per second since the stage started (decode fps for a scan)
+# - eta_s assumes the rest goes at the same rate (null while nothing is done)
+# - rss_mb is the resident memory of the process (null where /proc is missing)
+# - every stage adds its own fields: rows produced, mean chunk encode ms, ...
+# - parallel scans report per shard ("shard": k of "shards": n); the totals
+#   are the sums over the shards
+#
+# Progress events are rate limited (--progress-interval seconds apart), the
+# done event is always written.
+# =============================================================================
+
+def current_rss_mb():
+    """
+    Resident memory of this process in MB, or None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
+def emit_event(event):
+    # One write call, so events from worker processes and threads do not interleave
+    print(json.dumps(event) + "\n", end='', flush=True)
+
+class ProgressReporter:
+    """
+    Tracks how many units of a stage are done and prints progress events.
+    A disabled reporter does nothing, so callers never need to check.
+    """
+
+    def __init__(self, stage, unit, total=None, enabled=True, interval=0.5, **fields):
+        self.stage = stage
+        self.unit = unit
+        self.total = total
+        self.enabled = enabled
+        self.interval = interval
+        self.fields = fields # Added to every event (e.g. the shard), callables are called each time
+        self.start = time.perf_counter()
+        self.last_emit = None
+
+    def event(self, kind, done, fields):
+        elapsed = time.perf_counter() - self.start
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = round(max(self.total - done, 0) / rate, 1)
+        event = {"event": kind, "stage": self.stage, "unit": self.unit, "done": done, "total": self.total,
+                 "rate": round(rate, 1), "eta_s": eta, "elapsed_s": round(elapsed, 2), "rss_mb": current_rss_mb()}
+        # Callable fields are evaluated now, so expensive values are only computed for printed events
+        for name, value in list(self.fields.items()) + list(fields.items()):
+            event[name] = value() if callable(value) else value
+        return event
+
+    def update(self, done, force=False, **fields):
+        """
+        Reports `done` units. Prints an event at most every `interval` seconds (unless forced).
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if not force and self.last_emit is not None and now - self.last_emit < self.interval:
+            return
+        self.last_emit = now
+        emit_event(self.event("progress", done, fields))
+
+    def finish(self, done, **fields):
+        """
+        Prints the final event of the stage.
+        """
+        if self.enabled:
+            emit_event(self.event("done", done, fields))
@@ -0,0 +1,187 @@
+import argparse
+import math
+import os
+import struct
+import sys
+
+import cv2
+import numpy as np
+
+# =============================================================================
+# WATERFALL STORE
+# =============================================================================
+# The JPEG chunks are what the viewer shows, but anything that looks across a
+# chunk boundary (a note straddling it, a bar line on its last row) has to
+# decode two chunks and juggle chunk_base_y offsets. With --store, slit_scan.py
+# also writes the whole waterfall, losslessly, to one file:
+#
+#   OUTPUT/waterfall.npy    uint8, shape (rows, width) or (rows, width, 3)
+#
+# Global row g is array row g: the rows ascend in time (the chunks store the
+# same rows bottom-up). It is a normal .npy file, so np.load(path,
+# mmap_mode='r') slices any range of rows without reading the rest.
+#
+# WRITING:
+# The file is created at an upper bound of its final size (sparse, nothing is
+# written yet) and filled through np.memmap, one chunk-sized block at a time.
+# Shards of a parallel scan write their own blocks. Once the scan is complete
+# the header gets the real row count and the file is cut to it.
+# The header is padded to a fixed size, so rewriting it never moves the data.
+# =============================================================================
+
+STORE_FILENAME = "waterfall.npy"
+
+HEADER_SIZE = 128 # Magic, version, header length and the padded header dict (a multiple of 64)
+
+def write_header(f, shape):
+    header = "{'descr': '|u1', 'fortran_order': False, 'shape': %r, }" % (tuple(shape),)
+    header = header.ljust(HEADER_SIZE - 10 - 1) + "\n"
+    f.seek(0)
+    f.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode('latin1'))
+
+def row_shape(width, channels):
+    """
+    Shape of one row: (width, 3) for colour, (width,) for the single-channel planes.
+    """
+    return (width, 3) if channels == 'bgr' else (width,)
+
+def create_store(output_dir, width, channels, capacity):
+    """
+    Creates (or, when resuming, keeps) the store file with room for `capacity` rows.
+    """
+    path = os.path.join(output_dir, STORE_FILENAME)
+    shape = (capacity,) + row_shape(width, channels)
+    size = HEADER_SIZE + int(np.prod(shape))
+    with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+        write_header(f, shape)
+        if os.path.getsize(path) < size:
+            f.truncate(size)
+
+def finalize_store(output_dir, rows):
+    """
+    Writes the real row count into the header and drops the unused capacity.
+    """
+    path = os.path.join(output_dir, STORE_FILENAME)
+    store = load_store(output_dir)
+    shape = (rows,) + store.shape[1:]
+    del store
+    with open(path, 'r+b') as f:
+        write_header(f, shape)
+        f.truncate(HEADER_SIZE + int(np.prod(shape)))
+
+def load_store(output_dir, mode='r'):
+    """
+    The store of an output directory as a memory-mapped array, or None if it has none.
+    """
+    path = os.path.join(output_dir, STORE_FILENAME)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode=mode)
+
+class StoreWriter:
+    """
+    Writes rows into the store through a memory map of one chunk-sized block.
+    Rows of one write() must not cross a block boundary (chunk pieces never do).
+    """
+
+    def __init__(self, output_dir, width, channels, block_rows):
+        self.path = os.path.join(output_dir, STORE_FILENAME)
+        self.row_shape = row_shape(width, channels)
+        self.row_bytes = int(np.prod(self.row_shape))
+        self.block_rows = block_rows
+        self.block_index = None
+        self.block = None
+
+    def map_block(self, index):
+        self.close()
+        start = index * self.block_rows
+        # Only the last shard can run past the estimated capacity; it grows the file
+        needed = HEADER_SIZE + (start + self.block_rows) * self.row_bytes
+        if os.path.getsize(self.path) < needed:
+            with open(self.path, 'r+b') as f:
+                f.truncate(needed)
+        self.block = np.memmap(self.path, dtype=np.uint8, mode='r+', offset=HEADER_SIZE + start * self.row_bytes,
+                               shape=(self.block_rows,) + self.row_shape)
+        self.block_index = index
+
+    def write(self, row, rows):
+        """
+        Writes rows (earliest first) starting at global row `row`.
+        """
+        index = row // self.block_rows
+        if index != self.block_index:
+            self.map_block(index)
+        offset = row - index * self.block_rows
+        self.block[offset:offset + len(rows)] = rows
+
+    def close(self):
+        if self.block is not None:
+            self.block.flush()
+            self.block = None
+            self.block_index = None
+
+def chunk_view(store, index, chunk_size):
+    """
+    Chunk `index` as the JPEG chunks store it (latest row at the top), without copying.
+    """
+    return store[index * chunk_size:min((index + 1) * chunk_size, len(store))][::-1]
+
+def export_chunks(store, output_dir, chunk_size, levels=0):
+    """
+    Writes the store as JPEG chunks (and their pyramid levels) of any size.
+    """
+    # Imported here: slit_scan imports this module for --store
+    from slit_scan import PYRAMID_DIRNAME, save_chunk
+
+    for level in range(1, levels + 1):
+        os.makedirs(os.path.join(output_dir, PYRAMID_DIRNAME, str(2 ** level)), exist_ok=True)
+    count = math.ceil(len(store) / chunk_size)
+    for index in range(count):
+        # cv2 needs positive strides, so only the chunk being encoded is copied
+        save_chunk(np.ascontiguousarray(chunk_view(store, index, chunk_size)), output_dir, index, levels)
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description='Export JPEG chunks or previews from a waterfall store (slit_scan.py --store)')
+    parser.add_argument('--input', required=True, help='Scan output directory containing waterfall.npy')
+    parser.add_argument('--export-chunks', type=str, help='Write the waterfall as JPEG chunks to this directory')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='Height of each exported chunk')
+    parser.add_argument('--pyramid-levels', type=int, default=0, help='Also export 1/2, 1/4, ... size copies of the chunks')
+    parser.add_argument('--preview', type=str, help='Write rows --start-row .. --end-row to this image (latest at the top)')
+    parser.add_argument('--start-row', type=int, default=0, help='First global row of the preview')
+    parser.add_argument('--end-row', type=int, help='End global row of the preview (default: the last row)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Scale factor of the preview')
+
+    args = parser.parse_args()
+
+    store = load_store(args.input)
+    if store is None:
+        print(f"Error: No {STORE_FILENAME} in {args.input} (scan with --store)")
+        sys.exit(1)
+    print(f"Waterfall store: {store.shape[0]} rows, {store.shape[1]} px wide")
+
+    if args.export_chunks:
+        os.makedirs(args.export_chunks, exist_ok=True)
+        count = export_chunks(store, args.export_chunks, args.chunk_size, args.pyramid_levels)
+        print(f"Exported {count} chunks to {args.export_chunks}")
+
+    if args.preview:
+        end_row = min(args.end_row if args.end_row is not None else len(store), len(store))
+        rows = store[max(args.start_row, 0):end_row][::-1]
+        if len(rows) == 0:
+            print(f"Error: No rows between {args.start_row} and {end_row}")
+            sys.exit(1)
+        if args.scale != 1.0:
+            size = (max(1, round(rows.shape[1] * args.scale)), max(1, round(rows.shape[0] * args.scale)))
+            rows = cv2.resize(np.ascontiguousarray(rows), size, interpolation=cv2.INTER_AREA)
+        # cv2.imwrite doesn't support non-ASCII paths on Windows
+        is_success, im_buf = cv2.imencode(os.path.splitext(args.preview)[1] or ".png", np.ascontiguousarray(rows))
+        if not is_success:
+            print(f"Error: Could not encode {args.preview}")
+            sys.exit(1)
+        with open(args.preview, "wb") as f:
+            im_buf.tofile(f)
+        print(f"Saved rows {args.start_row}..{end_row} to {args.preview}")
+
+if __name__ == "__main__":
+    main()
@@ -46,9 +46,90 @@ app.get('/api/videos', async (req, res) => {
   }
 });
 
+// Progress events printed by the Python scripts with --progress (format documented in scripts/telemetry.py)
+interface ProgressEvent {
+  event: 'progress' | 'done';
+  stage: string;
+  unit: string;
+  done: number;
+  total: number | null;
+  rate: number;
+  eta_s: number | null;
+  rss_mb: number | null;
+  shard?: number;
+  [field: string]: unknown;
+}
+
+// Latest event of every shard of the running (or last) job, per video
+const progressByVideo = new Map<string, { stage: string, shards: Map<number, ProgressEvent>, finished: boolean }>();
+
+// Every finished run is appended here, so throughput can be compared across runs
+const telemetryLogPath = path.join(__dirname, '../workspace/telemetry.jsonl');
+
+// Splits a script's stdout into lines: progress events are recorded, everything else is logged
+function watchOutput(stream: NodeJS.ReadableStream, videoFilename: string, label: string) {
+  progressByVideo.delete(videoFilename);
+  let pending = '';
+  stream.on('data', (data) => {
+    const lines = (pending + data.toString()).split('\n');
+    pending = lines.pop() ?? '';
+    const log: string[] = [];
+    for (const line of lines) {
+      if (!line.startsWith('{"event"')) {
+        log.push(line);
+        continue;
+      }
+      try {
+        recordProgress(videoFilename, JSON.parse(line));
+      } catch (e) {
+        log.push(line);
+      }
+    }
+    if (log.length > 0) console.log(`[${label}]: ${log.join('\n')}`);
+  });
+}
+
+function recordProgress(videoFilename: string, event: ProgressEvent) {
+  let entry = progressByVideo.get(videoFilename);
+  if (!entry || entry.stage !== event.stage) {
+    entry = { stage: event.stage, shards: new Map(), finished: false };
+    progressByVideo.set(videoFilename, entry);
+  }
+  if (event.event === 'done') {
+    entry.finished = true;
+    fs.appendFile(telemetryLogPath, JSON.stringify({ time: new Date().toISOString(), video: videoFilename, ...event }) + '\n')
+      .catch((e) => console.error('Failed to write telemetry log', e));
+  } else {
+    entry.shards.set(event.shard ?? 0, event);
+  }
+}
+
+// Progress of the running job: the sum over its shards (the slowest shard decides the ETA)
+app.get('/api/progress/:videoFilename', (req, res) => {
+  const entry = progressByVideo.get(req.params.videoFilename);
+  if (!entry) return res.json({ status: 'idle' });
+
+  const events = Array.from(entry.shards.values());
+  const sum = (field: string) => events.reduce((acc, event) => acc + (typeof event[field] === 'number' ? event[field] as number : 0), 0);
+  const totalKnown = events.length > 0 && events.every(event => event.total !== null);
+  const etas = events.map(event => event.eta_s).filter((eta): eta is number => eta !== null);
+  res.json({
+    status: entry.finished ? 'completed' : 'running',
+    stage: entry.stage,
+    unit: events.length > 0 ? events[0].unit : undefined,
+    done: sum('done'),
+    total: totalKnown ? sum('total') : null,
+    rate: sum('rate'),
+    etaS: etas.length > 0 ? Math.max(...etas) : null,
+    rows: sum('rows'),
+    rssMb: sum('rss_mb'),
+    encodeMs: events.reduce((acc, event) => Math.max(acc, typeof event.encode_ms === 'number' ? event.encode_ms : 0), 0) || null
+  });
+});
+
 // Trigger Slit-Scan
 app.post('/api/process/slit-scan', (req, res) => {
-  const { videoFilename, y, x1, x2, startTime, endTime, speed } = req.body;
+  const { videoFilename, y, x1, x2, startTime, endTime, speed, stride, channels, previewScale, backend, workers, resume, cache = true, cacheQuotaMb, autoTrim, pyramidLevels = 3, store, duplicates } = req.body;
   
   if (!videoFilename || y === undefined || x1 === undefined || x2 === undefined) {
     return res.status(400).json({ error: 'Missing parameters' });
@@ -59,8 +140,13 @@ app.post('/api/process/slit-scan', (req, res) => {
   const outputDir = path.join(workspaceDir, 'output_' + videoFilename);
   const scriptPath = path.join(__dirname, '../scripts/slit_scan.py');
 
-  // Clear previous output
-  fs.emptyDirSync(outputDir);
+  // Clear previous output (unless we continue an interrupted scan from its checkpoint)
+  const resuming = resume && fs.existsSync(path.join(outputDir, 'metadata.json'));
+  if (resuming) {
+    console.log(`Resuming Slit-Scan for ${videoFilename} from its checkpoint`);
+  } else {
+    fs.emptyDirSync(outputDir);
+  }
 
   console.log(`Starting Slit-Scan for ${videoFilename}...`);
 
@@ -76,6 +162,28 @@ app.post('/api/process/slit-scan', (req, res) => {
   if (startTime !== undefined) args.push('--start', startTime.toString());
   if (endTime !== undefined) args.push('--end', endTime.toString());
   if (speed !== undefined) args.push('--speed', speed.toString());
+  if (stride) args.push('--stride', stride.toString());
+  if (channels) args.push('--channels', channels);
+  if (previewScale) args.push('--preview-scale', previewScale.toString());
+  // WaterfallViewer loads the level that matches its zoom (NoteEditor only reads the full-size chunks)
+  args.push('--pyramid-levels', pyramidLevels.toString());
+  if (backend) args.push('--backend', backend);
+  // Lossless waterfall.npy next to the chunks; detection slices it instead of decoding JPEGs
+  if (store) args.push('--store');
+  // 'detect' or 'collapse' frames that repeat the previous one (30fps footage in a 60fps upload)
+  if (duplicates) args.push('--duplicates', duplicates);
+  if (workers) args.push('--workers', workers.toString());
+  // Skip intros, menus and results screens (scripts/find_gameplay.py)
+  if (autoTrim) args.push('--intervals', 'auto');
+  if (resuming) args.push('--resume');
+  // Rescanning the same video with the same settings is served from the cache (send "cache": false to skip it).
+  // The cache keeps a copy of every output (up to the quota, 10 GB by default).
+  if (cache) {
+    args.push('--cache-dir', path.join(workspaceDir, '.cache', 'slit_scan'));
+    if (cacheQuotaMb) args.push('--cache-quota', cacheQuotaMb.toString());
+  }
+  // Structured progress for /api/progress and the telemetry log
+  args.push('--progress');
 
   // Use the virtual environment Python if available
   const venvPython = process.platform === 'win32'
@@ -89,9 +197,7 @@ app.post('/api/process/slit-scan', (req, res) => {
     env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
   });
 
-  pythonProcess.stdout.on('data', (data) => {
-    console.log(`[Python]: ${data}`);
-  });
+  watchOutput(pythonProcess.stdout, videoFilename, 'Python');
 
   pythonProcess.stderr.on('data', (data) => {
     console.error(`[Python Error]: ${data}`);
@@ -110,9 +216,24 @@ app.post('/api/process/slit-scan', (req, res) => {
             return idxA - idxB;
           });
           
+        // Single-channel chunks come with a colour preview for display
+        const hasPreview = fs.existsSync(path.join(outputDir, 'preview'));
+
+        // Downsampled copies of the displayed chunks, so zoomed-out views load small images
+        const manifestPath = path.join(outputDir, 'pyramid.json');
+        const levels = fs.existsSync(manifestPath)
+          ? fs.readJsonSync(manifestPath).levels.map((level: { factor: number, dir: string, width: number }) => ({
+              factor: level.factor,
+              dir: path.posix.join('output_' + videoFilename, level.dir),
+              width: level.width
+            }))
+          : undefined;
+
         res.json({ 
           status: 'completed', 
           outputDir: 'output_' + videoFilename,
+          previewDir: hasPreview ? 'output_' + videoFilename + '/preview' : undefined,
+          levels,
           chunks 
         });
       } catch (e) {
@@ -195,7 +316,7 @@ app.post('/api/extract-frames', (req, res) => {
 
 // Detect notes
 app.post('/api/process/detect-notes', (req, res) => {
-  const { videoFilename, threshold = 200, laneRatios, beatsPerBar, barsPerLine, minHeight } = req.body;
+  const { videoFilename, threshold = 200, laneRatios, beatsPerBar, barsPerLine, minHeight, workers } = req.body;
 
   if (!videoFilename) {
     return res.status(400).json({ error: 'Missing videoFilename' });
@@ -229,14 +350,14 @@ app.post('/api/process/detect-notes', (req, res) => {
   if (beatsPerBar) args.push('--beats-per-bar', beatsPerBar.toString());
   if (barsPerLine) args.push('--bars-per-line', barsPerLine.toString());
   if (minHeight) args.push('--min-height', minHeight.toString());
+  if (workers) args.push('--workers', workers.toString());
+  args.push('--progress');
 
   const pythonProcess = spawn(pythonExec, args, {
     env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
   });
 
-  pythonProcess.stdout.on('data', (data) => {
-    console.log(`[Python Detect]: ${data}`);
-  });
+  watchOutput(pythonProcess.stdout, videoFilename, 'Python Detect');
 
   pythonProcess.stderr.on('data', (data) => {
     console.error(`[Python Detect Error]: ${data}`);
@@ -258,6 +379,93 @@ app.post('/api/process/detect-notes', (req, res) => {
   });
 });
 
+// Frame index written by scripts/slit_scan.py (layout documented in scripts/frame_index.py)
+interface FrameIndex {
+  startFrame: number;
+  frames: Uint32Array; // Absolute frame number of each scanned frame (not consecutive with --intervals)
+  frameRows: Uint32Array; // Global row where each frame's strip starts
+  rowFrames: Uint32Array; // Absolute frame number of each global row
+  times: Float64Array | null; // Variable frame rate: seconds of frames startFrame .. last scanned + 1
+}
+
+function loadFrameIndex(outputDir: string): FrameIndex | null {
+  const indexPath = path.join(outputDir, 'frame_index.bin');
+  if (!fs.existsSync(indexPath)) return null;
+
+  const buf = fs.readFileSync(indexPath);
+  const magic = buf.toString('ascii', 0, 4);
+  if (magic !== 'M2FI' && magic !== 'M2F2') return null;
+
+  const startFrame = buf.readUInt32LE(4);
+  const frameCount = buf.readUInt32LE(8);
+  const rowCount = buf.readUInt32LE(12);
+  const framesOffset = 16;
+  const frameRowsOffset = magic === 'M2F2' ? framesOffset + 4 * frameCount : framesOffset;
+  const rowsOffset = frameRowsOffset + 4 * (frameCount + 1);
+  const timesOffset = rowsOffset + 4 * rowCount;
+
+  // slice() copies, which also gives Uint32Array the 4-byte alignment it needs
+  const arrayBuffer = buf.buffer.slice(buf.byteOffset, buf.byteOffset + buf.length);
+  let frames: Uint32Array;
+  if (magic === 'M2F2') {
+    frames = new Uint32Array(arrayBuffer, framesOffset, frameCount);
+  } else {
+    frames = new Uint32Array(frameCount);
+    for (let i = 0; i < frameCount; i++) frames[i] = startFrame + i;
+  }
+  // Float64Array needs 8-byte alignment, which timesOffset does not always have
+  let times: Float64Array | null = null;
+  if (buf.length > timesOffset) {
+    times = new Float64Array((buf.length - timesOffset) >> 3);
+    for (let i = 0; i < times.length; i++) times[i] = buf.readDoubleLE(timesOffset + 8 * i);
+  }
+  return {
+    startFrame,
+    frames,
+    frameRows: new Uint32Array(arrayBuffer, frameRowsOffset, frameCount + 1),
+    rowFrames: new Uint32Array(arrayBuffer, rowsOffset, rowCount),
+    times
+  };
+}
+
+// Index of the first element >= value in a sorted array
+function lowerBound(array: Uint32Array, value: number): number {
+  let lo = 0;
+  let hi = array.length;
+  while (lo < hi) {
+    const mid = (lo + hi) >> 1;
+    if (array[mid] < value) lo = mid + 1;
+    else hi = mid;
+  }
+  return lo;
+}
+
+// Fractional frame number for a global row (a row halfway up a strip of frame F is F + 0.5).
+// In stride mode a strip also covers the frames before it that took no rows (within one interval).
+function rowToFrame(index: FrameIndex, row: number): number {
+  if (index.rowFrames.length === 0) return index.startFrame;
+  const r = Math.min(Math.max(Math.floor(row), 0), index.rowFrames.length - 1);
+  const i = lowerBound(index.frames, index.rowFrames[r]);
+  const stripStart = index.frameRows[i];
+  const stripHeight = Math.max(index.frameRows[i + 1] - stripStart, 1);
+  let first = i;
+  while (first > 0 && index.frameRows[first - 1] === stripStart && index.frames[first - 1] === index.frames[first] - 1) {
+    first--;
+  }
+  const span = index.frames[i] + 1 - index.frames[first];
+  return index.frames[first] + (row - stripStart) * span / stripHeight;
+}
+
+// Seconds for a global row: 1 / fps per frame, or the stored frame times of a variable frame rate video
+function rowToTime(index: FrameIndex, row: number, fps: number): number {
+  const frame = rowToFrame(index, row);
+  if (!index.times || index.times.length === 0) return frame / fps;
+  const offset = Math.min(Math.max(frame - index.startFrame, 0), index.times.length - 1);
+  const i = Math.min(Math.floor(offset), index.times.length - 2);
+  if (i < 0) return index.times[0];
+  return index.times[i] + (offset - i) * (index.times[i + 1] - index.times[i]);
+}
+
 // Export MIDI
 app.post('/api/process/export-midi', (req, res) => {
     const { videoFilename, laneMapping } = req.body;
@@ -324,22 +532,25 @@ app.post('/api/process/export-midi', (req, res) => {
         // Calculate absolute time for each note and convert to MIDI events
         // We need to sort notes by time to calculate delta times (waits)
         
+        // Frame index written by slit_scan.py (maps every waterfall row to its video frame)
+        const frameIndex = loadFrameIndex(outputDir);
+
         const notesWithTime = notes.map((note: any) => {
             // Time Calculation
-            // BaseFrame = chunk_index * (chunk_size / speed)
-            // Note: We assume previous chunks are full size (chunk_size).
-            // If detect_notes.py runs on all chunks, we can trust chunk_index order.
-            
-            const baseFrame = note.chunk_index * (chunk_size / speed);
-            
-            // Frame within chunk
+            // Chunks are exactly chunk_size rows high (only the last one is shorter),
+            // so the global row (counted from the bottom of the chart) follows from the chunk index.
             // Top (y=0) is Late. Bottom (y=H) is Early.
-            // Frame = BaseFrame + (ChunkHeight - y) / speed
             const chunkHeight = note.chunk_height || chunk_size; // Fallback if missing
-            const frameOffset = (chunkHeight - note.y) / speed;
+            const globalRow = note.chunk_index * chunk_size + (chunkHeight - note.y);
             
-            const totalFrame = baseFrame + frameOffset;
-            const timeSeconds = (totalFrame / fps) + start_time;
+            let timeSeconds: number;
+            if (frameIndex) {
+                // Exact: look up the frame that produced this row
+                timeSeconds = rowToTime(frameIndex, globalRow, fps);
+            } else {
+                // Older outputs: assume every frame contributed exactly 'speed' rows
+                timeSeconds = (globalRow / speed / fps) + start_time;
+            }
             
             // Calculate duration in ticks
             // Minimum duration: 1/32 note (128 / 8 = 16 ticks)
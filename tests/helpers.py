@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# =============================================================================
+# TEST HELPERS
+# =============================================================================
+# The scripts import their siblings directly (they are run as
+# `python scripts/x.py`), so the tests put scripts/ on the path the same way.
+# End-to-end tests run the scripts in a subprocess on small synthetic videos.
+# =============================================================================
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
+
+def make_video(path, frames=240, width=96, height=64, fps=30, order=None):
+    """
+    Writes an MJPG .avi whose rows scroll down 3 px per frame over random blocks,
+    so every frame contributes different rows to a scan.
+    order lists the frames (0 .. frames - 1) to write instead, e.g. with repeats; None writes a black frame.
+    """
+    rng = np.random.default_rng(1)
+    pattern = rng.integers(0, 256, size=(frames * 3 + height) // 4 + 1, dtype=np.uint8)
+    pattern = np.repeat(pattern, 4)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    for i in (range(frames) if order is None else order):
+        if i is None:
+            writer.write(np.zeros((height, width, 3), dtype=np.uint8))
+            continue
+        rows = pattern[frames * 3 - i * 3:frames * 3 - i * 3 + height]
+        frame = np.repeat(rows[:, None], width, axis=1)
+        frame = np.stack([frame, frame[:, ::-1] // 2, 255 - frame], axis=2)
+        writer.write(np.ascontiguousarray(frame))
+    writer.release()
+
+def run_script(name, *args):
+    """
+    Runs scripts/<name> with the given options. Returns the CompletedProcess (output as text).
+    """
+    return subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, name)] + [str(a) for a in args],
+                          capture_output=True, text=True, env=dict(os.environ, PYTHONIOENCODING='utf-8'))
+
+def read_metadata(output_dir):
+    with open(os.path.join(output_dir, "metadata.json"), 'r') as f:
+        return json.load(f)
+
+def scan_until_killed(output_dir, *args, min_chunk=1, timeout=60):
+    """
+    Starts slit_scan.py and kills it once a checkpoint past chunk min_chunk is on disk
+    (any shard's, for a parallel scan). Returns False if the scan finished before it could be killed.
+    """
+    process = subprocess.Popen([sys.executable, os.path.join(SCRIPTS_DIR, "slit_scan.py"), "--output", output_dir] +
+                               [str(a) for a in args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    deadline = time.monotonic() + timeout
+    try:
+        while process.poll() is None and time.monotonic() < deadline:
+            checkpoints = []
+            try:
+                checkpoints.append(read_metadata(output_dir).get("checkpoint", {}))
+                for name in os.listdir(output_dir):
+                    if name.startswith("checkpoint_shard_") and name.endswith(".json"):
+                        with open(os.path.join(output_dir, name), 'r') as f:
+                            checkpoints.append(json.load(f))
+            except (OSError, ValueError):
+                pass
+            if any(checkpoint.get("last_chunk", -1) >= min_chunk for checkpoint in checkpoints):
+                kill_tree(process)
+                process.wait()
+                return True
+            time.sleep(0.001)
+        return False
+    finally:
+        if process.poll() is None:
+            kill_tree(process)
+            process.wait()
+
+def kill_tree(process):
+    """
+    SIGKILLs the process and the workers it started (only the process itself on Windows, with TerminateProcess).
+    """
+    if hasattr(os, 'killpg'):
+        os.killpg(process.pid, signal.SIGKILL)
+    else:
+        process.kill()
+
+def output_files(output_dir):
+    """
+    SHA-1 of every chunk, pyramid level and the frame index of a scan, by relative path
+    (digests keep assertion diffs short).
+    """
+    files = {}
+    for root, _, names in os.walk(output_dir):
+        for name in names:
+            if name.startswith("chunk_") or name == "frame_index.bin":
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    files[os.path.relpath(path, output_dir)] = hashlib.sha1(f.read()).hexdigest()
+    return files
@@ -0,0 +1,49 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import helpers
+
+class BatchScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.video = os.path.join(self.dir, "synthetic.avi")
+        helpers.make_video(self.video, frames=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def run_batch(self, output, **options):
+        manifest = os.path.join(self.dir, "batch.json")
+        with open(manifest, 'w') as f:
+            json.dump({"defaults": dict({"speed": 3, "chunk_size": 50, "pyramid_levels": 0}, **options),
+                       "jobs": [{"video": "synthetic.avi", "y": 40, "x1": 0, "x2": 96, "output": output}]}, f)
+        result = helpers.run_script("batch_scan.py", manifest)
+        with open(os.path.join(self.dir, "batch_report.json"), 'r') as f:
+            return result, json.load(f)["jobs"][0]
+
+    def test_foreign_directory_is_not_cleared(self):
+        foreign = os.path.join(self.dir, "documents")
+        os.makedirs(foreign)
+        with open(os.path.join(foreign, "notes.txt"), 'w') as f:
+            f.write("keep me")
+
+        result, entry = self.run_batch("documents")
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(entry["status"], "failed")
+        self.assertEqual(os.listdir(foreign), ["notes.txt"])
+
+    def test_finished_output_is_skipped(self):
+        result, entry = self.run_batch("output")
+        self.assertEqual(entry["status"], "scanned", result.stdout)
+        result, entry = self.run_batch("output")
+        self.assertEqual(entry["status"], "skipped", result.stdout)
+        # How progress is reported doesn't change the scan
+        result, entry = self.run_batch("output", progress=True, progress_interval=2)
+        self.assertEqual(entry["status"], "skipped", result.stdout)
+
+if __name__ == "__main__":
+    unittest.main()
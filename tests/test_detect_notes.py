@@ -0,0 +1,226 @@
+import bisect
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import helpers # noqa: F401 (puts scripts/ on the path)
+
+from detect_notes import StreamingDetector, generate_grid, lane_bounds, note_row_masks, quantize_rows
+from waterfall_store import STORE_FILENAME
+
+def reference_note_row_mask(lane_gray, threshold):
+    """
+    The per-lane row classification note_row_masks replaced (one lane at a time, in floats).
+    """
+    detection_thresh = max(100, threshold - 50)
+    is_bright = np.max(lane_gray, axis=1) > detection_thresh
+    fill_thresh = detection_thresh * 0.8
+    is_wide = np.sum(lane_gray > fill_thresh, axis=1) / lane_gray.shape[1] > 0.6
+    is_solid = np.std(lane_gray, axis=1) < 80.0
+    return is_bright & is_wide & is_solid
+
+def reference_grid(lines, line_height, min_y, max_y):
+    """
+    The loop generate_grid replaced: fill the gaps, then extend one line at a time.
+    """
+    grid = [lines[0]]
+    for prev_line, curr_line in zip(lines, lines[1:]):
+        num_segments = round((curr_line - prev_line) / line_height)
+        if num_segments > 1:
+            step = (curr_line - prev_line) / num_segments
+            grid += [prev_line + k * step for k in range(1, num_segments)]
+        grid.append(curr_line)
+    while grid[0] > min_y:
+        grid.insert(0, grid[0] - line_height)
+    while grid[-1] < max_y:
+        grid.append(grid[-1] + line_height)
+    return grid
+
+def reference_quantize(global_y, grid, subdivisions):
+    idx = bisect.bisect_right(grid, global_y) - 1
+    if not 0 <= idx < len(grid) - 1:
+        return global_y
+    segment_height = grid[idx + 1] - grid[idx]
+    fraction = (global_y - grid[idx]) / segment_height
+    return grid[idx] + (round(fraction * subdivisions) / subdivisions) * segment_height
+
+def synthetic_rows(rng, height, width):
+    """
+    Rows that sit on every edge of the checks: solid notes, noise, partial fills and exact std / fill boundaries.
+    """
+    kinds = rng.integers(0, 6, size=height)
+    gray = np.empty((height, width), dtype=np.uint8)
+    for y, kind in enumerate(kinds):
+        if kind == 0: # Solid bar of a random brightness
+            gray[y] = rng.integers(0, 256)
+        elif kind == 1: # Noise
+            gray[y] = rng.integers(0, 256, size=width)
+        elif kind == 2: # Bright over part of the row
+            gray[y] = 0
+            gray[y, :rng.integers(0, width + 1)] = rng.integers(150, 256)
+        elif kind == 3: # Half 0, half 160: std exactly 80
+            gray[y] = np.where(np.arange(width) % 2 == 0, 0, 160)
+        elif kind == 4: # Around the fill threshold (0.8 * 150 = 120)
+            gray[y] = rng.integers(118, 123, size=width)
+        else: # Solid note with a few dark pixels
+            gray[y] = 230
+            gray[y, rng.integers(0, width, size=rng.integers(0, width // 2 + 1))] = rng.integers(0, 100)
+    return gray
+
+class NoteRowMasksTest(unittest.TestCase):
+
+    def test_matches_the_per_lane_reference(self):
+        rng = np.random.default_rng(0)
+        for width, ratios in [(776, [1 / 9] * 9), (300, [0.1, 0.3, 0.2, 0.4]), (50, [0.5, 0.5])]:
+            gray = synthetic_rows(rng, 2000, width)
+            bounds = lane_bounds(width, ratios)
+            for threshold in (0, 150, 170, 200, 255):
+                masks = note_row_masks(gray, bounds, threshold)
+                for lane_idx, (x_start, x_end) in enumerate(bounds):
+                    expected = reference_note_row_mask(gray[:, x_start:x_end], threshold)
+                    np.testing.assert_array_equal(masks[:, lane_idx], expected, err_msg=f"lane {lane_idx}, threshold {threshold}")
+
+class GridTest(unittest.TestCase):
+
+    def test_matches_the_loops(self):
+        rng = random.Random(1)
+        for case in range(200):
+            line_height = rng.uniform(50, 900)
+            lines = sorted(rng.uniform(0, 200 * line_height) for _ in range(rng.randint(2, 40)))
+            # Notes before, inside and after the detected lines, and on the lines themselves
+            note_ys = [rng.uniform(-50 * line_height, 300 * line_height) for _ in range(200)] + lines
+            min_y, max_y = (min(note_ys), max(note_ys)) if case % 5 else (0, 0)
+
+            expected_grid = reference_grid(lines, line_height, min_y, max_y)
+            grid = generate_grid(lines, line_height, min_y, max_y)
+            self.assertEqual(grid.tolist(), expected_grid, f"case {case}")
+
+            snapped, inside = quantize_rows(note_ys, grid, 192)
+            self.assertEqual(snapped.tolist(), [reference_quantize(y, expected_grid, 192) for y in note_ys], f"case {case}")
+            self.assertEqual(inside.tolist(), [0 <= bisect.bisect_right(expected_grid, y) - 1 < len(expected_grid) - 1 for y in note_ys])
+
+# (lane, first row, rows) of the notes in the synthetic waterfall; rows ascend in time
+NOTES = [(0, 90, 20), (1, 195, 12), (2, 296, 8), (0, 400, 30), (1, 640, 4)]
+# A 3-row gap inside a note (merged with --merge-gap 5)
+GAPPED_NOTE = (2, 500, 10, 3, 10)
+
+def synthetic_waterfall(height=800, width=90):
+    """
+    Single-channel waterfall with three lanes of solid notes on black.
+    """
+    waterfall = np.zeros((height, width), dtype=np.uint8)
+    for lane, lo, h in NOTES:
+        waterfall[lo:lo + h, lane * 30:lane * 30 + 30] = 230
+    lane, lo, h1, gap, h2 = GAPPED_NOTE
+    waterfall[lo:lo + h1, lane * 30:lane * 30 + 30] = 230
+    waterfall[lo + h1 + gap:lo + h1 + gap + h2, lane * 30:lane * 30 + 30] = 230
+    return waterfall
+
+class StitchingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.waterfall = synthetic_waterfall()
+        lane, lo, h1, gap, h2 = GAPPED_NOTE
+        self.expected = sorted([(lane, lo + h / 2, h) for lane, lo, h in NOTES] + [(lane, lo + (h1 + gap + h2) / 2, h1 + gap + h2)])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def detect(self, chunk_size, *args):
+        np.save(os.path.join(self.dir, STORE_FILENAME), self.waterfall)
+        with open(os.path.join(self.dir, "metadata.json"), 'w') as f:
+            json.dump({"fps": 60, "speed": 10, "start_time": 0, "channels": "max", "chunk_size": chunk_size}, f)
+        result = helpers.run_script("detect_notes.py", "--input", self.dir, "--lanes", 3, "--source", "store", *args)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        with open(os.path.join(self.dir, "notes.json"), 'r') as f:
+            return json.load(f)["notes"]
+
+    def test_notes_across_chunk_boundaries_are_found_once(self):
+        for chunk_size in (100, 7, 64, 1000):
+            notes = self.detect(chunk_size)
+            self.assertEqual(sorted((n["lane"], n["global_y"], n["h"]) for n in notes), self.expected, f"chunk size {chunk_size}")
+            for note in notes:
+                # Attributed to the chunk holding its center, in that chunk's (top-down) rows
+                self.assertEqual(note["chunk_base_y"], note["chunk_index"] * chunk_size)
+                self.assertTrue(0 < note["y"] <= note["chunk_height"])
+                self.assertEqual(note["y"], note["chunk_height"] - (note["global_y"] - note["chunk_base_y"]))
+
+        # Chunks classified in worker processes are stitched the same way
+        self.assertEqual(self.detect(64, "--workers", 2), self.detect(64))
+
+    def test_streaming_detector_does_not_depend_on_piece_size(self):
+        for piece in (1, 5, 97, 800):
+            detector = StreamingDetector(90, [1 / 3] * 3, 200, 3, 5)
+            events = []
+            for start in range(0, len(self.waterfall), piece):
+                events += detector.feed(self.waterfall[start:start + piece])
+            events += detector.flush()
+            self.assertEqual(sorted((e["lane"], e["global_y"], e["h"]) for e in events), self.expected, f"piece {piece}")
+
+    def test_hold_centred_on_a_bar_line(self):
+        # The bar line ends long before the hold does: it must still be known when the hold closes
+        self.waterfall = np.zeros((600, 90), dtype=np.uint8)
+        self.waterfall[100:400, 0:30] = 230
+        self.waterfall[249:251] = 230
+        for piece in (1, 100, 600):
+            detector = StreamingDetector(90, [1 / 3] * 3, 200, 3, 5)
+            events = []
+            for start in range(0, len(self.waterfall), piece):
+                events += detector.feed(self.waterfall[start:start + piece])
+            events += detector.flush()
+            self.assertEqual([e["global_y"] for e in events if e["type"] == "bar"], [250.0], f"piece {piece}")
+            self.assertEqual([e for e in events if e["type"] == "note"], [], f"piece {piece}")
+        for chunk_size in (1, 100, 600):
+            self.assertEqual(self.detect(chunk_size), [], f"chunk size {chunk_size}")
+
+BUNDLED_VIDEO = os.path.join(os.path.dirname(helpers.SCRIPTS_DIR), "source", "inside_identity.mp4")
+# The chart of the bundled video
+CHART = ["--y", 700, "--x1", 444, "--x2", 1220, "--speed", 7.3, "--start", 10, "--end", 40, "--store", "--pyramid-levels", 0]
+
+@unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg is not installed")
+@unittest.skipIf(not os.path.exists(BUNDLED_VIDEO), "the bundled video is missing")
+class LumaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def detect(self, name, *args):
+        output = os.path.join(self.dir, name)
+        result = helpers.run_script("slit_scan.py", "--video", BUNDLED_VIDEO, "--output", output, *(CHART + list(args)))
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        result = helpers.run_script("detect_notes.py", "--input", output)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        with open(os.path.join(output, "notes.json"), 'r') as f:
+            return json.load(f)
+
+    def test_luma_detection_matches_bgr(self):
+        expected = self.detect("bgr")
+        detected = self.detect("luma", "--channels", "luma", "--backend", "ffmpeg")
+        self.assertGreater(expected["bpm"], 0)
+        self.assertEqual(detected["bpm"], expected["bpm"])
+        self.assertEqual(detected["bar_lines"], expected["bar_lines"])
+
+        # Luma cannot see every saturated pixel the max channel does: a few short notes may differ
+        def unmatched(notes, others):
+            return [n for n in notes if not any(o["lane"] == n["lane"] and abs(o["global_y"] - n["global_y"]) <= 2 for o in others)]
+        self.assertLessEqual(len(unmatched(expected["notes"], detected["notes"])), len(expected["notes"]) // 20)
+        self.assertLessEqual(len(unmatched(detected["notes"], expected["notes"])), len(expected["notes"]) // 20)
+
+    def test_luma_needs_the_ffmpeg_backend(self):
+        output = os.path.join(self.dir, "out")
+        result = helpers.run_script("slit_scan.py", "--video", BUNDLED_VIDEO, "--output", output, *CHART, "--channels", "luma")
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("--backend ffmpeg", result.stdout)
+        self.assertFalse(os.path.exists(output))
+
+if __name__ == "__main__":
+    unittest.main()
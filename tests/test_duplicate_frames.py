@@ -0,0 +1,97 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import numpy as np
+
+import helpers
+
+from duplicate_frames import DUPLICATES_FILENAME
+from frame_index import FrameIndex
+
+BUNDLED_VIDEO = os.path.join(os.path.dirname(helpers.SCRIPTS_DIR), "source", "inside_identity.mp4")
+
+def doubled(frames):
+    """
+    30 fps gameplay re-encoded at 60 fps: every frame twice.
+    """
+    return [i for i in frames for _ in range(2)]
+
+def duplicates_of(order, max_run=3):
+    """
+    Offsets of the frames that repeat the previous one, leaving out runs longer than max_run.
+    """
+    repeated = [k for k in range(1, len(order)) if order[k] == order[k - 1]]
+    runs = []
+    for k in repeated:
+        if runs and runs[-1][-1] == k - 1:
+            runs[-1].append(k)
+        else:
+            runs.append([k])
+    return [k for run in runs if len(run) <= max_run for k in run]
+
+class DuplicateFramesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def scan(self, order, *args):
+        video = os.path.join(self.dir, "synthetic.avi")
+        helpers.make_video(video, frames=120, order=order, fps=60)
+        output = os.path.join(self.dir, "out")
+        result = helpers.run_script("slit_scan.py", "--video", video, "--output", output, "--y", 40, "--x1", 0, "--x2", 96,
+                                    "--speed", 3, "--pyramid-levels", 0, *args)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        return output
+
+    def test_known_pattern_is_found(self):
+        # 30-in-60, plus two frames the recorder repeated a third time
+        order = doubled(range(120))
+        order[50:50] = [order[50]]
+        order[151:151] = [order[151]]
+        expected = duplicates_of(order)
+        self.assertEqual(len(expected), 122)
+
+        output = self.scan(order, "--duplicates", "detect")
+        self.assertEqual(np.load(os.path.join(output, DUPLICATES_FILENAME)).tolist(), expected)
+
+    def test_static_frames_are_not_duplicates(self):
+        # A frozen screen and a black one inside 30-in-60 gameplay
+        order = doubled(range(40)) + [40] * 30 + doubled(range(41, 80)) + [None] * 20 + doubled(range(80, 120))
+        expected = duplicates_of(order)
+        self.assertEqual(len(expected), 40 + 39 + 40)
+
+        output = self.scan(order, "--duplicates", "detect")
+        self.assertEqual(np.load(os.path.join(output, DUPLICATES_FILENAME)).tolist(), expected)
+
+        # Collapsing takes the rows of the duplicates only: past its first frames, a static screen keeps its rows
+        output = self.scan(order, "--duplicates", "collapse")
+        self.assertEqual(np.load(os.path.join(output, DUPLICATES_FILENAME)).tolist(), expected)
+        heights = np.diff(FrameIndex.load(output).frame_rows.astype(np.int64))
+        self.assertEqual(heights.sum(), 3 * (len(order) - 1)) # The last frame is a duplicate, with no later frame to take its rows
+        self.assertEqual(np.flatnonzero(heights == 0).tolist(), sorted(expected + [81, 82, 83, 189, 190, 191]))
+
+    @unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg is not installed")
+    @unittest.skipIf(not os.path.exists(BUNDLED_VIDEO), "the bundled video is missing")
+    def test_threshold_on_a_re_encode_of_the_bundled_video(self):
+        video = os.path.join(self.dir, "30in60.mp4")
+        subprocess.run(["ffmpeg", "-v", "error", "-ss", "20", "-t", "10", "-i", BUNDLED_VIDEO, "-vf", "fps=30,fps=60",
+                        "-c:v", "mpeg4", "-q:v", "4", "-an", video], check=True)
+        output = os.path.join(self.dir, "out")
+        result = helpers.run_script("slit_scan.py", "--video", video, "--output", output, "--y", 700, "--x1", 444, "--x2", 1220,
+                                    "--speed", 7.3, "--pyramid-levels", 0, "--duplicates", "detect")
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        found = set(np.load(os.path.join(output, DUPLICATES_FILENAME)).tolist())
+        # Every second frame repeats the one before it. Where nothing moves above
+        # the scan line a few frames can't be told apart either way.
+        repeats = set(range(1, 600, 2))
+        self.assertLessEqual(len(repeats - found), 6)
+        self.assertLessEqual(len(found - repeats), 6)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import helpers # noqa: F401 (puts scripts/ on the path)
+
+from find_gameplay import find_intervals, highway_present, parse_intervals
+
+def highway(present):
+    """
+    A highway region that highway_present() classifies as gameplay (dark with a bright lane line) or not (a menu).
+    """
+    region = np.full((20, 40, 3), 30 if present else 180, dtype=np.uint8)
+    region[:, 20] = 255
+    return region
+
+class FakeSampler:
+    """
+    Seeks in a video that shows gameplay during the given [start, end) spans.
+    """
+
+    def __init__(self, gameplay):
+        self.gameplay = gameplay
+        self.count = 0
+
+    def present(self, seconds):
+        return any(start <= seconds < end for start, end in self.gameplay)
+
+    def sample(self, seconds):
+        self.count += 1
+        return highway(self.present(seconds))
+
+def find(gameplay, duration=100.0, step=5.0, resolution=0.1, min_length=20.0, min_gap=10.0, pad=1.0):
+    sampler = FakeSampler(gameplay)
+    samples = [(float(t), sampler.present(float(t))) for t in np.arange(0.0, duration, step)]
+    return find_intervals(samples, sampler, duration, resolution, min_length, min_gap, pad), sampler
+
+class FindIntervalsTest(unittest.TestCase):
+
+    def assertIntervals(self, intervals, expected, delta):
+        self.assertEqual(len(intervals), len(expected), intervals)
+        for (start, end), (expected_start, expected_end) in zip(intervals, expected):
+            self.assertAlmostEqual(start, expected_start, delta=delta)
+            self.assertAlmostEqual(end, expected_end, delta=delta)
+
+    def test_highway_classes(self):
+        self.assertTrue(highway_present(highway(True)))
+        self.assertFalse(highway_present(highway(False)))
+        self.assertFalse(highway_present(np.zeros((20, 40, 3), dtype=np.uint8))) # A black fade
+
+    def test_boundaries_are_refined_and_padded(self):
+        intervals, sampler = find([(12.3, 47.8), (60.2, 95.0)])
+        self.assertIntervals(intervals, [(11.3, 48.8), (59.2, 96.0)], 0.1)
+        # Bisecting 5 s down to 0.1 s takes 6 seeks per boundary
+        self.assertEqual(sampler.count, 4 * 6)
+
+    def test_short_gaps_are_merged_and_short_runs_dropped(self):
+        intervals, _ = find([(10.0, 40.0), (46.0, 80.0), (92.0, 99.0)], resolution=0.5)
+        self.assertIntervals(intervals, [(9.0, 81.0)], 0.5)
+
+    def test_gameplay_at_the_ends_of_the_video(self):
+        intervals, _ = find([(0.0, 30.0), (70.0, 100.0)])
+        self.assertIntervals(intervals, [(0.0, 31.0), (69.0, 100.0)], 0.1)
+        intervals, _ = find([(0.0, 100.0)])
+        self.assertEqual(intervals, [[0.0, 100.0]])
+        intervals, _ = find([])
+        self.assertEqual(intervals, [])
+
+    def test_padding_joins_close_intervals(self):
+        intervals, _ = find([(10.0, 40.0), (41.5, 80.0)], min_gap=1.0, resolution=0.01)
+        self.assertIntervals(intervals, [(9.0, 81.0)], 0.01)
+
+class ParseIntervalsTest(unittest.TestCase):
+
+    def test_inline_and_file(self):
+        self.assertEqual(parse_intervals("30-40,5.5-10"), [[5.5, 10.0], [30.0, 40.0]])
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "intervals.json")
+            with open(path, 'w') as f:
+                f.write('{"intervals": [[30, 40], [5.5, 10]]}')
+            self.assertEqual(parse_intervals(path), [[5.5, 10.0], [30.0, 40.0]])
+        finally:
+            shutil.rmtree(directory)
+        with self.assertRaises(ValueError):
+            parse_intervals("40-30")
+
+if __name__ == "__main__":
+    unittest.main()
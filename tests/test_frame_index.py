@@ -0,0 +1,42 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import helpers # noqa: F401 (puts scripts/ on the path)
+
+from frame_index import FrameIndex, write_index
+from seek_index import SeekIndex
+
+class FrameIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_constant_frame_rate_times_follow_fps(self):
+        write_index(self.dir, 10, [3, 3, 3])
+        index = FrameIndex.load(self.dir)
+        self.assertIsNone(index.times)
+        np.testing.assert_allclose(index.row_to_time([0, 1.5, 9], 30), [10 / 30, 10.5 / 30, 13 / 30])
+
+    def test_variable_frame_rate_times_come_from_the_seek_index(self):
+        # Frames 0-2 last 20 ms, frames 3-5 last 50 ms (and a frame past the end the median)
+        seek_index = SeekIndex([0, 20, 40, 60, 110, 160], [0], 30)
+        self.assertTrue(seek_index.vfr)
+        for frames in ([1, 2, 3, 4], [1, 2, 4, 5]):
+            write_index(self.dir, 0, [2, 2, 2, 2], frames, seek_index.times_of_frames(frames[0], frames[-1] + 2))
+            index = FrameIndex.load(self.dir)
+            times = index.row_to_time(np.arange(0, 8), 30)
+            expected = [seek_index.time_of_frame(f) for f in frames]
+            np.testing.assert_allclose(times[::2], expected)
+            # Halfway up a strip is halfway to the next frame's timestamp
+            middle = 0.5 * (seek_index.time_of_frame(frames[1]) + seek_index.time_of_frame(frames[1] + 1))
+            self.assertAlmostEqual(float(index.row_to_time(3, 30)), middle)
+        self.assertAlmostEqual(float(index.row_to_time(8, 30)), 0.16 + seek_index.frame_duration / 1000.0)
+
+if __name__ == "__main__":
+    unittest.main()
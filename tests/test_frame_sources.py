@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import helpers
+
+from frame_sources import IntervalSource, OpenCVSource, parse_ffmpeg_version, passthrough_args
+
+class FailingSeekIndex:
+    """
+    A seek index that can never seek (e.g. an index that does not match the file).
+    """
+
+    def seek(self, cap, frame):
+        for _ in range(3):
+            cap.grab() # Leaves the capture somewhere unrelated
+        return False
+
+class OpenCVSourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.video = os.path.join(self.dir, "synthetic.avi")
+        helpers.make_video(self.video, frames=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_failed_index_seek_falls_back_to_opencv(self):
+        crop = (0, 0, 96, 64)
+        for start_frame in (0, 30):
+            expected = OpenCVSource(self.video, crop, start_frame)
+            source = OpenCVSource(self.video, crop, start_frame, seek_index=FailingSeekIndex())
+            self.assertEqual(source.position, start_frame)
+            for _ in range(5):
+                np.testing.assert_array_equal(source.read(), expected.read())
+            source.release()
+            expected.release()
+
+class IntervalSourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.video = os.path.join(self.dir, "synthetic.avi")
+        helpers.make_video(self.video, frames=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_reads_the_ranges_back_to_back(self):
+        crop = (0, 10, 96, 20)
+        ranges = [(2, 5), (5, 7), (20, 21), (40, 44)]
+        opened = []
+
+        def open_range(start, end):
+            opened.append((start, end))
+            return OpenCVSource(self.video, crop, start, end)
+
+        source = IntervalSource(open_range, ranges)
+        # Only the first range is open before reading
+        self.assertEqual(opened, ranges[:1])
+        whole = OpenCVSource(self.video, crop)
+        frames = [whole.read().copy() for _ in range(60)]
+        whole.release()
+
+        for frame in [f for start, end in ranges for f in range(start, end)]:
+            self.assertEqual(source.position, frame)
+            np.testing.assert_array_equal(source.read(), frames[frame], err_msg=f"frame {frame}")
+        self.assertIsNone(source.read())
+        self.assertEqual(opened, ranges)
+        source.release()
+
+class FFmpegVersionTest(unittest.TestCase):
+
+    def test_versions(self):
+        self.assertEqual(parse_ffmpeg_version("ffmpeg version 4.4.2-0ubuntu0.22.04.1 Copyright (c) 2000-2021"), (4, 4))
+        self.assertEqual(parse_ffmpeg_version("ffmpeg version n5.1.2 Copyright (c) 2000-2022"), (5, 1))
+        self.assertEqual(parse_ffmpeg_version("ffmpeg version 7.0.2-static https://johnvansickle.com/ffmpeg/"), (7, 0))
+        self.assertIsNone(parse_ffmpeg_version("ffmpeg version N-113008-g7a0b1b5 Copyright (c) 2000-2023"))
+
+    def test_missing_ffmpeg_gets_the_current_option(self):
+        self.assertEqual(passthrough_args(os.path.join(tempfile.gettempdir(), "no-such-ffmpeg")), ['-fps_mode', 'passthrough'])
+
+if __name__ == "__main__":
+    unittest.main()
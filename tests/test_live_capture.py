@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+import helpers
+from waterfall_store import STORE_FILENAME
+
+class LiveCaptureTest(unittest.TestCase):
+
+    def test_errors_stay_out_of_the_note_stream(self):
+        # stdout is NDJSON for the consumer: errors go to stderr
+        result = helpers.run_script("live_capture.py", "--device", 0, "--input", "-", "--y", 1, "--x1", 0, "--x2", 2)
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stdout, "")
+        self.assertIn("Error:", result.stderr)
+
+        result = helpers.run_script("live_capture.py", "--input", "-", "--width", 64, "--height", 48, "--fps", 30,
+                                    "--y", 1, "--x1", 0, "--x2", 2, "--lanes", 3, "--lane-ratios", "1,2")
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stdout, "")
+
+    def test_piped_frames_produce_notes_and_an_end_event(self):
+        directory = tempfile.mkdtemp()
+        try:
+            video = os.path.join(directory, "synthetic.avi")
+            helpers.make_video(video, frames=120)
+            cap = cv2.VideoCapture(video)
+            raw = []
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                raw.append(frame.tobytes())
+            cap.release()
+        finally:
+            shutil.rmtree(directory)
+
+        # Same as `ffmpeg -i video -f rawvideo -pix_fmt bgr24 - | live_capture.py --input -`
+        # (the synthetic rows span the whole width: at the default threshold most of them are bar lines)
+        result = subprocess.run([sys.executable, os.path.join(helpers.SCRIPTS_DIR, "live_capture.py"),
+                                 "--input", "-", "--width", "96", "--height", "64", "--fps", "30",
+                                 "--y", "40", "--x1", "0", "--x2", "96", "--speed", "3", "--lanes", "4", "--threshold", "240"],
+                                input=b"".join(raw), capture_output=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        events = [json.loads(line) for line in result.stdout.decode().splitlines()]
+        notes = [event for event in events if event["type"] == "note"]
+        self.assertGreater(len(notes), 0)
+        for note in notes:
+            self.assertIn("lane", note)
+            self.assertGreaterEqual(note["time"], 0.0)
+        self.assertEqual(events[-1], {"type": "end", "frames": len(raw), "rows": 3 * len(raw), "notes": len(notes)})
+
+    def test_holds_across_a_bar_line_match_offline_detection(self):
+        # 600 waterfall rows (3 per frame) with a bar line at rows 249:251: the lane 0 hold is
+        # centred on it (dropped), the lane 2 hold only crosses it (kept)
+        waterfall = np.zeros((600, 90), dtype=np.uint8)
+        waterfall[100:400, 0:30] = 230
+        waterfall[50:350, 60:90] = 230
+        waterfall[450:470, 30:60] = 230
+        waterfall[249:251] = 230
+
+        # The 3-row band under the scan line (y 4) holds the frame's rows, earliest at the bottom
+        frames = np.zeros((200, 16, 90, 3), dtype=np.uint8)
+        frames[:, 4:7] = waterfall.reshape(200, 3, 90)[:, ::-1, :, None]
+        result = subprocess.run([sys.executable, os.path.join(helpers.SCRIPTS_DIR, "live_capture.py"),
+                                 "--input", "-", "--width", "90", "--height", "16", "--fps", "60",
+                                 "--y", "4", "--x1", "0", "--x2", "90", "--speed", "3", "--lanes", "3",
+                                 "--max-latency", "0"],
+                                input=frames.tobytes(), capture_output=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        events = [json.loads(line) for line in result.stdout.decode().splitlines()]
+        live = sorted((e["lane"], e["global_y"], e["h"]) for e in events if e["type"] == "note")
+
+        directory = tempfile.mkdtemp()
+        try:
+            np.save(os.path.join(directory, STORE_FILENAME), waterfall)
+            with open(os.path.join(directory, "metadata.json"), 'w') as f:
+                json.dump({"fps": 60, "speed": 3, "start_time": 0, "channels": "max", "chunk_size": 100}, f)
+            offline = helpers.run_script("detect_notes.py", "--input", directory, "--lanes", 3, "--source", "store")
+            self.assertEqual(offline.returncode, 0, offline.stdout + offline.stderr)
+            with open(os.path.join(directory, "notes.json"), 'r') as f:
+                notes = json.load(f)["notes"]
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(live, sorted((n["lane"], n["global_y"], n["h"]) for n in notes))
+        self.assertEqual(live, [(1, 460.0, 20.0), (2, 200.0, 300.0)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import helpers # noqa: F401 (puts scripts/ on the path)
+
+from scan_cache import INDEX_FILENAME, ScanCache
+
+def write_files(directory, files):
+    for name, data in files.items():
+        path = os.path.join(directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+def list_files(directory):
+    return sorted(os.path.relpath(os.path.join(root, name), directory)
+                  for root, _, names in os.walk(directory) for name in names)
+
+class ScanCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.dir, "cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def output(self, name, files):
+        path = os.path.join(self.dir, name)
+        write_files(path, files)
+        return path
+
+    def test_restore_replaces_the_outputs_of_a_longer_scan(self):
+        cache = ScanCache(self.cache_dir, 1024 * 1024)
+        short = self.output("short", {"chunk_0.jpg": b"new", "metadata.json": b"{}", "pyramid/2/chunk_0.jpg": b"new"})
+        self.assertEqual(cache.store("key", short, "video.mp4", {}), [])
+
+        target = self.output("target", {"chunk_0.jpg": b"old", "chunk_1.jpg": b"old", "pyramid/2/chunk_1.jpg": b"old",
+                                        "waterfall.npy": b"old", "notes.json": b"mine", "batch.key": b"mine"})
+        self.assertTrue(cache.restore("key", target))
+        self.assertEqual(list_files(target), ["batch.key", "chunk_0.jpg", "metadata.json", "notes.json",
+                                              os.path.join("pyramid", "2", "chunk_0.jpg")])
+        with open(os.path.join(target, "chunk_0.jpg"), 'rb') as f:
+            self.assertEqual(f.read(), b"new")
+
+    def test_output_larger_than_the_quota_is_not_cached(self):
+        cache = ScanCache(self.cache_dir, 1000)
+        self.assertEqual(cache.store("small", self.output("small", {"chunk_0.jpg": b"x" * 400}), "video.mp4", {}), [])
+        self.assertIsNone(cache.store("big", self.output("big", {"chunk_0.jpg": b"x" * 2000}), "video.mp4", {}))
+
+        self.assertTrue(os.path.isdir(os.path.join(self.cache_dir, "small")))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "big")))
+        with open(os.path.join(self.cache_dir, INDEX_FILENAME), 'r') as f:
+            self.assertEqual(list(json.load(f)), ["small"])
+
+    def test_new_entry_evicts_older_ones_but_not_itself(self):
+        cache = ScanCache(self.cache_dir, 1000)
+        cache.store("old", self.output("old", {"chunk_0.jpg": b"x" * 600}), "video.mp4", {})
+        self.assertEqual(cache.store("new", self.output("new", {"chunk_0.jpg": b"x" * 600}), "video.mp4", {}), ["old"])
+        self.assertTrue(cache.restore("new", os.path.join(self.dir, "restored")))
+
+if __name__ == "__main__":
+    unittest.main()
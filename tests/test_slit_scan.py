@@ -0,0 +1,258 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+import helpers
+
+from frame_index import FrameIndex
+from seek_index import INDEX_SUFFIX
+from slit_scan import interval_ranges, sequence_frame, sequence_frames, sequence_ranges
+from waterfall_store import STORE_FILENAME
+
+SCAN = ["--y", 40, "--x1", 0, "--x2", 96, "--speed", 3, "--chunk-size", 30, "--pyramid-levels", 1]
+
+class HalfSpeedSeekIndex:
+    """
+    A seek index of a video whose frames last 1/20 s.
+    """
+
+    def frame_at_time(self, seconds):
+        return int(seconds * 20)
+
+class SequenceTest(unittest.TestCase):
+
+    def test_interval_ranges(self):
+        # Sorted, overlapping ones merged, empty ones dropped
+        self.assertEqual(interval_ranges([[5, 6], [1, 2], [1.5, 3], [7, 7.05]], 0, 0, None, 10), [(10, 30), (50, 60)])
+        # Clipped to --start / --end
+        self.assertEqual(interval_ranges([[1, 5], [8, 9]], 2, 4, None, 10), [(20, 40)])
+        self.assertEqual(interval_ranges([[1, 5]], 6, 0, None, 10), [])
+        # Frames come from the seek index when there is one
+        self.assertEqual(interval_ranges([[1, 2]], 0, 0, HalfSpeedSeekIndex(), 10), [(20, 40)])
+
+    def test_frames_through_the_ranges(self):
+        for ranges in ([(10, 20), (50, 55)], [(10, 20), (30, None)], [(0, None)]):
+            frames = [sequence_frame(ranges, offset) for offset in range(30)]
+            self.assertEqual(sequence_frames(ranges, 15), frames[:15], ranges)
+            for first, last in ((0, 15), (5, 12), (10, 11), (12, None), (3, 3)):
+                expected = frames[first:30 if last is None else last]
+                if last is None and ranges[-1][1] is not None:
+                    expected = [f for f in expected if f < ranges[-1][1]]
+                covered = [f for start, end in sequence_ranges(ranges, first, last)
+                           for f in range(start, start + (len(expected) if end is None else end - start))]
+                self.assertEqual(covered, expected, (ranges, first, last))
+
+        self.assertEqual(sequence_frame([(10, 20), (50, 55)], 14), 54)
+        self.assertEqual(sequence_frame([(10, 20), (50, 55)], 17), 57) # Past the end
+        self.assertEqual(sequence_ranges([(10, 20), (50, 55)], 5, 12), [(15, 20), (50, 52)])
+        self.assertEqual(sequence_ranges([(10, 20), (50, 55)], 20), [(60, 60)])
+
+class SlitScanTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.video_dir = tempfile.mkdtemp()
+        cls.video = os.path.join(cls.video_dir, "synthetic.avi")
+        helpers.make_video(cls.video, frames=3000)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.video_dir)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def scan(self, name, *args):
+        output = os.path.join(self.dir, name)
+        result = helpers.run_script("slit_scan.py", "--video", self.video, "--output", output, *(SCAN + list(args)))
+        return output, result
+
+    def kill_scan(self, name, *args):
+        output = os.path.join(self.dir, name)
+        if not helpers.scan_until_killed(output, "--video", self.video, *(SCAN + list(args))):
+            self.skipTest("The scan finished before it could be killed")
+        return output
+
+    def test_workers_match_a_serial_scan(self):
+        for speed in (3, 2.7):
+            reference, result = self.scan(f"serial_{speed}", "--speed", speed)
+            self.assertEqual(result.returncode, 0, result.stdout)
+            expected = helpers.output_files(reference)
+            for workers in (2, 3):
+                output, result = self.scan(f"workers_{workers}_{speed}", "--speed", speed, "--workers", workers)
+                self.assertEqual(result.returncode, 0, result.stdout)
+                self.assertIn(f"shards with {workers} workers", result.stdout)
+                self.assertEqual(helpers.output_files(output), expected, f"speed {speed}, {workers} workers")
+
+    def test_rois_match_single_roi_scans(self):
+        rois = ["40,0,96", "20,10,80"]
+        references = []
+        for i, roi in enumerate(rois):
+            y, x1, x2 = roi.split(",")
+            reference, result = self.scan(f"single_{i}", "--speed", 2.7, "--store", "--y", y, "--x1", x1, "--x2", x2)
+            self.assertEqual(result.returncode, 0, result.stdout)
+            references.append(reference)
+        for workers in (1, 2):
+            output, result = self.scan(f"rois_{workers}", "--speed", 2.7, "--store", "--workers", workers,
+                                       "--roi", rois[0], "--roi", rois[1])
+            self.assertEqual(result.returncode, 0, result.stdout)
+            if workers > 1:
+                self.assertIn(f"shards with {workers} workers", result.stdout)
+            for i, reference in enumerate(references):
+                roi_output = os.path.join(output, f"roi_{i}")
+                self.assertEqual(helpers.output_files(roi_output), helpers.output_files(reference), f"roi_{i}, {workers} workers")
+                with open(os.path.join(roi_output, STORE_FILENAME), 'rb') as a, open(os.path.join(reference, STORE_FILENAME), 'rb') as b:
+                    self.assertEqual(a.read(), b.read(), f"roi_{i}, {workers} workers")
+
+    def test_chunks_have_exact_heights(self):
+        output, result = self.scan("out", "--speed", 2.7)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        index = FrameIndex.load(output)
+        chunk_count = -(-index.row_count // 30)
+        for i in range(chunk_count):
+            chunk = cv2.imdecode(np.fromfile(os.path.join(output, f"chunk_{i}.jpg"), dtype=np.uint8), cv2.IMREAD_COLOR)
+            self.assertEqual(chunk.shape[0], min(30, index.row_count - i * 30), f"chunk {i}")
+        self.assertFalse(os.path.exists(os.path.join(output, f"chunk_{chunk_count}.jpg")))
+
+    def test_stride_maps_rows_to_the_same_frames(self):
+        # At 3 px/frame, a stride 2 strip holds the 6 rows of its own frame and the empty one before it
+        reference, result = self.scan("stride_1", "--stride", 1)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        output, result = self.scan("stride_2", "--stride", 2)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        expected, index = FrameIndex.load(reference), FrameIndex.load(output)
+        self.assertEqual(index.row_count, expected.row_count)
+        self.assertEqual(index.frame_count, expected.frame_count)
+        self.assertEqual(np.count_nonzero(np.diff(index.frame_rows.astype(np.int64))), index.frame_count // 2)
+
+        rows = np.arange(0, index.row_count, 0.25)
+        np.testing.assert_allclose(index.row_to_frame(rows), expected.row_to_frame(rows))
+        np.testing.assert_allclose(index.row_to_time(rows, 30), expected.row_to_time(rows, 30))
+        np.testing.assert_allclose(index.row_to_time(rows, 30), rows / 3 / 30)
+
+    def test_chunk_size_below_one_is_rejected(self):
+        for args in (["--chunk-size", 0], ["--chunk-size", 0, "--workers", 2], ["--chunk-size", -5]):
+            output, result = self.scan("out", *args)
+            self.assertEqual(result.returncode, 1, args)
+            self.assertIn("--chunk-size must be at least 1", result.stdout)
+            self.assertFalse(os.path.exists(output))
+
+    def test_unreadable_intervals_are_rejected(self):
+        for intervals in (os.path.join(self.dir, "missing.json"), "40-30"):
+            output, result = self.scan("out", "--intervals", intervals)
+            self.assertEqual(result.returncode, 1, intervals)
+            self.assertIn("Could not read --intervals", result.stdout)
+            self.assertFalse(os.path.exists(output))
+
+    def test_preview_stays_in_step_with_the_chunks(self):
+        # Strips split across chunk boundaries at speed 2.7: a full-size preview is the same image
+        output, result = self.scan("out", "--speed", 2.7, "--preview-scale", 1.0)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        chunks = helpers.output_files(output)
+        for name in chunks:
+            if name.startswith("chunk_"):
+                self.assertEqual(helpers.output_files(os.path.join(output, "preview")).get(name), chunks[name], name)
+
+    def test_killed_scan_resumes_to_the_same_output(self):
+        for speed in (3, 2.7):
+            output = self.kill_scan(f"out_{speed}", "--speed", speed)
+            _, result = self.scan(f"out_{speed}", "--speed", speed, "--resume")
+            self.assertEqual(result.returncode, 0, result.stdout)
+            self.assertIn("Resuming at chunk", result.stdout)
+            reference, _ = self.scan(f"reference_{speed}", "--speed", speed)
+            self.assertEqual(helpers.output_files(output), helpers.output_files(reference), f"speed {speed}")
+
+    @unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg is not installed")
+    def test_ffmpeg_backend_matches_opencv(self):
+        # Odd band heights and offsets: a 4:2:0 crop must not snap to even rows
+        for y in (40, 41):
+            reference, result = self.scan(f"opencv_{y}", "--speed", 2.7, "--y", y)
+            self.assertEqual(result.returncode, 0, result.stdout)
+            output, result = self.scan(f"ffmpeg_{y}", "--speed", 2.7, "--y", y, "--backend", "ffmpeg")
+            self.assertEqual(result.returncode, 0, result.stdout)
+            self.assertEqual(helpers.output_files(output), helpers.output_files(reference), f"y {y}")
+
+    @unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg is not installed")
+    def test_ffmpeg_luma_has_the_shape_of_a_colour_scan(self):
+        # extractplanes=y after an odd crop must still hand out whole w x h planes
+        reference, result = self.scan("bgr", "--speed", 2.7, "--y", 41, "--x1", 1, "--store")
+        self.assertEqual(result.returncode, 0, result.stdout)
+        output, result = self.scan("luma", "--speed", 2.7, "--y", 41, "--x1", 1, "--store", "--channels", "luma", "--backend", "ffmpeg")
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertEqual(np.load(os.path.join(output, STORE_FILENAME)).shape, np.load(os.path.join(reference, STORE_FILENAME)).shape[:2])
+        self.assertEqual(helpers.output_files(output)["frame_index.bin"], helpers.output_files(reference)["frame_index.bin"])
+
+    @unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg is not installed")
+    def test_cache_keeps_the_backends_apart(self):
+        cache_dir = os.path.join(self.dir, "cache")
+        _, result = self.scan("opencv", "--cache-dir", cache_dir)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        _, result = self.scan("ffmpeg", "--cache-dir", cache_dir, "--backend", "ffmpeg")
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertNotIn("Cache hit", result.stdout)
+        _, result = self.scan("ffmpeg_again", "--cache-dir", cache_dir, "--backend", "ffmpeg")
+        self.assertIn("Cache hit", result.stdout)
+
+    def test_cache_hit_skips_the_seek_index(self):
+        cache_dir = os.path.join(self.dir, "cache")
+        _, result = self.scan("first", "--cache-dir", cache_dir)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        os.remove(self.video + INDEX_SUFFIX)
+        _, result = self.scan("again", "--cache-dir", cache_dir)
+        self.assertIn("Cache hit", result.stdout)
+        self.assertFalse(os.path.exists(self.video + INDEX_SUFFIX))
+
+    def test_killed_parallel_scan_resumes_to_the_same_output(self):
+        reference, _ = self.scan("reference", "--speed", 2.7, "--store")
+        for workers in (2, 1):
+            # Every shard continues from its own checkpoint, with as many workers as the resumed run has
+            output = self.kill_scan(f"out_{workers}", "--speed", 2.7, "--store", "--workers", 3)
+            self.assertIn("shards", helpers.read_metadata(output)["checkpoint"])
+            _, result = self.scan(f"out_{workers}", "--speed", 2.7, "--store", "--workers", workers, "--resume")
+            self.assertEqual(result.returncode, 0, result.stdout)
+            self.assertRegex(result.stdout, r"Shard \d: resuming at chunk")
+            self.assertEqual(helpers.output_files(output), helpers.output_files(reference), f"{workers} workers")
+            with open(os.path.join(output, STORE_FILENAME), 'rb') as a, open(os.path.join(reference, STORE_FILENAME), 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+            self.assertEqual(sorted(name for name in os.listdir(output) if "shard" in name), [])
+
+    def test_resume_rejects_a_different_store_setting(self):
+        output = self.kill_scan("out", "--store")
+        self.assertTrue(os.path.exists(os.path.join(output, STORE_FILENAME)))
+
+        _, result = self.scan("out", "--resume")
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("different parameters", result.stdout)
+
+        # Resuming with the same setting finishes the store
+        _, result = self.scan("out", "--resume", "--store")
+        self.assertEqual(result.returncode, 0, result.stdout)
+        reference, _ = self.scan("reference", "--store")
+        with open(os.path.join(output, STORE_FILENAME), 'rb') as a, open(os.path.join(reference, STORE_FILENAME), 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_scan_without_store_removes_a_stale_store(self):
+        output, result = self.scan("out", "--store")
+        self.assertEqual(result.returncode, 0, result.stdout)
+        output, result = self.scan("out")
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertFalse(os.path.exists(os.path.join(output, STORE_FILENAME)))
+
+    def test_new_scan_removes_the_chunks_of_a_longer_one(self):
+        output, result = self.scan("out")
+        self.assertEqual(result.returncode, 0, result.stdout)
+        reference, result = self.scan("reference", "--end", 10)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        output, result = self.scan("out", "--end", 10)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertEqual(helpers.output_files(output), helpers.output_files(reference))
+
+if __name__ == "__main__":
+    unittest.main()
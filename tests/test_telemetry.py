@@ -0,0 +1,72 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import helpers
+
+from frame_index import FrameIndex
+
+# Fields of a progress event that server/index.ts reads, and the types it expects
+PROGRESS_FIELDS = {
+    "event": (str,), "stage": (str,), "unit": (str,), "done": (int,), "total": (int, type(None)),
+    "rate": (int, float), "eta_s": (int, float, type(None)), "rows": (int,),
+    "rss_mb": (int, float, type(None)), "encode_ms": (int, float, type(None))
+}
+
+def progress_events(stdout):
+    """
+    The JSON-lines events of a script's stdout, picked out the way the server does.
+    """
+    return [json.loads(line) for line in stdout.splitlines() if line.startswith('{"event"')]
+
+class TelemetryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        cls.video = os.path.join(cls.dir, "synthetic.avi")
+        helpers.make_video(cls.video, frames=600)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def test_scan_events_have_the_fields_the_server_reads(self):
+        for workers in (1, 2):
+            output = os.path.join(self.dir, f"out_{workers}")
+            result = helpers.run_script("slit_scan.py", "--video", self.video, "--output", output, "--y", 40, "--x1", 0, "--x2", 96,
+                                        "--speed", 3, "--chunk-size", 30, "--pyramid-levels", 0, "--workers", workers,
+                                        "--progress", "--progress-interval", 0)
+            self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+            index = FrameIndex.load(output)
+            events = progress_events(result.stdout)
+            self.assertEqual([event["event"] for event in events].count("done"), 1)
+            self.assertEqual(events[-1]["event"], "done")
+
+            last = {}
+            for event in events[:-1]:
+                self.assertEqual(event["event"], "progress")
+                for field, types in PROGRESS_FIELDS.items():
+                    self.assertIsInstance(event.get(field, None), types, f"{field} of {event}")
+                self.assertEqual((event["stage"], event["unit"]), ("scan", "frames"))
+                # A serial scan leaves the shard out, the server counts it as shard 0
+                self.assertEqual("shard" in event, workers > 1)
+                last[event.get("shard", 0)] = event
+            # The last event of every shard is complete, and the shards add up to the whole scan
+            self.assertEqual(sorted(last), list(range(workers)))
+            for event in last.values():
+                self.assertEqual(event["done"], event["total"])
+                self.assertEqual(event["eta_s"], 0)
+                self.assertGreater(event["rate"], 0)
+                self.assertIsNotNone(event["encode_ms"]) # Every shard has encoded chunks by then
+            self.assertEqual(sum(event["total"] for event in last.values()), index.frame_count)
+            self.assertEqual(sum(event["rows"] for event in last.values()), index.row_count)
+
+            done = events[-1]
+            self.assertEqual((done["stage"], done["unit"], done["done"], done["rows"]), ("scan", "frames", index.frame_count, index.row_count))
+            self.assertGreater(done["rate"], 0)
+
+if __name__ == "__main__":
+    unittest.main()